@@ -0,0 +1,48 @@
+"""
+Micro-benchmark of the per-task chain setup cost of `translate_description`.
+
+before: a new chain (and a new ChatOpenAI client) is created for every task
+after:  the chain is taken from the process-local chain registry
+
+No request is sent to OpenAI, so the numbers only cover client construction. The TLS handshakes that a new
+client pays on its first request come on top of the "before" figure.
+
+Usage:
+    python benchmarks/bench_chain_setup.py [tasks]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from modules.chain_registry import clear_chains, get_chain
+from modules.model_config import ModelConfig
+from modules.openai_chain import OpenAIchain
+from modules.translation_prompt import TextTranslationPrompt
+
+
+def per_task_ms(setup, tasks: int) -> float:
+    start = time.perf_counter()
+    for _ in range(tasks):
+        setup()
+    return (time.perf_counter() - start) * 1000 / tasks
+
+
+def main(tasks: int):
+    model_config = ModelConfig(openai_api_key='sk-benchmark')
+    prompt = TextTranslationPrompt().create_prompt()
+
+    before = per_task_ms(lambda: OpenAIchain(prompt, model_config).create_chain(), tasks)
+    clear_chains()
+    after = per_task_ms(lambda: get_chain(prompt, model_config), tasks)
+
+    print(f'tasks: {tasks}')
+    print(f'before (chain per task):      {before:8.3f} ms/task')
+    print(f'after  (chain registry):      {after:8.3f} ms/task')
+    print(f'speedup:                      {before / after:8.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,144 @@
+"""
+Import-time and cold-start benchmark of the API server, against the fake chat completions backend of `fake_llm_server.py`.
+
+For every run, measures in fresh processes
+- the import time of `api.api_wrapper`, what `bootstrapper.py` imports before the server listens,
+  and of `api.job_manager`, imported by the warm-up once the server is up,
+- the time from starting `bootstrapper.py` to the first answer of `/ready`, and to `/ready` answering 200,
+- the time of the first job of the new server and of the next one, from the upload to the translated workbook,
+and the time to read `params.yaml` parsed and cached.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 3] [--rows 20] [--processes 2] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+import httpx
+import pandas as pd
+import yaml
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCHMARKS_DIR, '..', 'src'))
+sys.path.insert(0, SRC_DIR)
+
+from bench_throughput import COLUMN, LANGUAGES, SHEET, make_workbook
+from fake_llm_server import FakeBackendConfig, start_server
+from utils.config_file import ConfigFile
+
+
+def import_seconds(module: str) -> float:
+    """
+    The time to import `module` in a new interpreter
+    """
+    code = f'import sys, time; sys.path.insert(0, {SRC_DIR!r}); start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+    return float(subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout)
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 120) -> float:
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError('The API server did not start')
+        time.sleep(0.02)
+    return time.perf_counter() - start
+
+
+def ready_status(base_url: str):
+    try:
+        return httpx.get(f'{base_url}/ready', timeout=1).status_code
+    except httpx.TransportError:
+        return None
+
+
+def run_job(base_url: str, rows: int) -> float:
+    data = {'sheet_column_pairs': [{'sheet': SHEET, 'columns': [COLUMN]}], 'selected_languages': LANGUAGES}
+    start = time.perf_counter()
+    response = httpx.post(f'{base_url}/translate', files={'file': ('bench.xlsx', make_workbook(rows))},
+                          data={'data': json.dumps(data)}, timeout=60)
+    job_id = response.json()['job_id']
+    while httpx.get(f'{base_url}/jobs/{job_id}').json()['state'] not in ('completed', 'failed', 'cancelled'):
+        time.sleep(0.02)
+    return time.perf_counter() - start
+
+
+def cold_start(directory: str, port: int, rows: int) -> Dict:
+    """
+    Start a new API server in `directory` and time its startup and its first two jobs
+    """
+    base_url = f'http://127.0.0.1:{port}'
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, 'bootstrapper.py'), '127.0.0.1', str(port)], cwd=directory,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(lambda: ready_status(base_url) is not None)
+        listening = time.perf_counter() - start
+        wait_for(lambda: ready_status(base_url) == 200)
+        ready = time.perf_counter() - start
+        first_job = run_job(base_url, rows)
+        next_job = run_job(base_url, rows)
+    finally:
+        server.terminate()
+        server.wait()
+    return {'listening_s': round(listening, 2), 'ready_s': round(ready, 2), 'first_job_s': round(first_job, 2),
+            'next_job_s': round(next_job, 2)}
+
+
+def config_seconds(path: str, repeat: int = 1000) -> Dict:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with open(path, 'r') as f:
+            yaml.safe_load(f)
+    parsed = (time.perf_counter() - start) / repeat
+    config = ConfigFile(path)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        config.load()
+    cached = (time.perf_counter() - start) / repeat
+    return {'config_parse_ms': round(parsed * 1000, 3), 'config_cached_ms': round(cached * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=20, help='rows of the workbook of the timed jobs')
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8799, help='port of the fake backend, the API server uses the next one')
+    parser.add_argument('--latency', type=float, default=0.05, help='median latency of the fake backend in seconds')
+    parser.add_argument('--json', help='file to save the results to')
+    args = parser.parse_args()
+
+    base_url = start_server(FakeBackendConfig(latency=args.latency), args.port)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(BENCHMARKS_DIR, '..', 'params.yaml'), 'r') as f:
+            params = yaml.safe_load(f)
+        params['model']['base_url'] = base_url
+        params['parallel_processing']['num_processes'] = args.processes
+        params['translation_cache']['enabled'] = False
+        with open(os.path.join(directory, 'params.yaml'), 'w') as f:
+            yaml.safe_dump(params, f)
+        with open(os.path.join(directory, 'llm_config.yaml'), 'w') as f:
+            yaml.safe_dump({'openai': {'api_key': 'sk-benchmark'}}, f)
+
+        for run in range(args.runs):
+            results.append({'run': run, 'import_api_wrapper_s': round(import_seconds('api.api_wrapper'), 2),
+                            'import_job_manager_s': round(import_seconds('api.job_manager'), 2),
+                            **cold_start(directory, args.port + 1, args.rows),
+                            **config_seconds(os.path.join(directory, 'params.yaml'))})
+
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
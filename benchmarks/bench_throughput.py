@@ -0,0 +1,197 @@
+"""
+End-to-end throughput benchmark against the fake chat completions backend of `fake_llm_server.py`, without calling OpenAI.
+
+For synthetic workbooks of increasing size, runs
+- `TranslationService` in process mode, with a pool of worker processes, and in async mode,
+- the full `/translate` flow of the API, from the upload to the translated workbook,
+and reports the throughput in cells/s, the p50/p95/p99 latency of the requests as the backend served them,
+the peak RSS of the benchmark process and its worker processes, and the request counts.
+Compare the numbers of two commits with the same arguments to catch regressions, or use the peak RSS to size containers.
+
+Usage:
+    python benchmarks/bench_throughput.py [rows ...] [--latency 0.2] [--sigma 0.5] [--error-rate 0] [--rate-limit-rate 0]
+                                          [--processes 6] [--concurrency 100] [--json results.json]
+"""
+
+import argparse
+from io import BytesIO
+import json
+from multiprocessing import Pool
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List
+
+import httpx
+import pandas as pd
+import psutil
+import yaml
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+from fake_llm_server import FakeBackendConfig, start_server
+from modules.chain_registry import configure_hedging, configure_rate_limiter, init_worker
+from modules.model_config import ModelConfig
+from modules.translation_prompt import TextTranslationPrompt
+from services import TranslationService
+
+LANGUAGES = ['fr', 'de', 'es']
+SHEET = 'skills'
+COLUMN = 'description (to translate)'
+# share of the rows whose text is repeated, like the recurring texts of real catalogues
+DUPLICATE_SHARE = 0.2
+
+
+def make_texts(rows: int) -> List[str]:
+    unique = max(1, int(rows * (1 - DUPLICATE_SHARE)))
+    return [f'Description of skill number {i % unique}. Applies the methods of the field to everyday work.' for i in range(rows)]
+
+
+def make_workbook(rows: int) -> bytes:
+    df = pd.DataFrame({'id': range(rows), COLUMN: make_texts(rows), **{f'{lang} description': [None] * rows for lang in LANGUAGES}})
+    stream = BytesIO()
+    df.to_excel(stream, index=False, sheet_name=SHEET)
+    return stream.getvalue()
+
+
+class PeakRss:
+    """
+    Samples the RSS of this process and of its child processes on a background thread
+    """
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        process = psutil.Process()
+        while not self._stop.is_set():
+            rss = 0
+            for p in [process] + process.children(recursive=True):
+                try:
+                    rss += p.memory_info().rss
+                except psutil.Error:
+                    pass
+            self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def measure(name: str, rows: int, base_url: str, run: Callable[[], None]) -> Dict:
+    stats_url = base_url.rsplit('/v1', 1)[0] + '/stats'
+    httpx.post(stats_url + '/reset')
+    with PeakRss() as rss:
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+    stats = httpx.get(stats_url).json()
+    latencies = stats['latencies']
+    return {
+        'run': name, 'rows': rows, 'seconds': round(elapsed, 2), 'cells_per_s': round(rows / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000), 'p95_ms': round(percentile(latencies, 95) * 1000),
+        'p99_ms': round(percentile(latencies, 99) * 1000), 'peak_rss_mb': round(rss.peak / 1024 / 1024),
+        'requests': stats['requests'], 'errors': stats['errors'], 'rate_limited': stats['rate_limited'],
+        'max_in_flight': stats['max_in_flight'],
+    }
+
+
+def run_process(model_config: ModelConfig, rows: int, processes: int):
+    prompt = TextTranslationPrompt().create_prompt()
+    with Pool(processes, initializer=init_worker, initargs=(prompt, model_config)) as pool:
+        service = TranslationService(processes, model_config, list(enumerate(make_texts(rows))), LANGUAGES)
+        service.translate_apply_sync(pool)
+
+
+def run_async(model_config: ModelConfig, rows: int, concurrency: int):
+    configure_rate_limiter(None)
+    configure_hedging(None)
+    service = TranslationService(1, model_config, list(enumerate(make_texts(rows))), LANGUAGES)
+    service.translate_apply_async(concurrency)
+
+
+def run_api(client, rows: int):
+    data = {'sheet_column_pairs': [{'sheet': SHEET, 'columns': [COLUMN]}], 'selected_languages': LANGUAGES}
+    response = client.post('/translate', files={'file': ('bench.xlsx', make_workbook(rows))}, data={'data': json.dumps(data)})
+    job_id = response.json()['job_id']
+    while client.get(f'/jobs/{job_id}').json()['state'] not in ('completed', 'failed', 'cancelled'):
+        time.sleep(0.1)
+
+
+def api_client(base_url: str, processes: int, directory: str):
+    """
+    A test client of the API, running in `directory` with the settings of `params.yaml` sent to the fake backend
+    """
+    from fastapi.testclient import TestClient
+    from api.api_wrapper import FastAPI_Wrapper
+
+    with open(os.path.join(BENCHMARKS_DIR, '..', 'params.yaml'), 'r') as f:
+        params = yaml.safe_load(f)
+    params['model']['base_url'] = base_url
+    params['parallel_processing']['num_processes'] = processes
+    # measure the requests, not the cache hits of the previous runs
+    params['translation_cache']['enabled'] = False
+    os.chdir(directory)
+    with open('params.yaml', 'w') as f:
+        yaml.safe_dump(params, f)
+    with open('llm_config.yaml', 'w') as f:
+        yaml.safe_dump({'openai': {'api_key': 'sk-benchmark'}}, f)
+    return TestClient(FastAPI_Wrapper())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('rows', type=int, nargs='*', default=[100, 1000, 5000])
+    parser.add_argument('--processes', type=int, default=6)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--json', help='file to save the results to')
+    for name, field in FakeBackendConfig.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(field.default), default=0.2 if name == 'latency' else field.default,
+                            help=field.description)
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    backend = FakeBackendConfig(**{name: getattr(args, name) for name in FakeBackendConfig.model_fields})
+    base_url = start_server(backend, args.port)
+    model_config = ModelConfig(openai_api_key='sk-benchmark', base_url=base_url)
+    print(f'backend: {backend}, processes: {args.processes}, concurrency: {args.concurrency}, languages: {len(LANGUAGES)}')
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        client = api_client(base_url, args.processes, directory)
+        try:
+            for rows in args.rows:
+                results.append(measure('process', rows, base_url, lambda: run_process(model_config, rows, args.processes)))
+                results.append(measure('async', rows, base_url, lambda: run_async(model_config, rows, args.concurrency)))
+                results.append(measure('api', rows, base_url, lambda: run_api(client, rows)))
+        finally:
+            if client.app.job_manager is not None:
+                client.app.job_manager.shutdown()
+            os.chdir(BENCHMARKS_DIR)
+
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.json:
+        with open(json_path, 'w') as f:
+            json.dump({'backend': backend.model_dump(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
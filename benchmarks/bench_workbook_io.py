@@ -0,0 +1,99 @@
+"""
+Benchmark of the Excel work of a job around the LLM calls: reading the source columns and writing the translations.
+
+before: `DataReader.read_excel` parses the whole workbook for every selected sheet, converts every column to str,
+        and every sheet is parsed again and rebuilt with `DataFrame.update` and `to_excel` on write
+after:  `WorkbookSession` parses the workbook once in read-only mode, keeps only the source columns,
+        and patches the target cells while streaming the sheets to a write-only workbook
+
+Peak memory is measured with tracemalloc, so it only covers Python allocations.
+
+Usage:
+    python benchmarks/bench_workbook_io.py [rows]
+"""
+
+from io import BytesIO
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from modules.data_reader import DataReader
+from modules.workbook_session import WorkbookSession
+from utils.utils import convert_to_df
+
+LANGUAGES = ['fr', 'de', 'es']
+SHEETS = ['skills', 'occupations']
+COLUMN = 'description (to translate)'
+
+
+def make_workbook(rows: int) -> bytes:
+    df = pd.DataFrame({
+        'id': range(rows),
+        COLUMN: [f'Description of skill number {i}' for i in range(rows)],
+        **{f'{lang} description': [None] * rows for lang in LANGUAGES},
+        'notes': [f'note {i}' for i in range(rows)],
+        'score': [i * 0.5 for i in range(rows)],
+    })
+    stream = BytesIO()
+    with pd.ExcelWriter(stream) as writer:
+        for sheet in SHEETS:
+            df.to_excel(writer, index=False, sheet_name=sheet)
+    return stream.getvalue()
+
+
+def translations(texts):
+    return [(index, [f'{lang}: {text}' for lang in LANGUAGES]) for index, text in texts.items()]
+
+
+def before(file_content: bytes, path: str):
+    file_stream = BytesIO(file_content)
+    updated = {}
+    for sheet in SHEETS:
+        df = DataReader().read_excel(file_stream, sheet_name=sheet)
+        updated[sheet] = convert_to_df(df, translations(df[COLUMN]), LANGUAGES, 'description')
+    with pd.ExcelWriter(path) as writer:
+        for sheet in SHEETS:
+            file_stream.seek(0)
+            original_df = DataReader().read_excel(file_stream, sheet_name=sheet)
+            original_df.update(updated[sheet])
+            original_df.to_excel(writer, index=False, sheet_name=sheet)
+
+
+def after(file_content: bytes, path: str):
+    workbook = WorkbookSession(file_content)
+    for sheet in SHEETS:
+        texts = workbook.read_columns(sheet, [COLUMN])[COLUMN]
+        workbook.set_translations(sheet, translations(texts), LANGUAGES, 'description')
+    workbook.save(path)
+    workbook.close()
+
+
+def measure(run, file_content: bytes, path: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    run(file_content, path)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main(rows: int):
+    file_content = make_workbook(rows)
+    with tempfile.TemporaryDirectory() as directory:
+        before_s, before_mb = measure(before, file_content, os.path.join(directory, 'before.xlsx'))
+        after_s, after_mb = measure(after, file_content, os.path.join(directory, 'after.xlsx'))
+
+    print(f'rows per sheet: {rows}, sheets: {len(SHEETS)}, languages: {len(LANGUAGES)}')
+    print(f'before (DataReader + to_excel):  {before_s:8.2f} s  peak {before_mb:8.1f} MB')
+    print(f'after  (WorkbookSession):        {after_s:8.2f} s  peak {after_mb:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,227 @@
+"""
+A deterministic stand-in for the OpenAI chat completions endpoint, to measure the pipeline without calling the real API.
+
+Point `model.base_url` in `params.yaml` (or `ModelConfig.base_url`) to `http://127.0.0.1:<port>/v1`.
+Answers only depend on the request: a text translated to `fr` is answered `[fr] <text>`, and the JSON requests
+of packing and multi-language mode get a JSON object of such answers. Latencies are drawn from a log-normal
+distribution, and a share of the requests can be answered with 500 errors or 429s; these draws come from a seeded
+generator, so a run with the same settings and request order is reproducible.
+
+It also implements the files and batches endpoints of the Batch API, so `batch.base_url` can point to it too:
+a batch is answered like the chat completions above, without errors, once `batch_latency` seconds have passed.
+
+`GET /stats` returns the request counters and the latencies, `POST /stats/reset` clears them.
+
+Usage:
+    python benchmarks/fake_llm_server.py [--port 8799] [--latency 0.5] [--sigma 0.5] [--error-rate 0] [--rate-limit-rate 0]
+"""
+
+import argparse
+import asyncio
+import json
+from multiprocessing import Process
+import random
+import re
+import time
+from typing import List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+import httpx
+from pydantic import BaseModel, Field
+import uvicorn
+
+LANGUAGE_PATTERN = re.compile(r'language: (\S+?)\.')
+LANGUAGES_PATTERN = re.compile(r'each of these languages: (\[.*?\])')
+
+
+class FakeBackendConfig(BaseModel):
+    latency: float = Field(default=0.5, description='median latency of a request in seconds')
+    sigma: float = Field(default=0.5, description='sigma of the log-normal latency distribution, 0 for a fixed latency')
+    error_rate: float = Field(default=0.0, description='share of the requests answered with a 500 error')
+    rate_limit_rate: float = Field(default=0.0, description='share of the requests answered with a 429')
+    retry_after: float = Field(default=1.0, description='retry-after seconds of the 429s')
+    seed: int = Field(default=0, description='seed of the latency and error draws')
+    batch_latency: float = Field(default=0.0, description='seconds a batch takes to complete')
+
+
+def translate(text: str, language: str) -> str:
+    return f'[{language}] {text.strip()}'
+
+
+def answer(messages: List[dict], json_mode: bool) -> str:
+    """
+    The deterministic answer to the messages of a translation prompt
+    """
+    system = ' '.join(message['content'] for message in messages if message['role'] == 'system')
+    text = messages[-1]['content'].strip()
+    languages = LANGUAGES_PATTERN.search(system)
+    if languages:
+        return json.dumps({language: translate(text, language) for language in json.loads(languages.group(1))}, ensure_ascii=False)
+    language = LANGUAGE_PATTERN.search(system)
+    language = language.group(1) if language else 'xx'
+    if json_mode:
+        return json.dumps({key: translate(value, language) for key, value in json.loads(text).items()}, ensure_ascii=False)
+    return translate(text, language)
+
+
+def completion(model: str, content: str, prompt_tokens: int) -> dict:
+    return {
+        'id': f'chatcmpl-fake-{random.getrandbits(32):08x}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop', 'logprobs': None}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content) // 4,
+                  'total_tokens': prompt_tokens + len(content) // 4},
+    }
+
+
+def batch_output(content: bytes) -> bytes:
+    """
+    The output file of a batch: the answer of every request of the input file, under its custom id
+    """
+    lines = []
+    for line in content.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        body = request['body']
+        json_mode = (body.get('response_format') or {}).get('type') == 'json_object'
+        content = answer(body['messages'], json_mode)
+        prompt_tokens = sum(len(message['content']) for message in body['messages']) // 4
+        lines.append(json.dumps({'id': f"batch_req_{request['custom_id']}", 'custom_id': request['custom_id'],
+                                 'response': {'status_code': 200, 'request_id': request['custom_id'],
+                                              'body': completion(body.get('model', 'fake'), content, prompt_tokens)},
+                                 'error': None}, ensure_ascii=False))
+    return '\n'.join(lines).encode('utf-8')
+
+
+def create_app(config: FakeBackendConfig) -> FastAPI:
+    app = FastAPI()
+    draws = random.Random(config.seed)
+    stats = {'requests': 0, 'completed': 0, 'errors': 0, 'rate_limited': 0, 'in_flight': 0, 'max_in_flight': 0, 'latencies': [],
+             'batches': 0}
+    files = {}
+    batches = {}
+    # time at which every batch completes
+    ready_at = {}
+
+    @app.post('/v1/chat/completions')
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats['requests'] += 1
+        draw = draws.random()
+        latency = config.latency * draws.lognormvariate(0, config.sigma) if config.sigma else config.latency
+        if draw < config.rate_limit_rate:
+            stats['rate_limited'] += 1
+            return JSONResponse({'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                                status_code=429, headers={'retry-after': str(config.retry_after)})
+        start = time.monotonic()
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            stats['in_flight'] -= 1
+        if draw < config.rate_limit_rate + config.error_rate:
+            stats['errors'] += 1
+            return JSONResponse({'error': {'message': 'Injected error', 'type': 'server_error'}}, status_code=500)
+        json_mode = (body.get('response_format') or {}).get('type') == 'json_object'
+        content = answer(body['messages'], json_mode)
+        stats['completed'] += 1
+        stats['latencies'].append(time.monotonic() - start)
+        prompt_tokens = sum(len(message['content']) for message in body['messages']) // 4
+        return completion(body.get('model', 'fake'), content, prompt_tokens)
+
+    def store(filename: str, purpose: str, content: bytes) -> dict:
+        file_id = f'file-fake-{len(files)}'
+        files[file_id] = {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                          'filename': filename, 'purpose': purpose, 'status': 'processed', 'content': content}
+        return {key: value for key, value in files[file_id].items() if key != 'content'}
+
+    @app.post('/v1/files')
+    async def create_file(file: UploadFile = File(...), purpose: str = Form(...)):
+        return store(file.filename, purpose, await file.read())
+
+    @app.get('/v1/files/{file_id}/content')
+    def file_content(file_id: str):
+        if file_id not in files:
+            raise HTTPException(status_code=404, detail=f'No file {file_id}')
+        return Response(files[file_id]['content'], media_type='application/octet-stream')
+
+    def batch_state(batch_id: str) -> dict:
+        if batch_id not in batches:
+            raise HTTPException(status_code=404, detail=f'No batch {batch_id}')
+        batch = batches[batch_id]
+        if batch['status'] == 'in_progress' and time.time() >= ready_at[batch_id]:
+            output = store(f'{batch_id}_output.jsonl', 'batch_output', batch_output(files[batch['input_file_id']]['content']))
+            batch.update({'status': 'completed', 'output_file_id': output['id'], 'completed_at': int(time.time())})
+        return batch
+
+    @app.post('/v1/batches')
+    async def create_batch(request: Request):
+        body = await request.json()
+        if body['input_file_id'] not in files:
+            raise HTTPException(status_code=404, detail=f"No file {body['input_file_id']}")
+        stats['batches'] += 1
+        batch_id = f'batch-fake-{len(batches)}'
+        ready_at[batch_id] = time.time() + config.batch_latency
+        batches[batch_id] = {'id': batch_id, 'object': 'batch', 'endpoint': body['endpoint'], 'input_file_id': body['input_file_id'],
+                             'completion_window': body['completion_window'], 'status': 'in_progress', 'created_at': int(time.time()),
+                             'output_file_id': None, 'error_file_id': None}
+        return batch_state(batch_id)
+
+    @app.get('/v1/batches/{batch_id}')
+    def get_batch(batch_id: str):
+        return batch_state(batch_id)
+
+    @app.post('/v1/batches/{batch_id}/cancel')
+    def cancel_batch(batch_id: str):
+        batch = batch_state(batch_id)
+        if batch['status'] == 'in_progress':
+            batch['status'] = 'cancelled'
+        return batch
+
+    @app.get('/stats')
+    def get_stats():
+        return stats
+
+    @app.post('/stats/reset')
+    def reset_stats():
+        stats.update({'requests': 0, 'completed': 0, 'errors': 0, 'rate_limited': 0, 'max_in_flight': 0, 'latencies': [], 'batches': 0})
+        return stats
+
+    return app
+
+
+def serve(config: FakeBackendConfig, port: int):
+    uvicorn.run(create_app(config), host='127.0.0.1', port=port, log_level='warning')
+
+
+def start_server(config: Optional[FakeBackendConfig] = None, port: int = 8799) -> str:
+    """
+    Run the fake backend in a background process, so that it does not compete with the measured code
+    for the GIL. Returns its base url.
+    """
+    Process(target=serve, args=(config or FakeBackendConfig(), port), daemon=True, name='fake_llm_server').start()
+    while True:
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/stats')
+            return f'http://127.0.0.1:{port}/v1'
+        except httpx.TransportError:
+            time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8799)
+    for name, field in FakeBackendConfig.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(field.default), default=field.default, help=field.description)
+    args = parser.parse_args()
+    config = FakeBackendConfig(**{name: getattr(args, name) for name in FakeBackendConfig.model_fields})
+    serve(config, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,34 +3,38 @@
 Contains the main `FastAPI_Wrapper` class, which wraps `FastAPI`.
 """
 
-from collections import defaultdict
-from io import BytesIO
+import asyncio
 import json
-from multiprocessing import Pool
 import os
 import psutil
+import shutil
 import time
 import threading
 
 from fastapi import FastAPI
-from fastapi import File, UploadFile, Form, HTTPException
+from fastapi import File, UploadFile, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-import yaml
-
-from modules.model_config import ModelConfig
-from modules.data_reader import DataReader
-from services import TranslationService
-from utils.utils import convert_to_df
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
+from modules.translation_cache import TranslationCache
+from utils.config_file import ConfigFile
 from utils.logger import setup_logger
 
-global completed
-completed = False
-
 logger = setup_logger(__name__)
 
 CORS_ALLOW_ORIGINS=['http://localhost', 'http://localhost:5000', 'http://localhost:8765', 'http://127.0.0.1:5000']
+# minimum seconds between two progress events of a job stream, the results in between are sent together
+PROGRESS_EVENT_INTERVAL = 0.5
+# seconds after which a job stream sends its progress again when nothing changed, so that proxies keep it open
+PROGRESS_HEARTBEAT = 15
+MEDIA_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'jsonl': 'application/jsonl',
+}
+# bytes copied at a time when an upload is spooled to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 class FastAPI_Wrapper(FastAPI):
 
@@ -42,6 +46,16 @@ class FastAPI_Wrapper(FastAPI):
         
         super().__init__()
 
+        self.translation_cache = None
+        self.job_manager = None
+        self.metadata_cache = None
+        # parsed again only when the files change, so that settings can be edited without restarting the API
+        self.params_file = ConfigFile('params.yaml')
+        self.llm_config_file = ConfigFile('llm_config.yaml')
+        self._config_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._startup_error = None
+
         origins = CORS_ALLOW_ORIGINS
 
         self.add_middleware(
@@ -58,8 +72,8 @@ class FastAPI_Wrapper(FastAPI):
 
             def suicide():
                 time.sleep(1)
-                pool.terminate()
-                pool.join()
+                if self.job_manager is not None:
+                    self.job_manager.shutdown()
                 myself = psutil.Process(os.getpid())
                 myself.kill()
 
@@ -67,22 +81,99 @@ class FastAPI_Wrapper(FastAPI):
             logger.info(f'>>> Successfully killed API <<<')
             return {"success": True}  
 
+        def load_config():
+            """
+            Read the settings and create the translation cache and the job manager on first use
+            """
+            # pandas, langchain and openai are imported with the job manager, after the server is up
+            from api.job_manager import JobManager
+
+            params = self.params_file.load()
+            llm_config = self.llm_config_file.load()
+
+            with self._config_lock:
+                cache_params = params.get('translation_cache', {})
+                if not cache_params.get('enabled'):
+                    self.translation_cache = None
+                elif self.translation_cache is None or self.translation_cache.path != cache_params['path']:
+                    self.translation_cache = TranslationCache(path=cache_params['path'], max_size_mb=cache_params['max_size_mb'])
+
+                if self.job_manager is None:
+                    self.job_manager = JobManager(max_concurrent_jobs=params['parallel_processing'].get('max_concurrent_jobs', 2))
+            return params, llm_config
+
+        def warm_up():
+            """
+            Import the translation modules, read the settings and start the worker processes before the first job comes in
+            """
+            from api.job_manager import JobSettings
+
+            try:
+                params, llm_config = load_config()
+                self.job_manager.warm_up(JobSettings.from_params(params, llm_config))
+            except Exception as e:
+                logger.error(f'API warm-up failed: {e}')
+                self._startup_error = str(e)
+                return
+            self._ready.set()
+            logger.info('API ready')
+
+        # the server accepts requests, e.g. on /ready, while it warms up
+        self.add_event_handler("startup", lambda: threading.Thread(target=warm_up, daemon=True, name='warm_up').start())
+
+        @self.get("/ready")
+        def ready():
+            """
+            Readiness probe: 200 once the API is warmed up and takes jobs without delay, 503 before
+            """
+            if self._ready.is_set():
+                return {"ready": True}
+            return JSONResponse(status_code=503, content={"ready": False, "error": self._startup_error})
+
+        async def spool(upload: UploadFile, file_format: str) -> str:
+            """
+            Copy an upload to a temporary file in chunks, on a worker thread, instead of reading it into memory
+            """
+            path = self.job_manager.spool_path(file_format)
+
+            def copy():
+                upload.file.seek(0)
+                with open(path, 'wb') as f:
+                    shutil.copyfileobj(upload.file, f, UPLOAD_CHUNK_SIZE)
+
+            try:
+                await run_in_threadpool(copy)
+            except Exception:
+                os.remove(path)
+                raise
+            return path
+
         @self.post("/translate")
-        async def translate(file: UploadFile = File(...), data: str = Form(...)):
+        async def translate(file: UploadFile = File(...), data: str = Form(...), previous_file: UploadFile = File(None)):
+            """
+            Queue a translation job. With the `previous_file` output of an earlier version of the file, or the
+            `baseline_job_id` of the job that translated it, only the rows whose source text changed are translated.
+            """
+            from api.job_manager import JobSettings
+            from modules.streaming_io import file_format
+
+            try:
+                input_format = file_format(file.filename)
+                if previous_file is not None and file_format(previous_file.filename) != input_format:
+                    raise ValueError(f"The previous file must be a {input_format} file like the uploaded file")
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            spooled = []
             try:
-                file_content = await file.read()
-                with open('params.yaml', 'r') as f:
-                    params = yaml.safe_load(f)
-                num_processes = params['parallel_processing']['num_processes']
-
-                with open('llm_config.yaml', 'r') as f:
-                    llm_config = yaml.safe_load(f)
-                api_key = llm_config['openai']['api_key']
-                model_config = ModelConfig(openai_api_key=api_key, 
-                                        llm_model_name=params["model"]["model_name"],
-                                        temperature=params["model"]["temperature"])
-
-                file_stream = BytesIO(file_content)
+                params, llm_config = load_config()
+                upload_path = await spool(file, input_format)
+                spooled.append(upload_path)
+                previous_path = None
+                if previous_file is not None:
+                    previous_path = await spool(previous_file, input_format)
+                    spooled.append(previous_path)
+                settings = JobSettings.from_params(params, llm_config)
+
                 data_dict = json.loads(data)
                 sheet_column_pairs = data_dict["sheet_column_pairs"]
                 selected_languages = data_dict["selected_languages"]
@@ -90,57 +181,157 @@ class FastAPI_Wrapper(FastAPI):
                 if sheet_column_pairs is None:
                     raise HTTPException(status_code=400, detail="sheet_column_pairs not provided")
 
-                df_sheet = defaultdict(list)
-                output_dir = "translated_files"
-                os.makedirs(output_dir, exist_ok=True)
-
-                global pool
-                pool = Pool(num_processes)
-
-                final_output_path = os.path.join(output_dir, f'translated_combined.xlsx')
-                def translate_runner():
-                    for pair in sheet_column_pairs:
-                        sheet = pair.get("sheet")
-                        columns = pair.get("columns")
-                        df = DataReader().read_excel(file_stream, sheet_name=sheet)
-                        for column in columns:
-                            text_index_pairs = list(zip(df.index.tolist(), df[column].tolist()))
-
-                            logger.info(f'translating sheet {sheet} column {column}...')
-                            sheet_results = TranslationService(num_processes, model_config, text_index_pairs, selected_languages).translate_apply_sync(pool)
-
-                            updated_df = convert_to_df(df, sheet_results, selected_languages, ('name' if 'name' in column else 'description'))
-
-                            logger.info(f'translated sheet {sheet} column {column}')
-                            df_sheet[sheet].append(updated_df)
-                    
-                    pool.close()
-                    pool.join()
-                    # Combine all the translated DataFrames and save to a single Excel file
-                    
-                    with pd.ExcelWriter(final_output_path) as writer:
-                        for sheet_name, dfs in df_sheet.items():
-                            logger.info(f"Processing sheet: {sheet_name}")
-                            # Read the original DataFrame from the file stream once
-                            file_stream.seek(0)  # Reset the file stream pointer to the beginning
-                            original_df = DataReader().read_excel(file_stream, sheet_name=sheet_name)
-                            for updated_df in dfs:
-                                original_df.update(updated_df)            
-                            original_df.to_excel(writer, index=False, sheet_name=sheet_name)
-
-                    global completed
-                    completed = True
-
-                threading.Thread(target=translate_runner, daemon=True).start()
-
-                return {"status": "success", "file_path": final_output_path}
+                try:
+                    job = self.job_manager.submit(upload_path, sheet_column_pairs, selected_languages, settings, self.translation_cache,
+                                                  file_format=input_format, previous_content=previous_path,
+                                                  baseline_job_id=data_dict.get("baseline_job_id"))
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+
+                return {"status": "success", "job_id": job.id, "file_path": job.output_path}
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
-            
+            finally:
+                # the spooled uploads are moved to the job directory, unless the job was not queued
+                for path in spooled:
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        @self.get("/jobs/{job_id}/download")
+        def download(job_id: str, request: Request):
+            """
+            Stream the translated file of a completed job. Supports `Range` requests to resume a download
+            and `If-None-Match` with the `ETag` of a previous download.
+            """
+            from api.file_download import file_response
+            from modules.streaming_io import file_format
+
+            # creates the job manager, whose output directory also has the jobs of previous API processes
+            load_config()
+            path = self.job_manager.result_path(job_id)
+            if path is None:
+                raise HTTPException(status_code=404, detail=f"job {job_id} has no translated file")
+            return file_response(path, request, MEDIA_TYPES[file_format(path)])
+
+        @self.post("/workbook/metadata")
+        def workbook_metadata(file: UploadFile = File(...)):
+            """
+            The sheets of a workbook with their number of rows, the columns to translate and the target languages,
+            read from the header rows. A workbook with the same content hash as a previous upload is not parsed again.
+            """
+            from modules.workbook_metadata import MetadataCache
+
+            with self._config_lock:
+                if self.metadata_cache is None:
+                    self.metadata_cache = MetadataCache()
+            try:
+                return self.metadata_cache.metadata(file.file)
+            except FileNotFoundError as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
         @self.get("/completed")
-        def completed():
-            global completed
-            # Check if the translation process is completed using a global variable that you can get from the main thread
-            return {"completed": completed}
+        def completed(job_id: str = None):
+            # Without a job id, the translation is completed when every job is finished
+            jobs = list(self.job_manager.jobs.values()) if self.job_manager is not None else []
+            if job_id is not None:
+                jobs = [job for job in jobs if job.id == job_id]
+            return {"completed": bool(jobs) and all(job.finished for job in jobs)}
+
+        @self.get("/jobs")
+        def list_jobs():
+            jobs = self.job_manager.jobs.values() if self.job_manager is not None else []
+            return [job.to_dict() for job in jobs]
+
+        @self.get("/jobs/{job_id}")
+        def get_job(job_id: str):
+            job = self.job_manager.get(job_id) if self.job_manager is not None else None
+            if job is None:
+                raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+            return {**job.to_dict(), 'progress': job.progress.snapshot()}
+
+        @self.get("/jobs/{job_id}/events")
+        async def job_events(job_id: str, request: Request):
+            """
+            Server-Sent Events stream of the progress of a job: a `progress` event whenever units finish, with the counts
+            per sheet, column and language, the throughput and the ETA, and an `end` event once the job is finished
+            """
+            job = self.job_manager.get(job_id) if self.job_manager is not None else None
+            if job is None:
+                raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+
+            async def events():
+                changed = job.progress.subscribe()
+                try:
+                    while True:
+                        changed.clear()
+                        progress = {**job.to_dict(), 'progress': job.progress.snapshot()}
+                        yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+                        if job.finished:
+                            yield f"event: end\ndata: {json.dumps({'state': job.state.value})}\n\n"
+                            return
+                        try:
+                            await asyncio.wait_for(changed.wait(), PROGRESS_HEARTBEAT)
+                        except asyncio.TimeoutError:
+                            pass
+                        if await request.is_disconnected():
+                            return
+                        await asyncio.sleep(PROGRESS_EVENT_INTERVAL)
+                finally:
+                    job.progress.unsubscribe(changed)
+
+            return StreamingResponse(events(), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        @self.delete("/jobs/{job_id}")
+        def delete_job(job_id: str):
+            """
+            Cancel a queued or running job, or delete a finished job and its output files
+            """
+            job = self.job_manager.cancel(job_id) if self.job_manager is not None else None
+            if job is None:
+                raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+            return job.to_dict()
+
+        @self.post("/jobs/{job_id}/resume")
+        def resume_job(job_id: str):
+            """
+            Resume a failed, cancelled or interrupted job from its checkpoint journal, also after a restart of the API
+            """
+            _, llm_config = load_config()
+            try:
+                job = self.job_manager.resume(job_id, llm_config['openai']['api_key'], self.translation_cache)
+            except ValueError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            if job is None:
+                raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+            return job.to_dict()
+
+        @self.get("/cache/stats")
+        def cache_stats():
+            if self.translation_cache is None:
+                return {"enabled": False}
+            return {"enabled": True, **self.translation_cache.stats()}
+
+        @self.delete("/cache")
+        def invalidate_cache(model_name: str = None, prompt_version: str = None):
+            if self.translation_cache is None:
+                raise HTTPException(status_code=404, detail="translation cache is not enabled")
+            deleted = self.translation_cache.invalidate(model_name=model_name, prompt_version=prompt_version)
+            return {"deleted": deleted}
+
+        @self.get("/metrics")
+        def get_metrics():
+            """
+            Metrics of the API and of its worker processes in the Prometheus text format
+            """
+            from modules import metrics
 
+            # the counters of the jobs the manager still keeps, the deleted jobs drop out
+            metrics.JOB_PROGRESS.clear()
+            jobs = list(self.job_manager.jobs.values()) if self.job_manager is not None else []
+            for job in jobs:
+                for counter, value in job.to_dict()['counters'].items():
+                    metrics.JOB_PROGRESS.set(value, job_id=job.id, counter=counter)
+            return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
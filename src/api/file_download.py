@@ -0,0 +1,96 @@
+"""
+Download of the output files of the jobs, streamed from disk with HTTP Range and ETag support
+so that clients can resume an interrupted download and revalidate a file they already have
+"""
+
+from email.utils import formatdate
+import os
+import re
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# bytes read from the file per chunk of the response body
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def etag(stat: os.stat_result) -> str:
+    """
+    A strong validator of the file version, changed whenever the file is written again
+    """
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    The first and last byte of a single `bytes=` range, None when the range cannot be satisfied.
+    Several ranges are not supported, the first one is served.
+    """
+    match = _RANGE.match(header.split(',')[0].strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # suffix range: the last bytes of the file
+        length = int(last)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        return None
+    return first, last
+
+
+def _read(path: str, first: int, last: int) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(path: str, request: Request, media_type: str = 'application/octet-stream') -> Response:
+    """
+    Stream a file: 304 when the `If-None-Match` ETag is current, 206 with the requested bytes for a `Range` request
+    whose `If-Range` validator is still current, 416 when the range is outside the file, else 200 with the whole file
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    headers = {
+        'ETag': etag(stat),
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename="{os.path.basename(path)}"',
+    }
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None and {'*', headers['ETag']} & {tag.strip() for tag in if_none_match.split(',')}:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    # a Range request for another version of the file gets the whole file
+    if range_header is not None and if_range in (None, headers['ETag'], headers['Last-Modified']):
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+        first, last = byte_range
+        headers['Content-Range'] = f'bytes {first}-{last}/{size}'
+        headers['Content-Length'] = str(last - first + 1)
+        logger.info(f'Sending bytes {first}-{last} of {path}')
+        return StreamingResponse(_read(path, first, last), status_code=206, media_type=media_type, headers=headers)
+
+    headers['Content-Length'] = str(size)
+    return StreamingResponse(_read(path, 0, size - 1), media_type=media_type, headers=headers)
@@ -0,0 +1,696 @@
+"""
+Runs the translation jobs of the API. Every job has its own id, output directory, state, counters and cancellation,
+and all the jobs share a bounded number of job threads and one process pool.
+The upload, the settings and a checkpoint journal of every job are kept in its output directory, so that an
+interrupted job can be resumed, also by a new API process.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from enum import Enum
+import json
+from multiprocessing import Pool, Queue
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+import uuid
+
+import pandas as pd
+from pydantic import BaseModel, Field
+
+from api.job_progress import JobProgress
+from modules import metrics, tracing
+from modules.batch_client import BatchClient, BatchConfig, OpenAIBatchClient
+from modules.cell_filter import SKIPPED_CATEGORIES
+from modules.chain_registry import configure_hedging, configure_rate_limiter, get_hedger, get_rate_limiter, init_worker
+from modules.checkpoint_journal import CheckpointJournal
+from modules.data_reader import DataReader
+from modules.hedging import HedgingConfig
+from modules.model_config import ModelConfig
+from modules.rate_limiter import RateLimitConfig
+from modules.row_diff import UNCHANGED, Baseline, Fingerprint
+from modules.streaming_io import ChunkWriter, prefetch, read_chunks, read_header, set_chunk_translations, target_columns
+from modules.text_packer import PackingConfig
+from modules.text_segmenter import TextSegmenter
+from modules.translation_cache import TranslationCache
+from modules.translation_plan import TranslationPlan
+from modules.translation_prompt import MultiLanguageTextTranslationPrompt, PackedTextTranslationPrompt, TextTranslationPrompt
+from modules.workbook_session import WorkbookSession
+from services import TranslationService
+from utils.logger import setup_logger
+from utils.utils import cell_text, is_empty_cell
+
+logger = setup_logger(__name__)
+
+OUTPUT_DIR = 'translated_files'
+# name of the translated file in the directory of a job, with the extension of its format
+OUTPUT_NAME = 'translated_combined'
+# Number of chunks of a streamed job that are translated at the same time
+CHUNKS_IN_FLIGHT = 2
+# rows per chunk of the CSV and JSON lines inputs in batch mode, i.e. the whole file
+BATCH_CHUNK_SIZE = sys.maxsize
+# job ids are uuid4 hex strings, also the names of their directories
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+def is_job_id(job_id: str) -> bool:
+    """
+    Whether `job_id` has the form of a job id, so that it names a directory inside the output directory
+    """
+    return JOB_ID_PATTERN.fullmatch(job_id) is not None
+
+
+def _target_pattern(column: str) -> str:
+    """
+    The target columns of a source column are named `{language_code} {pattern}`
+    """
+    return 'name' if 'name' in column else 'description'
+
+
+class JobSettings(BaseModel):
+    model: ModelConfig = Field(description='openai model settings')
+    num_processes: int = Field(default=6, description='number of worker processes in process mode')
+    execution_mode: str = Field(default='process', description='process, async or batch')
+    concurrency: int = Field(default=6, description='maximum number of requests in flight in async mode')
+    batch: Optional[BatchConfig] = Field(default=None, description='batch API settings, None unless in batch mode')
+    rate_limit: Optional[RateLimitConfig] = Field(default=None, description='rate limiter settings, None when disabled')
+    hedging: Optional[HedgingConfig] = Field(default=None, description='hedged requests settings, None when disabled')
+    packing: Optional[PackingConfig] = Field(default=None, description='packing settings, None when disabled')
+    languages_per_request: Optional[int] = Field(default=None, description='languages per multi-language request, None when disabled')
+    max_segment_tokens: Optional[int] = Field(default=None, description='texts over this number of tokens are split into segments, None when disabled')
+    streaming: bool = Field(default=False, description='stream Excel inputs in chunks of rows, CSV and JSON lines inputs are always streamed')
+    chunk_size: int = Field(default=1000, description='number of rows per chunk of a streamed input')
+    pre_filter: bool = Field(default=True, description='resolve the cells that need no translation locally')
+    tracing: bool = Field(default=False, description='save the spans of the job to a Chrome trace-event file')
+    profile: bool = Field(default=False, description='profile the job and its worker processes with cProfile, implies tracing')
+
+    @classmethod
+    def from_params(cls, params: dict, llm_config: dict) -> 'JobSettings':
+        """
+        Build the settings of a job from `params.yaml` and `llm_config.yaml`
+        """
+        parallel_processing = params['parallel_processing']
+        num_processes = parallel_processing['num_processes']
+        execution_mode = parallel_processing.get('mode', 'process')
+        concurrency = parallel_processing.get('concurrency', num_processes)
+
+        rate_limit_params = parallel_processing.get('rate_limit', {})
+        rate_limit = None
+        if rate_limit_params.get('enabled'):
+            rate_limit = RateLimitConfig(requests_per_minute=rate_limit_params['requests_per_minute'],
+                                         tokens_per_minute=rate_limit_params['tokens_per_minute'],
+                                         max_concurrency=concurrency if execution_mode == 'async' else rate_limit_params['max_concurrency'],
+                                         min_concurrency=rate_limit_params['min_concurrency'])
+
+        hedging_params = params.get('hedging', {})
+        hedging = None
+        if hedging_params.get('enabled'):
+            hedging = HedgingConfig(percentile=hedging_params['percentile'], max_hedge_ratio=hedging_params['max_hedge_ratio'],
+                                    min_samples=hedging_params['min_samples'], min_delay=hedging_params['min_delay'])
+
+        batch = None
+        if execution_mode == 'batch':
+            batch = BatchConfig(**params.get('batch', {}))
+
+        packing_params = params.get('packing', {})
+        packing = None
+        # batches hold one request per text and language
+        if packing_params.get('enabled') and execution_mode != 'batch':
+            packing = PackingConfig(max_pack_tokens=packing_params['max_pack_tokens'], max_pack_items=packing_params['max_pack_items'])
+
+        multi_language_params = params.get('multi_language', {})
+        languages_per_request = None
+        if multi_language_params.get('enabled') and execution_mode != 'batch':
+            languages_per_request = multi_language_params['languages_per_request']
+
+        segmentation_params = params.get('segmentation', {})
+        max_segment_tokens = segmentation_params['max_segment_tokens'] if segmentation_params.get('enabled') else None
+
+        streaming_params = params.get('streaming', {})
+        streaming = streaming_params.get('enabled', False)
+        chunk_size = streaming_params.get('chunk_size', 1000)
+        if execution_mode == 'batch':
+            # every chunk would be a batch of its own, waiting up to the completion window before the next chunks
+            # are submitted, so the whole file is one chunk and all its batches are submitted and polled together
+            streaming, chunk_size = False, BATCH_CHUNK_SIZE
+
+        # the environment variables turn tracing and profiling on without editing params.yaml
+        tracing_params = params.get('tracing', {})
+        profile = tracing_params.get('profile', False) or os.environ.get('TRANSLATION_PROFILE', '0') != '0'
+        trace = tracing_params.get('enabled', False) or os.environ.get('TRANSLATION_TRACE', '0') != '0' or profile
+
+        model_config = ModelConfig(openai_api_key=llm_config['openai']['api_key'],
+                                   llm_model_name=params["model"]["model_name"],
+                                   temperature=params["model"]["temperature"],
+                                   base_url=params["model"].get("base_url"))
+        return cls(model=model_config, num_processes=num_processes, execution_mode=execution_mode, concurrency=concurrency,
+                   batch=batch, rate_limit=rate_limit, hedging=hedging, packing=packing, languages_per_request=languages_per_request,
+                   max_segment_tokens=max_segment_tokens,
+                   streaming=streaming, chunk_size=chunk_size,
+                   pre_filter=params.get('pre_filter', {}).get('enabled', True), tracing=trace, profile=profile)
+
+    def worker_prompt(self):
+        if self.packing:
+            return PackedTextTranslationPrompt().create_prompt()
+        if self.languages_per_request:
+            return MultiLanguageTextTranslationPrompt().create_prompt()
+        return TextTranslationPrompt().create_prompt()
+
+    def segmenter(self) -> Optional[TextSegmenter]:
+        if not self.max_segment_tokens:
+            return None
+        return TextSegmenter(self.max_segment_tokens, self.model.llm_model_name)
+
+    @property
+    def json_mode(self) -> bool:
+        return bool(self.packing or self.languages_per_request)
+
+    def to_saved(self) -> dict:
+        """
+        The settings to save with a job, without the api key
+        """
+        return self.model_dump(exclude={'model': {'openai_api_key'}})
+
+    @classmethod
+    def from_saved(cls, saved: dict, openai_api_key: str) -> 'JobSettings':
+        return cls.model_validate({**saved, 'model': {**saved['model'], 'openai_api_key': openai_api_key}})
+
+
+class JobState(str, Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+
+class TranslationJob:
+    """
+    A translation of the selected sheets and columns of an uploaded workbook, or of the selected columns of a CSV or JSON lines file
+    """
+    def __init__(self, file_content: Union[bytes, str, None], sheet_column_pairs: List[dict], selected_languages: List[str],
+                 settings: JobSettings, cache: Optional[TranslationCache] = None, output_dir: str = OUTPUT_DIR,
+                 job_id: Optional[str] = None, file_format: str = 'xlsx', previous_content: Union[bytes, str, None] = None,
+                 baseline_job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        # the uploaded files, or the paths of the temporary files they were spooled to
+        self.file_content = file_content
+        self.previous_content = previous_content
+        self.baseline_job_id = baseline_job_id
+        self.file_format = file_format
+        self.sheet_column_pairs = sheet_column_pairs
+        self.selected_languages = selected_languages
+        self.settings = settings
+        self.cache = cache
+        self.output_dir = os.path.join(output_dir, self.id)
+        self.output_path = os.path.join(self.output_dir, f'{OUTPUT_NAME}.{file_format}')
+        self.failures_path = os.path.join(self.output_dir, 'failed_translations.json')
+        self.input_path = os.path.join(self.output_dir, f'input.{file_format}')
+        self.job_path = os.path.join(self.output_dir, 'job.json')
+        self.journal_path = os.path.join(self.output_dir, 'checkpoint.jsonl')
+        # source hashes of the translated rows, the baseline of the next version of the file
+        self.fingerprint_path = os.path.join(self.output_dir, 'fingerprint.json')
+        # a previous output of the file, or the fingerprint of a previous job, to only translate the rows that changed
+        self.previous_path = os.path.join(self.output_dir, f'previous.{file_format}')
+        self.baseline_path = os.path.join(self.output_dir, 'baseline_fingerprint.json')
+        self.trace_path = os.path.join(self.output_dir, 'trace.json')
+        self.profile_path = os.path.join(self.output_dir, 'profile.prof')
+        self.state = JobState.QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.counters = {'total_cells': 0, 'unique_texts': 0, 'units_done': 0, 'translations_done': 0, 'translations_failed': 0,
+                         **{f'skipped_{category}': 0 for category in (*SKIPPED_CATEGORIES, UNCHANGED)}}
+        self.cancel_event = threading.Event()
+        self.progress = JobProgress(selected_languages)
+        self.batch_client: Optional[BatchClient] = None
+        # the chunks of a streamed job are translated on several threads
+        self._counters_lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (JobState.COMPLETED, JobState.FAILED, JobState.CANCELLED)
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.id,
+            'state': self.state.value,
+            'file_path': self.output_path,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'counters': dict(self.counters),
+        }
+
+    @property
+    def streamed(self) -> bool:
+        return self.file_format != 'xlsx' or self.settings.streaming
+
+    def save(self):
+        """
+        Save the upload and the request of the job to its output directory, to be able to resume it.
+        The upload is read from there when the job runs, so it is not kept in memory while the job waits.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._store(self.file_content, self.input_path)
+        self.file_content = None
+        if self.previous_content is not None:
+            self._store(self.previous_content, self.previous_path)
+            self.previous_content = None
+        if self.baseline_job_id is not None:
+            shutil.copyfile(os.path.join(os.path.dirname(self.output_dir), self.baseline_job_id, 'fingerprint.json'), self.baseline_path)
+        with open(self.job_path, 'w') as f:
+            json.dump({'job_id': self.id, 'created_at': self.created_at, 'file_format': self.file_format,
+                       'sheet_column_pairs': self.sheet_column_pairs, 'selected_languages': self.selected_languages,
+                       'baseline_job_id': self.baseline_job_id, 'settings': self.settings.to_saved()}, f, indent=2)
+
+    @staticmethod
+    def _store(content: Union[bytes, str], path: str):
+        if isinstance(content, str):
+            # a spooled upload is moved, not copied
+            shutil.move(content, path)
+            return
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    @classmethod
+    def load(cls, job_id: str, openai_api_key: str, cache: Optional[TranslationCache] = None,
+             output_dir: str = OUTPUT_DIR) -> Optional['TranslationJob']:
+        """
+        Load a saved job to resume it. It keeps the settings it was started with, so that the completed translations
+        and the new ones come from the same model and prompt.
+        """
+        job_path = os.path.join(output_dir, job_id, 'job.json')
+        if not is_job_id(job_id) or not os.path.exists(job_path):
+            return None
+        with open(job_path, 'r') as f:
+            saved = json.load(f)
+        job = cls(None, saved['sheet_column_pairs'], saved['selected_languages'],
+                  JobSettings.from_saved(saved['settings'], openai_api_key), cache, output_dir, job_id=job_id,
+                  file_format=saved.get('file_format', 'xlsx'), baseline_job_id=saved.get('baseline_job_id'))
+        job.created_at = saved['created_at']
+        return job
+
+    def _on_result(self, result):
+        _, translations = result
+        translations = translations or [None for _ in self.selected_languages]
+        done = sum(1 for translation in translations if translation)
+        with self._counters_lock:
+            self.counters['units_done'] += 1
+            self.counters['translations_done'] += done
+            self.counters['translations_failed'] += len(translations) - done
+        self.progress.record(*result)
+
+    def run(self, pool=None, batch_client: Optional[BatchClient] = None):
+        """
+        Translate the job. `pool` is the shared process pool, used in process mode. `batch_client` submits the batches
+        in batch mode, the OpenAI API by default.
+        """
+        if self.cancel_event.is_set():
+            return
+        self.batch_client = batch_client
+        self.state = JobState.RUNNING
+        self.started_at = time.time()
+        self.progress.notify()
+        trace = nullcontext()
+        if self.settings.tracing:
+            trace = tracing.trace_job(self.id, self.trace_path, self.profile_path if self.settings.profile else None)
+        try:
+            with trace:
+                if self.streamed:
+                    self._translate_streamed(pool)
+                else:
+                    self._translate(pool)
+            self.state = JobState.CANCELLED if self.cancel_event.is_set() else JobState.COMPLETED
+        except Exception as e:
+            logger.error(f'Job {self.id} failed: {e}')
+            self.error = str(e)
+            self.state = JobState.FAILED
+        finally:
+            self.finished_at = time.time()
+            self.progress.notify()
+            logger.info(f'Job {self.id} {self.state.value}: {self.counters}')
+
+    def _translate_plan(self, plan: TranslationPlan, pool, journal: CheckpointJournal,
+                        completed: dict) -> Tuple[List[Tuple[int, Optional[List[str]]]], List[dict]]:
+        """
+        Translate the units of a plan. Returns the results of the units and the failed cells.
+        """
+        settings = self.settings
+        with self._counters_lock:
+            self.counters['total_cells'] += plan.total_cells
+            self.counters['unique_texts'] += plan.unique_texts
+            for category, count in plan.skipped.items():
+                self.counters[f'skipped_{category}'] += count
+        self.progress.add_plan(plan)
+        service = TranslationService(settings.num_processes, settings.model, plan.text_index_pairs(), self.selected_languages,
+                                     cache=self.cache, packing=settings.packing,
+                                     languages_per_request=settings.languages_per_request, on_result=self._on_result,
+                                     journal=journal, completed=completed)
+        with tracing.span('translate', units=plan.unique_texts, mode=settings.execution_mode):
+            if settings.execution_mode == 'async':
+                results = service.translate_apply_async(settings.concurrency, self.cancel_event)
+                if get_rate_limiter() is not None:
+                    logger.info(f'Rate limiter: {get_rate_limiter().stats()}')
+                if get_hedger() is not None:
+                    logger.info(f'Hedging: {get_hedger().stats()}')
+            elif settings.execution_mode == 'batch':
+                client = self.batch_client or OpenAIBatchClient(settings.model.openai_api_key, settings.batch.base_url)
+                results = service.translate_batch(client, settings.batch, self.output_dir, self.cancel_event)
+            else:
+                results = service.translate_apply_sync(pool, self.cancel_event)
+        return results, plan.failed_cells(service.failures)
+
+    def _write_failures(self, failed_cells: List[dict]):
+        if failed_cells:
+            # with the translation cache on, running the job again only requests these translations
+            logger.warning(f'{len(failed_cells)} translations failed, see {self.failures_path}')
+            with open(self.failures_path, 'w') as f:
+                json.dump(failed_cells, f, indent=2, default=str)
+
+    def _translate(self, pool):
+        workbook = WorkbookSession(self.input_path)
+        try:
+            self._translate_workbook(workbook, pool)
+        finally:
+            workbook.close()
+
+    def _baseline(self) -> Optional[Baseline]:
+        """
+        The previous version of the file the job only translates the changed rows of, None to translate every row
+        """
+        if os.path.exists(self.previous_path):
+            columns = {sheet: {column: _target_pattern(column) for column in columns}
+                       for sheet, columns in self._columns_to_translate().items()}
+            with tracing.span('read_baseline'):
+                return Baseline.from_output(self.previous_path, self.file_format, columns, self.selected_languages,
+                                             store_dir=self.output_dir)
+        if os.path.exists(self.baseline_path):
+            return Baseline.from_fingerprint(self.baseline_path, self.selected_languages)
+        return None
+
+    def _add_column(self, plan: TranslationPlan, fingerprint: Fingerprint, baseline: Optional[Baseline],
+                    sheet: Optional[str], column: str, series: pd.Series, cells, empty: pd.Series):
+        """
+        Add a source column to the plan and to the fingerprint, with the translations of the rows that did not change
+        since the baseline. `cells` holds the columns of the file by name, `empty` flags the empty source cells.
+        """
+        with tracing.span('plan_column', sheet=sheet, column=column, rows=len(series)):
+            fingerprint.add(sheet, column, series)
+            carried = None
+            if baseline is not None:
+                targets = target_columns(list(cells.keys()), self.selected_languages, _target_pattern(column))
+                targets = pd.DataFrame({language_code: cells[target] for language_code, target in zip(self.selected_languages, targets)
+                                        if target is not None}, index=series.index)
+                carried = baseline.carry_over(sheet, column, series, targets)
+            plan.add_column(sheet, column, series, carried, empty)
+
+    def _translate_workbook(self, workbook: WorkbookSession, pool):
+        plan = TranslationPlan(segmenter=self.settings.segmenter(), pre_filter=self.settings.pre_filter)
+        fingerprint = Fingerprint()
+        baseline = self._baseline()
+        try:
+            for pair in self.sheet_column_pairs:
+                sheet = pair.get("sheet")
+                columns = pair.get("columns")
+                if baseline is not None:
+                    # the target cells of the file are kept for the rows that did not change
+                    columns = list(dict.fromkeys(columns + [target for column in columns
+                                                            for target in workbook.target_columns(sheet, self.selected_languages, _target_pattern(column))
+                                                            if target is not None]))
+                cells = workbook.read_columns(sheet, columns)
+                for column in pair.get("columns"):
+                    self._add_column(plan, fingerprint, baseline, sheet, column, cells[column], cells, workbook.empty_cells(sheet, column))
+        finally:
+            if baseline is not None:
+                baseline.close()
+        logger.info(f'Job {self.id}: translating {plan.unique_texts} unique texts of {plan.total_cells} cells in {len(plan.columns)} columns, '
+                    f'{plan.segmented_texts} long texts split into segments, skipped {dict(plan.skipped)}...')
+        # the plan is rebuilt from the same upload and request, so the unit ids of the journal still match
+        completed = CheckpointJournal.load(self.journal_path)
+        journal = CheckpointJournal(self.journal_path)
+        try:
+            results, failed_cells = self._translate_plan(plan, pool, journal, completed)
+        finally:
+            journal.close()
+        if self.cancel_event.is_set():
+            return
+        self._write_failures(failed_cells)
+
+        with tracing.span('assemble'):
+            for (sheet, column), column_results in plan.fan_out(results, len(self.selected_languages)).items():
+                workbook.set_translations(sheet, column_results, self.selected_languages, _target_pattern(column))
+                logger.info(f'translated sheet {sheet} column {column}')
+
+        # Write the translations into a copy of the uploaded workbook
+        workbook.save(self.output_path)
+        fingerprint.save(self.fingerprint_path)
+
+    def _columns_to_translate(self) -> Dict[Optional[str], List[str]]:
+        """
+        The columns to translate per sheet. CSV and JSON lines files have a single sheet, None, whatever the sheet of the request.
+        """
+        columns = {}
+        for pair in self.sheet_column_pairs:
+            sheet = pair.get("sheet") if self.file_format == 'xlsx' else None
+            columns.setdefault(sheet, []).extend(column for column in pair.get("columns") if column not in columns.get(sheet, []))
+        return columns
+
+    def _translate_chunk(self, plan: TranslationPlan, chunk: pd.DataFrame, pool, journal: CheckpointJournal,
+                         completed: dict) -> List[dict]:
+        """
+        Translate the plan of a chunk and patch the translations into the chunk. Returns the failed cells.
+        """
+        with tracing.span('chunk', first_row=int(chunk.index[0]), last_row=int(chunk.index[-1])):
+            results, failed_cells = self._translate_plan(plan, pool, journal, completed)
+            with tracing.span('assemble'):
+                for (_, column), column_results in plan.fan_out(results, len(self.selected_languages)).items():
+                    set_chunk_translations(chunk, column_results, self.selected_languages, _target_pattern(column))
+        return failed_cells
+
+    def _translate_streamed(self, pool):
+        """
+        Translate the input chunk by chunk, reading the next chunks while the current one is translated and appending
+        every translated chunk to the output, so that memory depends on the chunk size instead of the file size.
+        Up to `CHUNKS_IN_FLIGHT` chunks are translated at the same time, so that the requests of the next chunk
+        keep the workers busy while the last requests of a chunk finish. Chunks are written in order.
+        The chunks are the same on resume, so the unit ids of the journal still match.
+        """
+        columns_to_translate = self._columns_to_translate()
+        if self.file_format == 'xlsx':
+            unknown_sheets = [sheet for sheet in columns_to_translate if sheet not in DataReader().excel_sheet_names(self.input_path)]
+            if unknown_sheets:
+                raise ValueError(f"Worksheets {unknown_sheets} not found")
+        completed = CheckpointJournal.load(self.journal_path)
+        journal = CheckpointJournal(self.journal_path)
+        writer = ChunkWriter(self.output_path, self.file_format, read_header(self.input_path, self.file_format))
+        failed_cells, next_unit_id = [], 0
+        segmenter = self.settings.segmenter()
+        fingerprint = Fingerprint()
+        baseline = self._baseline()
+        pending = deque()
+
+        def write_done(in_flight: int):
+            # write the chunks at the head of the queue that are done, waiting for the oldest one while more than
+            # `in_flight` chunks are pending
+            while pending and (len(pending) > in_flight or pending[0][2] is None or pending[0][2].done()):
+                sheet, chunk, future = pending.popleft()
+                if future is not None:
+                    failed_cells.extend(future.result())
+                if self.cancel_event.is_set():
+                    return
+                writer.write(chunk, sheet)
+
+        executor = ThreadPoolExecutor(max_workers=CHUNKS_IN_FLIGHT, thread_name_prefix=f'job_{self.id[:8]}')
+        try:
+            for sheet, chunk in prefetch(read_chunks(self.input_path, self.file_format, self.settings.chunk_size)):
+                columns = columns_to_translate.get(sheet, [])
+                missing = [column for column in columns if column not in chunk.columns]
+                if missing:
+                    raise ValueError(f"Columns {missing} not found" + (f" in worksheet '{sheet}'" if sheet else ''))
+                future = None
+                if columns and len(chunk):
+                    plan = TranslationPlan(first_unit_id=next_unit_id, segmenter=segmenter, pre_filter=self.settings.pre_filter)
+                    for column in columns:
+                        self._add_column(plan, fingerprint, baseline, sheet, column, chunk[column].map(cell_text), chunk,
+                                         chunk[column].map(is_empty_cell))
+                    next_unit_id += plan.unique_texts
+                    logger.info(f'Job {self.id}: translating rows {chunk.index[0]}-{chunk.index[-1]}' + (f' of sheet {sheet}' if sheet else ''))
+                    future = executor.submit(tracing.copy_context(self._translate_chunk), plan, chunk, pool, journal, completed)
+                pending.append((sheet, chunk, future))
+                write_done(CHUNKS_IN_FLIGHT - 1)
+                if self.cancel_event.is_set():
+                    return
+            write_done(0)
+            if self.cancel_event.is_set():
+                return
+            writer.close()
+            fingerprint.save(self.fingerprint_path)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            journal.close()
+            if baseline is not None:
+                baseline.close()
+        self._write_failures(failed_cells)
+
+
+class JobManager:
+    """
+    Keeps the jobs of the API by id and runs at most `max_concurrent_jobs` of them at a time.
+    In process mode all the jobs share one pool of worker processes. In batch mode the jobs submit their batches
+    with `batch_client`, e.g. a client of a local stand-in server, or with the OpenAI API by default.
+    """
+    def __init__(self, max_concurrent_jobs: int = 2, output_dir: str = OUTPUT_DIR, batch_client: Optional[BatchClient] = None):
+        self.output_dir = output_dir
+        self.batch_client = batch_client
+        self.jobs: Dict[str, TranslationJob] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix='translation_job')
+        self._pool = None
+        self._pool_key = None
+        self._lock = threading.Lock()
+        # the worker processes send their metrics through this queue, see `modules.metrics`
+        self._metrics_queue = Queue()
+        metrics.collect(self._metrics_queue)
+        # and the spans of the traced jobs through this one, see `modules.tracing`
+        self._trace_queue = Queue()
+        tracing.collect(self._trace_queue)
+
+    def _get_pool(self, settings: JobSettings):
+        """
+        The shared process pool. It is recreated when the number of processes or the rate limit changes
+        and no job is using it.
+        """
+        worker_rate_limit = settings.rate_limit.per_process(settings.num_processes) if settings.rate_limit else None
+        key = (settings.num_processes, worker_rate_limit, settings.hedging)
+        with self._lock:
+            if self._pool is not None and self._pool_key != key:
+                if any(job.state == JobState.RUNNING and job.settings.execution_mode == 'process' for job in self.jobs.values()):
+                    logger.warning('Pool settings changed while jobs are running, keeping the current pool')
+                    return self._pool
+                self._pool.close()
+                self._pool = None
+            if self._pool is None:
+                self._pool = Pool(settings.num_processes, initializer=init_worker,
+                                  initargs=(settings.worker_prompt(), settings.model, settings.json_mode, worker_rate_limit, settings.hedging,
+                                            self._metrics_queue, self._trace_queue))
+                self._pool_key = key
+            return self._pool
+
+    def warm_up(self, settings: JobSettings):
+        """
+        Start the worker processes of process mode with the current settings, so that the first job does not wait for them
+        """
+        if settings.execution_mode == 'process':
+            self._get_pool(settings)
+
+    def _run(self, job: TranslationJob):
+        if job.settings.execution_mode == 'process':
+            job.run(self._get_pool(job.settings))
+        elif job.settings.execution_mode == 'batch':
+            job.run(batch_client=self.batch_client)
+        else:
+            configure_rate_limiter(job.settings.rate_limit)
+            configure_hedging(job.settings.hedging)
+            job.run()
+
+    def spool_path(self, file_format: str) -> str:
+        """
+        A new temporary file to spool an upload to. It is in the output directory, so that submitting the job
+        renames it into the job directory instead of copying it.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix='upload_', suffix=f'.{file_format}', dir=self.output_dir)
+        os.close(fd)
+        return path
+
+    def submit(self, file_content: Union[bytes, str], sheet_column_pairs: List[dict], selected_languages: List[str],
+               settings: JobSettings, cache: Optional[TranslationCache] = None, file_format: str = 'xlsx',
+               previous_content: Union[bytes, str, None] = None, baseline_job_id: Optional[str] = None) -> TranslationJob:
+        """
+        Queue a job. With the `previous_content` output of an earlier version of the file, or the id of the job
+        that translated it, only the rows whose source text changed are translated.
+        The uploads are given as bytes or as the paths of the temporary files they were spooled to, see `spool_path`.
+        """
+        if baseline_job_id is not None and not is_job_id(baseline_job_id):
+            raise ValueError(f'{baseline_job_id!r} is not a job id')
+        if baseline_job_id is not None and not os.path.exists(os.path.join(self.output_dir, baseline_job_id, 'fingerprint.json')):
+            raise ValueError(f'job {baseline_job_id} has no fingerprint to compare with')
+        job = TranslationJob(file_content, sheet_column_pairs, selected_languages, settings, cache, self.output_dir,
+                             file_format=file_format, previous_content=previous_content, baseline_job_id=baseline_job_id)
+        job.save()
+        self.jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        logger.info(f'Job {job.id} queued')
+        return job
+
+    def resume(self, job_id: str, openai_api_key: str, cache: Optional[TranslationCache] = None) -> Optional[TranslationJob]:
+        """
+        Run a failed, cancelled or interrupted job again. Translations recorded in its checkpoint journal are not requested again.
+        Jobs of a previous API process are loaded from their output directory.
+        """
+        job = self.jobs.get(job_id)
+        if job is not None and not job.finished:
+            raise ValueError(f'job {job_id} is {job.state.value}')
+        job = TranslationJob.load(job_id, openai_api_key, cache, self.output_dir)
+        if job is None:
+            return None
+        self.jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        logger.info(f'Job {job.id} queued for resume')
+        return job
+
+    def get(self, job_id: str) -> Optional[TranslationJob]:
+        return self.jobs.get(job_id)
+
+    def result_path(self, job_id: str) -> Optional[str]:
+        """
+        The translated file of a completed job, also of a job of a previous API process. None when the job
+        has no translated file, so that the other files of the job directory are never served.
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            path = job.output_path if job.state == JobState.COMPLETED else None
+        else:
+            job_path = os.path.join(self.output_dir, job_id, 'job.json')
+            if not is_job_id(job_id) or not os.path.exists(job_path):
+                return None
+            with open(job_path, 'r') as f:
+                saved = json.load(f)
+            path = os.path.join(self.output_dir, job_id, f"{OUTPUT_NAME}.{saved.get('file_format', 'xlsx')}")
+        return path if path is not None and os.path.isfile(path) else None
+
+    def cancel(self, job_id: str) -> Optional[TranslationJob]:
+        """
+        Cancel a queued or running job. A finished job is removed together with its output files.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if not job.finished:
+            job.cancel_event.set()
+            if job.state == JobState.QUEUED:
+                job.state = JobState.CANCELLED
+                job.finished_at = time.time()
+                job.progress.notify()
+            logger.info(f'Job {job_id} cancelled')
+        else:
+            del self.jobs[job_id]
+            shutil.rmtree(job.output_dir, ignore_errors=True)
+            logger.info(f'Job {job_id} deleted')
+        return job
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            job.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
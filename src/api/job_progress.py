@@ -0,0 +1,115 @@
+"""
+Live progress of a translation job, pushed to the clients of its `/jobs/{job_id}/events` stream
+"""
+
+import asyncio
+from collections import deque
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from modules.translation_plan import TranslationPlan
+
+# seconds of results the throughput is measured over
+THROUGHPUT_WINDOW = 30
+
+
+class JobProgress:
+    """
+    Counts the translated and failed cells of every (sheet, column, language) of a job as its work units finish,
+    and the throughput of the last `THROUGHPUT_WINDOW` seconds. Results are recorded from the threads of the job;
+    the event loop of every subscriber is woken up when they change.
+    """
+    def __init__(self, language_codes: List[str]):
+        self.language_codes = language_codes
+        # unit id -> number of cells per (sheet, column)
+        self._unit_cells: Dict[int, Dict[Tuple[str, str], float]] = {}
+        self._cells: Dict[Tuple[str, str], float] = {}
+        # (sheet, column) -> done and failed cells per language
+        self._done: Dict[Tuple[str, str], List[float]] = {}
+        self._failed: Dict[Tuple[str, str], List[float]] = {}
+        self._units_planned = 0
+        self._units_done = 0
+        # (time, units, translations) of the recent results
+        self._recent: deque = deque()
+        self._lock = threading.Lock()
+        self._subscribers: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    def add_plan(self, plan: TranslationPlan):
+        """
+        Add the work units of a plan, before they are translated
+        """
+        unit_cells = plan.unit_cells()
+        with self._lock:
+            for unit_id, cells in unit_cells.items():
+                self._unit_cells[unit_id] = cells
+                for key, count in cells.items():
+                    self._cells[key] = self._cells.get(key, 0) + count
+                    self._done.setdefault(key, [0] * len(self.language_codes))
+                    self._failed.setdefault(key, [0] * len(self.language_codes))
+            self._units_planned += plan.unique_texts
+        self.notify()
+
+    def record(self, unit_id: int, translations: Optional[List[str]]):
+        """
+        Count the cells of a finished work unit as translated or failed in every language
+        """
+        translations = translations or [None for _ in self.language_codes]
+        with self._lock:
+            for key, count in self._unit_cells.pop(unit_id, {}).items():
+                for position, translation in enumerate(translations):
+                    (self._done if translation else self._failed)[key][position] += count
+            self._units_done += 1
+            now = time.monotonic()
+            self._recent.append((now, sum(1 for translation in translations if translation)))
+            while self._recent and self._recent[0][0] < now - THROUGHPUT_WINDOW:
+                self._recent.popleft()
+        self.notify()
+
+    def snapshot(self) -> dict:
+        """
+        The counts per (sheet, column, language), the throughput of the recent results and the estimated seconds left
+        """
+        with self._lock:
+            now = time.monotonic()
+            recent = [entry for entry in self._recent if entry[0] >= now - THROUGHPUT_WINDOW]
+            # measured from the first recent result, so that the rate is right before the window is full
+            seconds = max(now - recent[0][0], 1.0) if recent else None
+            units_per_s = len(recent) / seconds if recent else 0.0
+            remaining = self._units_planned - self._units_done
+            columns = [{'sheet': sheet, 'column': column, 'cells': round(cells),
+                        'languages': {language_code: {'done': round(self._done[(sheet, column)][position]),
+                                                      'failed': round(self._failed[(sheet, column)][position])}
+                                      for position, language_code in enumerate(self.language_codes)}}
+                       for (sheet, column), cells in self._cells.items()]
+            return {
+                'units_planned': self._units_planned,
+                'units_done': self._units_done,
+                'units_per_s': round(units_per_s, 2),
+                'translations_per_s': round(sum(entry[1] for entry in recent) / seconds, 2) if recent else 0.0,
+                'eta_s': round(remaining / units_per_s) if units_per_s else None,
+                'columns': columns,
+            }
+
+    def subscribe(self) -> asyncio.Event:
+        """
+        An event of the running loop that is set whenever the progress changes
+        """
+        changed = asyncio.Event()
+        with self._lock:
+            self._subscribers.add((asyncio.get_running_loop(), changed))
+        return changed
+
+    def unsubscribe(self, changed: asyncio.Event):
+        with self._lock:
+            self._subscribers = {(loop, event) for loop, event in self._subscribers if event is not changed}
+
+    def notify(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, changed in subscribers:
+            try:
+                loop.call_soon_threadsafe(changed.set)
+            except RuntimeError:
+                # the loop of a client that went away is closed
+                pass
@@ -4,11 +4,13 @@ This is the main Streamlit app that allows users to upload an Excel file, select
  the download link for the translated file.
 """
 
+import hashlib
 import json
+import os
+import subprocess
 import time
-from typing import List
+from typing import Optional
 import sys
-from urllib.parse import quote
 
 import pandas as pd
 import requests
@@ -18,21 +20,16 @@ import streamlit as st
 API_HOST='127.0.0.1'
 API_PORT=5000
 API_BASE_URL=f'http://{API_HOST}:{API_PORT}'
+# url of the API as the browser reaches it, to download the translated files from the API directly.
+# Unset, the API is only reachable from the app, which passes the files on through the Download button.
+API_PUBLIC_URL=os.getenv('API_PUBLIC_URL')
+# seconds between two updates of the progress of a running job
+PROGRESS_INTERVAL=1
+# seconds to wait for a new API server to be ready
+API_START_TIMEOUT=120
 
-
-# Add the src directory to the system path to access utility functions
-def get_column_names_for_translation(df, pattern="(to translate)"):
-    """
-    Gets the column names that contain the pattern in the DataFrame.
-    """
-    return [col for col in df.columns if pattern in col]
-
-
-def get_languages_from_df_column_names(df: pd.DataFrame) -> List[str]:
-    """
-    # Assumes that the column name is in the format: {language_code} description
-    """
-    return [col.replace(' description', '') for col in df.columns if ' description' in col]
+# a fragment reruns on its own without rerunning the whole script, `st.fragment` from streamlit 1.37
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
 
 
 def create_session_state():
@@ -54,9 +51,17 @@ def create_session_state():
     if "API_STARTED" not in st.session_state:
         st.session_state.API_STARTED = False
 
+    # the running job, followed until it is finished
+    if "JOB_ID" not in st.session_state:
+        st.session_state.JOB_ID = None
+
+    # the last finished job, shown with its download button
+    if "JOB_RESULT" not in st.session_state:
+        st.session_state.JOB_RESULT = None
+
 
-def column_selector(df, sheet_name, i):
-    possible_column_names = get_column_names_for_translation(df)
+def column_selector(sheet, sheet_name, i):
+    possible_column_names = sheet["columns_to_translate"]
     selected_columns = st.session_state.sheet_column_pairs[i]["columns"]
     for col in possible_column_names:
         if st.checkbox(col, key=f"{sheet_name}_column_{col}_{i}", value=col in selected_columns):
@@ -67,8 +72,9 @@ def column_selector(df, sheet_name, i):
                 selected_columns.remove(col)
 
 
-def select_sheet_column_pairs_and_get_languages(excel_file, uploaded_file):
+def select_sheet_column_pairs_and_get_languages(metadata):
     all_languages = []
+    sheets = {sheet["name"]: sheet for sheet in metadata["sheets"]}
 
     def add_pair():
         if possible_sheets:
@@ -77,22 +83,22 @@ def select_sheet_column_pairs_and_get_languages(excel_file, uploaded_file):
             st.warning("All sheets have been selected. Cannot add more. You can change the selected sheets/columns.")
 
     # Display the sheet-column pairs
-    possible_sheets = excel_file.sheet_names
+    possible_sheets = list(sheets)
     for i, pair in enumerate(st.session_state.sheet_column_pairs):
         with st.expander(f"Selected sheet {i+1}", expanded=True):
             sheet_name = st.selectbox(
                 "**Select a sheet and column[s] to translate:**", 
                 possible_sheets, 
-                key=f"sheet_{i}"
+                key=f"sheet_{i}",
+                format_func=lambda name: f"{name} ({sheets[name]['rows']} rows)"
             )
             if sheet_name:
                 st.session_state.sheet_column_pairs[i]["sheet"] = sheet_name
-                df = pd.read_excel(uploaded_file, sheet_name=sheet_name)
 
-                column_selector(df, sheet_name, i)
+                column_selector(sheets[sheet_name], sheet_name, i)
 
                 if not all_languages:
-                    all_languages = get_languages_from_df_column_names(df)
+                    all_languages = sheets[sheet_name]["languages"]
         possible_sheets = [sh for sh in possible_sheets if sh != sheet_name]
 
     st.button("Add a sheet name for translation", on_click=add_pair)
@@ -131,6 +137,59 @@ def select_languages(all_languages):
                         st.session_state.selected_languages.remove(lang)
 
 
+@st.cache_resource
+def start_api():
+    """
+    Start the API server once per Streamlit server. It keeps running for the next translations and the other sessions.
+    """
+    job = [f'{sys.executable}', 'src/bootstrapper.py', API_HOST, str(API_PORT)]
+    print(f"Starting API server: {job}")
+    return subprocess.Popen(job)
+
+
+def api_status() -> Optional[int]:
+    """
+    The status code of the readiness probe of the API, None when no server answers
+    """
+    try:
+        return requests.get(f"{API_BASE_URL}/ready", timeout=2).status_code
+    except requests.RequestException:
+        return None
+
+
+def wait_for_api(timeout=API_START_TIMEOUT) -> bool:
+    """
+    Start the API server unless it is running, and wait until it is ready to take jobs
+    """
+    if api_status() == 200:
+        return True
+    process = start_api()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = api_status()
+        if status == 200:
+            return True
+        if process.poll() is not None and status is None:
+            # the server exited before it answered, it is started again on the next try
+            start_api.clear()
+            return False
+        time.sleep(0.2)
+    return False
+
+
+@st.cache_data(max_entries=16, show_spinner="Reading the workbook...")
+def workbook_metadata(content_hash: str, _content: bytes) -> dict:
+    """
+    The sheets, row counts, columns to translate and languages of an uploaded workbook, read by the API from the
+    header rows once per content hash instead of parsing every sheet on every rerun
+    """
+    if not wait_for_api():
+        raise RuntimeError("The API server is not ready, see application.log.")
+    response = requests.post(f"{API_BASE_URL}/workbook/metadata", files={"file": ("workbook.xlsx", _content)})
+    response.raise_for_status()
+    return response.json()
+
+
 def run_translation(uploaded_file):
     with st.spinner('Translating...'):
         try:
@@ -152,10 +211,86 @@ def run_translation(uploaded_file):
 
             if not response.status_code == 200:
                 st.error(f'Error in translation: {response.text}')
+            else:
+                st.session_state.JOB_ID = response.json().get("job_id")
+                st.session_state.JOB_RESULT = None
         except Exception as e:
             st.error(f"Error in translation: {str(e)}")
 
 
+def progress_table(progress) -> pd.DataFrame:
+    """
+    The translated and failed cells of every sheet, column and language
+    """
+    return pd.DataFrame([{"sheet": column["sheet"], "column": column["column"], "language": lang,
+                          "translated": f"{counts['done']}/{column['cells']}", "failed": counts["failed"]}
+                         for column in progress["columns"] for lang, counts in column["languages"].items()])
+
+
+@fragment(run_every=PROGRESS_INTERVAL)
+def show_progress():
+    """
+    Show the progress of the running job. The fragment polls the API on its own, so the app stays responsive,
+    and reruns the app once the job is finished to show its result.
+    """
+    job_id = st.session_state.JOB_ID
+    if job_id is None:
+        return
+    try:
+        job = requests.get(f"{API_BASE_URL}/jobs/{job_id}", timeout=5).json()
+    except requests.RequestException as e:
+        st.error(f"Lost the connection to the API: {str(e)}")
+        return
+    if job.get("state") in ("completed", "failed", "cancelled") or "progress" not in job:
+        st.session_state.JOB_ID = None
+        st.session_state.JOB_RESULT = job
+        st.rerun()
+    progress = job["progress"]
+    planned, done = progress["units_planned"], progress["units_done"]
+    st.progress(done / planned if planned else 0.0, text=f"{job['state'].capitalize()}: {done}/{planned} texts")
+    eta = f"{progress['eta_s'] // 60}m {progress['eta_s'] % 60}s" if progress["eta_s"] is not None else "-"
+    st.write(f"**{progress['translations_per_s']}** translations/s · ETA **{eta}** · "
+             f"**{job['counters']['translations_failed']}** failed translations")
+    if progress["columns"]:
+        st.dataframe(progress_table(progress), hide_index=True, use_container_width=True)
+
+
+@st.cache_data(max_entries=1, show_spinner="Downloading the translated file...")
+def translated_file(job_id: str) -> bytes:
+    """
+    The translated file of a job, downloaded once instead of on every rerun of the app
+    """
+    response = requests.get(f"{API_BASE_URL}/jobs/{job_id}/download")
+    response.raise_for_status()
+    return response.content
+
+
+def show_result(job):
+    """
+    Show the outcome of the last finished job
+    """
+    if job.get("state") == "completed":
+        st.success(f"Translation completed. The translated file is {job.get('file_path')}")
+        file_name = os.path.basename(job["file_path"])
+        if API_PUBLIC_URL:
+            # the browser downloads the file from the API directly, so the app never holds it in memory
+            st.link_button("⬇️  Download", f"{API_PUBLIC_URL.rstrip('/')}/jobs/{job['job_id']}/download")
+        else:
+            try:
+                st.download_button("⬇️  Download", data=translated_file(job["job_id"]), file_name=file_name)
+            except requests.RequestException as e:
+                st.error(f"Error downloading the translated file: {str(e)}")
+        if not job.get("shown"):
+            # once per job, not on every rerun of the app
+            job["shown"] = True
+            st.balloons()
+            print("Translation completed.")
+    elif job.get("state") in ("failed", "cancelled"):
+        st.error(f"Translation {job.get('state')}: {job.get('error') or ''}")
+    else:
+        st.error(f"Translation job not found: {job.get('detail') or ''}")
+
+
 def main():
     st.title("Translator App")
 
@@ -167,69 +302,60 @@ def main():
 
     if uploaded_file is not None:
         st.success("File uploaded successfully")
-        excel_file = pd.ExcelFile(uploaded_file)
+        content = uploaded_file.getvalue()
+        try:
+            metadata = workbook_metadata(hashlib.sha256(content).hexdigest(), content)
+        except (RuntimeError, requests.RequestException) as e:
+            st.error(f"Error reading the workbook: {str(e)}")
+            return
 
         st.markdown("<h4>Select Sheet[s] to Translate:</h4>", unsafe_allow_html=True)
         st.write("The app will display the sheets in the uploaded Excel file. You can select the sheets and columns to translate and the languages to translate to. Only the columns with '(to translate)' in their names will be displayed.")
 
-        all_languages = select_sheet_column_pairs_and_get_languages(excel_file, uploaded_file)
+        all_languages = select_sheet_column_pairs_and_get_languages(metadata)
 
         display_selected_sheet_column_pairs()
 
         if all_languages:
             select_languages(all_languages)
 
-        if not st.session_state.API_STARTED:
+        if not st.session_state.JOB_ID:
             if st.button("🚀  Translate"):
-                st.write("Starting the API server...")
                 if not st.session_state.sheet_column_pairs:
                     st.error("Please select at least one sheet-column pair to translate.")
                     return
 
-                import subprocess
-                import threading
-
-                def start_api(job):
-                    print(f"Starting API server: {job}")
-                    proc = subprocess.Popen(job)
-                    proc.wait()
-                    return proc
-                
-                job = [f'{sys.executable}', 'src/bootstrapper.py', API_HOST, str(API_PORT)]
-
-                # server thread remains alive as long as the main thread is alive, or is manually killed
-                thread = threading.Thread(name="fastapi_translation_bootstrapper", target=start_api, args=(job,), daemon=True)
-                thread.start()
+                with st.spinner("Waiting for the API server..."):
+                    if not wait_for_api():
+                        st.error("The API server is not ready, see application.log.")
+                        return
 
-                time.sleep(2)
                 run_translation(uploaded_file)
 
                 st.session_state.API_STARTED = True
 
                 st.rerun()
-        
-        if st.session_state.API_STARTED:
+
+        # follow the progress of the translation job until it is finished
+        if st.session_state.JOB_ID:
             st.write("Translating. Please wait...")
             st.info("This may take a while depending on the size of the file and the number of columns to translate. At the end the translated file will be available in the translated_files folder.")
+            show_progress()
+
+        if st.session_state.JOB_RESULT:
+            show_result(st.session_state.JOB_RESULT)
+
+        if st.session_state.API_STARTED:
             st.caption("You can shutdown the API server by clicking the button below.")
             c1, c2, _, c4 = st.columns([1,1,1,1])
             with c4:
                 if st.button("🔥  Shutdown"):
                     response = requests.get(f"{API_BASE_URL}/shutdown")
+                    start_api.clear()
                     st.session_state.API_STARTED = False
+                    st.session_state.JOB_ID = None
                     st.rerun()
 
-        # check if the API server is running or completed
-        while st.session_state.API_STARTED:
-            time.sleep(10)
-            response = requests.get(f"{API_BASE_URL}/completed")
-            if response.status_code == 200:
-                if response.json().get("completed"):
-                    st.success("Translation completed.")
-                    st.balloons()
-                    print("Translation completed.")
-                    break
-
 def sidebar():
     st.sidebar.header('About')
     st.sidebar.info('FastAPI Wrapper to run the translation service.')
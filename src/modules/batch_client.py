@@ -0,0 +1,120 @@
+"""
+A module to submit translation requests through the OpenAI Batch API: the requests are written to a JSONL file,
+uploaded, run by the provider within the completion window and their responses downloaded as a JSONL file.
+Batches do not count against the real-time rate limits of the account.
+"""
+
+from abc import ABC, abstractmethod
+import json
+from typing import Iterator, List, Optional, Tuple
+
+from openai import OpenAI
+from pydantic import BaseModel, Field
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+# Batch statuses after which the batch does not change anymore
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+# Roles of the OpenAI chat messages, by langchain message type
+MESSAGE_ROLES = {'system': 'system', 'human': 'user', 'ai': 'assistant'}
+
+
+class BatchConfig(BaseModel):
+    completion_window: str = Field(default='24h', description='time within which the provider runs a batch')
+    poll_interval: float = Field(default=60, description='seconds between two status checks of a batch')
+    max_requests_per_batch: int = Field(default=50000, description='maximum number of requests in one batch file')
+    base_url: Optional[str] = Field(default=None, description='OpenAI compatible server to send the batches to, None for the OpenAI API')
+
+
+def batch_request(custom_id: str, messages, model_name: str, temperature: float) -> dict:
+    """
+    One line of a batch request file, for the langchain `messages` of a formatted prompt
+    """
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': BATCH_ENDPOINT,
+        'body': {
+            'model': model_name,
+            'temperature': temperature,
+            'messages': [{'role': MESSAGE_ROLES[message.type], 'content': message.content} for message in messages],
+        },
+    }
+
+
+def parse_batch_output(content: bytes) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Yield the (custom id, answer) of every line of a batch output or error file, None for the requests that failed
+    """
+    for line in content.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get('response') or {}
+        answer = None
+        if response.get('status_code') == 200:
+            try:
+                answer = response['body']['choices'][0]['message']['content']
+            except (KeyError, IndexError, TypeError):
+                logger.warning(f"Unexpected batch response for request {record.get('custom_id')}")
+        else:
+            logger.warning(f"Batch request {record.get('custom_id')} failed: {record.get('error') or response.get('body')}")
+        yield record.get('custom_id'), answer
+
+
+class BatchClient(ABC):
+    """
+    Submits request files and polls their batches. Subclass it to send the batches to another provider
+    or to a local stand-in server.
+    """
+    @abstractmethod
+    def submit(self, path: str, completion_window: str) -> str:
+        """
+        Upload a request file and start its batch. Returns the batch id.
+        """
+
+    @abstractmethod
+    def status(self, batch_id: str) -> Tuple[str, List[str]]:
+        """
+        The status of a batch and the ids of its output and error files, once it has them
+        """
+
+    @abstractmethod
+    def download(self, file_id: str) -> bytes:
+        """
+        The content of an output or error file
+        """
+
+    @abstractmethod
+    def cancel(self, batch_id: str):
+        """
+        Stop a batch that has not finished
+        """
+
+
+class OpenAIBatchClient(BatchClient):
+    """
+    Batch client of the OpenAI API, or of any server that implements its files and batches endpoints
+    """
+    def __init__(self, openai_api_key: str, base_url: Optional[str] = None):
+        self._client = OpenAI(api_key=openai_api_key, base_url=base_url)
+
+    def submit(self, path: str, completion_window: str) -> str:
+        with open(path, 'rb') as f:
+            input_file = self._client.files.create(file=f, purpose='batch')
+        batch = self._client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window=completion_window)
+        logger.info(f'Submitted batch {batch.id} of {path}')
+        return batch.id
+
+    def status(self, batch_id: str) -> Tuple[str, List[str]]:
+        batch = self._client.batches.retrieve(batch_id)
+        return batch.status, [file_id for file_id in (batch.output_file_id, batch.error_file_id) if file_id]
+
+    def download(self, file_id: str) -> bytes:
+        return self._client.files.content(file_id).content
+
+    def cancel(self, batch_id: str):
+        self._client.batches.cancel(batch_id)
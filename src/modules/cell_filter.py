@@ -0,0 +1,53 @@
+"""
+A module to find the source cells that need no translation, with vectorized pandas string operations
+"""
+
+from typing import Optional
+
+import pandas as pd
+
+# Cell categories
+TEXT = 'text'
+# nothing to translate, the target cell is left as it is
+EMPTY = 'empty'
+# numbers, dates, URLs, email addresses and codes, copied to the target cell as they are
+NON_LINGUISTIC = 'non_linguistic'
+# text without any letter, e.g. punctuation or symbols, copied to the target cell as it is
+PASS_THROUGH = 'pass_through'
+SKIPPED_CATEGORIES = (EMPTY, NON_LINGUISTIC, PASS_THROUGH)
+
+# Text of the cells that are empty in the source file, see `utils.utils.cell_text`
+EMPTY_TEXT = 'nan'
+NON_LINGUISTIC_PATTERN = '|'.join([
+    # numbers, amounts, percentages, dates, times and phone numbers
+    r'[-+]?[\d\s.,:/%()\-+$€£¥]*\d[\d\s.,:/%()\-+$€£¥]*',
+    r'(?:https?://|ftp://|www\.)\S+',
+    r'[\w.+\-]+@[\w\-]+(?:\.[\w\-]+)+',
+])
+# identifiers and codes: a single token of 3 characters or more with a digit, but not ordinals like 21st or 3e.
+# Only the tokens with at least as many digits as letters are codes, e.g. S1.2.3, AB-1234 or ENG_042,
+# so that terms like COVID-19, B2B, 3D or MP3-player are translated.
+CODE_PATTERN = r'(?=\S*\d)(?!\d+(?i:st|nd|rd|th|er|re|e|ème|eme)$)[A-Za-z0-9_\-./#:]{3,}'
+# any letter, in any script
+LETTER_PATTERN = r'[^\W\d_]'
+
+
+def classify_cells(texts: pd.Series, empty: Optional[pd.Series] = None) -> pd.Series:
+    """
+    The category of every source cell: TEXT for the cells to translate, or the reason to skip it.
+    `empty` flags the cells that are empty in the source file, from their raw values, so that a cell with the text
+    'nan' or 'NaN' is translated; without it, the cells with the text of an empty cell are empty.
+    Cells of whitespace only are empty too.
+    """
+    stripped = texts.astype(str).str.strip()
+    if empty is None:
+        empty = texts.astype(str) == EMPTY_TEXT
+    empty = empty.reindex(texts.index, fill_value=False).astype(bool) | (stripped == '')
+    code = stripped.str.fullmatch(CODE_PATTERN) & (stripped.str.count(r'\d') >= stripped.str.count(r'[A-Za-z]'))
+    non_linguistic = ~empty & (stripped.str.fullmatch(NON_LINGUISTIC_PATTERN) | code)
+    pass_through = ~empty & ~non_linguistic & ~stripped.str.contains(LETTER_PATTERN)
+    categories = pd.Series(TEXT, index=texts.index, dtype=object)
+    categories[empty] = EMPTY
+    categories[non_linguistic] = NON_LINGUISTIC
+    categories[pass_through] = PASS_THROUGH
+    return categories
@@ -0,0 +1,143 @@
+"""
+A process-local registry of chains. Chains are not picklable, so every worker process builds its own,
+but only once per (model config, prompt) instead of once per task.
+Chains used from an event loop are built once per loop instead, because the connections of their async HTTP client
+belong to the loop that opened them; `close_loop_chains` closes them when the loop is done.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Tuple
+import weakref
+
+from langchain_core.runnables import RunnableSequence
+
+from modules import metrics, tracing
+from modules.hedging import Hedger, HedgingConfig
+from modules.model_config import ModelConfig
+from modules.openai_chain import OpenAIchain
+from modules.rate_limiter import RateLimitConfig, RateLimiter
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_chains: Dict[Tuple[str, str, bool], RunnableSequence] = {}
+# event loop -> key -> (chain, async HTTP client) of the chains used from the loop
+_loop_chains: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str, bool], tuple]]' = weakref.WeakKeyDictionary()
+_loop_chains_lock = threading.Lock()
+_rate_limiter: Optional[RateLimiter] = None
+_hedger: Optional[Hedger] = None
+
+
+def configure_rate_limiter(config: Optional[RateLimitConfig]):
+    """
+    Set the rate limiter shared by all the chains of this process. Chains created before are dropped.
+    """
+    global _rate_limiter
+    current = _rate_limiter.config if _rate_limiter is not None else None
+    if config == current:
+        return
+    _rate_limiter = RateLimiter(config) if config is not None else None
+    _chains.clear()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    return _rate_limiter
+
+
+def configure_hedging(config: Optional[HedgingConfig]):
+    """
+    Set the hedging policy shared by all the chains of this process. Chains created before are dropped.
+    """
+    global _hedger
+    current = _hedger.config if _hedger is not None else None
+    if config == current:
+        return
+    _hedger = Hedger(config) if config is not None else None
+    _chains.clear()
+
+
+def get_hedger() -> Optional[Hedger]:
+    return _hedger
+
+
+def chain_key(prompt, model_config: ModelConfig, json_mode: bool = False) -> Tuple[str, str, bool]:
+    prompt_hash = hashlib.sha256(prompt.pretty_repr().encode('utf-8')).hexdigest()
+    return (model_config.model_dump_json(), prompt_hash, json_mode)
+
+
+def _create_chain(prompt, model_config: ModelConfig, json_mode: bool) -> tuple:
+    """
+    A new chain and the async HTTP client of its model
+    """
+    with tracing.span('create_chain'):
+        factory = OpenAIchain(prompt, model_config, json_mode, _rate_limiter, _hedger)
+        return factory.create_chain(), factory.http_async_client
+
+
+def get_chain(prompt, model_config: ModelConfig, json_mode: bool = False) -> RunnableSequence:
+    """
+    Return the chain of this process for the model config and prompt, creating it on first use.
+    The chain keeps its `ChatOpenAI` client, so its HTTP connection pool is reused by every task of the worker.
+    Called from a running event loop, the chain is the one of that loop, see `close_loop_chains`.
+    """
+    key = chain_key(prompt, model_config, json_mode)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not None:
+        return _get_loop_chain(loop, key, prompt, model_config, json_mode)
+    chain = _chains.get(key)
+    if chain is None:
+        logger.info(f'Creating chain for {model_config.llm_model_name} in process {os.getpid()}')
+        chain, _ = _create_chain(prompt, model_config, json_mode)
+        if chain is not None:
+            _chains[key] = chain
+    return chain
+
+
+def _get_loop_chain(loop: asyncio.AbstractEventLoop, key: Tuple[str, str, bool], prompt, model_config: ModelConfig,
+                    json_mode: bool) -> RunnableSequence:
+    with _loop_chains_lock:
+        chains = _loop_chains.setdefault(loop, {})
+        if key in chains:
+            return chains[key][0]
+    logger.info(f'Creating chain for {model_config.llm_model_name} in process {os.getpid()} for an event loop')
+    chain, client = _create_chain(prompt, model_config, json_mode)
+    if chain is not None:
+        with _loop_chains_lock:
+            chains[key] = (chain, client)
+    return chain
+
+
+async def close_loop_chains():
+    """
+    Drop the chains of the running event loop and close their HTTP clients, before the loop is closed
+    """
+    with _loop_chains_lock:
+        chains = _loop_chains.pop(asyncio.get_running_loop(), {})
+    for _, client in chains.values():
+        await client.aclose()
+
+
+def init_worker(prompt, model_config: ModelConfig, json_mode: bool = False, rate_limit: Optional[RateLimitConfig] = None,
+                hedging: Optional[HedgingConfig] = None, metrics_sink=None, trace_sink=None):
+    """
+    `multiprocessing.Pool` initializer that sets up the rate limiter and the hedging policy of the worker and builds the chain
+    before the worker receives its first task. With `metrics_sink` and `trace_sink` queues, the metrics and the spans of the worker
+    are sent to the API process.
+    """
+    metrics.configure_worker(metrics_sink)
+    tracing.configure_worker(trace_sink)
+    configure_rate_limiter(rate_limit)
+    configure_hedging(hedging)
+    get_chain(prompt, model_config, json_mode)
+
+
+def clear_chains():
+    _chains.clear()
+    with _loop_chains_lock:
+        _loop_chains.clear()
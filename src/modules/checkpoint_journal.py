@@ -0,0 +1,98 @@
+"""
+An append-only journal of the translations a job has finished, so that an interrupted job can be resumed
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Seconds between two fsyncs of the journal. Every line is flushed to the OS as soon as it is written,
+# which is enough to survive the process being killed; the fsync bounds what a machine crash can lose.
+FSYNC_INTERVAL = 1.0
+
+
+class CheckpointJournal:
+    """
+    JSONL journal of finished work units. Every line is `{"unit": id, "translations": {language: translation}}`,
+    where the unit id is the position of the text in the `TranslationPlan` of the job.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self._truncate_torn_line(path)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def _truncate_torn_line(path: str):
+        """
+        Cut a torn last line off the journal, so the next record starts on a line of its own instead of being glued to it
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # search backwards for the end of the last complete line
+            end = size
+            while end > 0:
+                start = max(end - 4096, 0)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            logger.warning(f'Truncating the torn last line of {path} ({size - end} bytes)')
+            f.truncate(end)
+
+    @staticmethod
+    def load(path: str) -> Dict[int, Dict[str, str]]:
+        """
+        Read the translations recorded in a journal. A torn last line, left by a crash in the middle of a write, is ignored.
+        """
+        completed: Dict[int, Dict[str, str]] = {}
+        if not os.path.exists(path):
+            return completed
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f'Skipping unreadable line {line_number} of {path}')
+                    continue
+                completed.setdefault(entry['unit'], {}).update(entry['translations'])
+        return completed
+
+    def record(self, unit_id: int, translations: Dict[str, str]):
+        """
+        Append the finished translations of a unit. Failed (empty) translations are not recorded, so they are retried on resume.
+        """
+        translations = {lang: translation for lang, translation in translations.items() if translation}
+        if not translations:
+            return
+        line = json.dumps({'unit': unit_id, 'translations': translations}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            now = time.monotonic()
+            if now - self._last_sync > FSYNC_INTERVAL:
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
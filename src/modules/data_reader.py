@@ -1,5 +1,7 @@
 from io import BytesIO
+from typing import Iterator, List
 
+import openpyxl
 import pandas as pd
 
 from utils.logger import setup_logger
@@ -27,8 +29,54 @@ class DataReader:
             logger.error(f"Error reading Excel file: {str(e)}")
             raise FileNotFoundError("Error reading Excel file")
 
+    def iter_csv(self, file, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Read a csv file in chunks of `chunk_size` rows. Cells are kept as the strings of the file.
+        """
+        yield from pd.read_csv(file, chunksize=chunk_size, dtype=str, keep_default_na=False)
+
+    def csv_header(self, file) -> List[str]:
+        """
+        The column names of a csv file, named like the columns of its chunks
+        """
+        return list(pd.read_csv(file, nrows=0, dtype=str, keep_default_na=False).columns)
+
+    def iter_jsonl(self, file, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Read a JSON lines file in chunks of `chunk_size` records. Values are kept as they are, without type or date conversion.
+        """
+        yield from pd.read_json(file, lines=True, chunksize=chunk_size, dtype=False, convert_dates=False, keep_default_dates=False)
+
+    def excel_sheet_names(self, file) -> List[str]:
+        workbook = openpyxl.load_workbook(file, read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+
+    def iter_excel(self, file, chunk_size: int, sheet_name: str) -> Iterator[pd.DataFrame]:
+        """
+        Read a sheet of an Excel file in chunks of `chunk_size` rows, streaming it in openpyxl read-only mode.
+        Chunks are indexed by the row number in the sheet. A sheet without rows yields one empty chunk with its columns.
+        """
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook[sheet_name].iter_rows(values_only=True)
+            header = next(rows, ())
+            columns = [f'Unnamed: {position}' if value is None else str(value) for position, value in enumerate(header)]
+            chunk, first_row = [], 2
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield pd.DataFrame(chunk, columns=columns, index=range(first_row, first_row + len(chunk)), dtype=object)
+                    chunk, first_row = [], first_row + len(chunk)
+            if chunk or first_row == 2:
+                yield pd.DataFrame(chunk, columns=columns, index=range(first_row, first_row + len(chunk)), dtype=object)
+        finally:
+            workbook.close()
+
     @staticmethod
     def __get_df_as_str(df):
         for col in df.columns:
             df[col] = df[col].astype(str)
-        return df
\ No newline at end of file
+        return df
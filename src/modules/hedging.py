@@ -0,0 +1,206 @@
+"""
+Hedged requests: when a request runs longer than a percentile of the recent request latencies, a duplicate request is sent
+and the first answer wins. The duplicates are capped to a share of the requests.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+from typing import Dict, Optional
+
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import BaseModel, Field
+
+from modules import metrics, tracing
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Number of recent latencies the percentile is computed on
+LATENCY_WINDOW = 500
+# Number of requests between two log lines of the hedging counters
+STATS_LOG_INTERVAL = 500
+# Threads that run the requests of the synchronous chains, so that a slow request can be raced by its duplicate
+HEDGE_THREADS = 64
+# Seconds between two checks of the hedging delay of a request that started before there were `min_samples` latencies
+DELAY_RECHECK_INTERVAL = 0.25
+
+
+class HedgingConfig(BaseModel):
+    percentile: float = Field(default=95, description='latency percentile after which a duplicate request is sent')
+    max_hedge_ratio: float = Field(default=0.1, description='maximum number of duplicate requests per request')
+    min_samples: int = Field(default=20, description='number of latencies to measure before hedging')
+    min_delay: float = Field(default=1.0, description='minimum seconds to wait before sending a duplicate request')
+
+
+class LatencyTracker:
+    """
+    The latencies of the last `LATENCY_WINDOW` requests that succeeded
+    """
+    def __init__(self, percentile: float):
+        self.percentile = percentile
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._threshold: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self._threshold = None
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def threshold(self) -> float:
+        with self._lock:
+            if self._threshold is None:
+                latencies = sorted(self._latencies)
+                self._threshold = latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))]
+            return self._threshold
+
+
+class Hedger:
+    """
+    Sends a duplicate of the requests that are slower than the configured percentile, within a budget of
+    `max_hedge_ratio` duplicates per request. Safe to use from threads (`invoke`) and from an event loop (`ainvoke`).
+    """
+    def __init__(self, config: HedgingConfig):
+        self.config = config
+        self.latencies = LatencyTracker(config.percentile)
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix='hedged_request')
+
+    def _delay(self) -> Optional[float]:
+        """
+        Seconds to wait for a request before hedging it, None while there are not enough samples yet
+        """
+        if len(self.latencies) < self.config.min_samples:
+            return None
+        return max(self.config.min_delay, self.latencies.threshold())
+
+    def _remaining(self, start: float) -> float:
+        """
+        Seconds left before hedging a request that started at `start`. The delay is computed again every time,
+        so that the requests of a burst that started before there were enough samples are hedged too.
+        """
+        delay = self._delay()
+        if delay is None:
+            return DELAY_RECHECK_INTERVAL
+        return delay - (time.monotonic() - start)
+
+    def _start(self):
+        metrics.LLM_HEDGING.inc(kind='requests')
+        with self._lock:
+            self.requests += 1
+            if self.requests % STATS_LOG_INTERVAL == 0:
+                logger.info(f'Hedging: {self.stats()}')
+
+    def _try_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges >= self.config.max_hedge_ratio * self.requests:
+                return False
+            self.hedges += 1
+        metrics.LLM_HEDGING.inc(kind='hedges')
+        return True
+
+    def _won(self, hedge: bool):
+        if hedge:
+            metrics.LLM_HEDGING.inc(kind='hedges_won')
+            with self._lock:
+                self.hedges_won += 1
+
+    @staticmethod
+    def _winner(done: set, pending: set):
+        """
+        The first attempt that succeeded, or one that failed when both did, None while the other one still runs
+        """
+        for attempt in done:
+            if attempt.exception() is None:
+                return attempt
+        return None if pending else next(iter(done))
+
+    def _submit(self, call, inputs: dict):
+        """
+        Run an attempt on the executor with a copy of the context of the caller, so that its LLM request
+        keeps the trace tags of the job and unit. Every attempt gets its own copy, a context runs on one thread at a time.
+        """
+        return self._executor.submit(tracing.copy_context(self._timed), call, inputs)
+
+    def _timed(self, call, inputs: dict):
+        start = time.monotonic()
+        result = call(inputs)
+        self.latencies.observe(time.monotonic() - start)
+        return result
+
+    async def _atimed(self, call, inputs: dict):
+        start = time.monotonic()
+        result = await call(inputs)
+        self.latencies.observe(time.monotonic() - start)
+        return result
+
+    def wrap(self, chain: Runnable) -> Runnable:
+        """
+        Wrap a chain so that its slow invocations are hedged
+        """
+        def invoke(inputs: dict):
+            self._start()
+            start = time.monotonic()
+            primary = self._submit(chain.invoke, inputs)
+            while (remaining := self._remaining(start)) > 0:
+                done, _ = wait([primary], timeout=remaining)
+                if done:
+                    return primary.result()
+            if not self._try_hedge():
+                return primary.result()
+            hedge = self._submit(chain.invoke, inputs)
+            pending = {primary, hedge}
+            while True:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                # the first answer wins, an error only counts when both requests failed
+                winner = self._winner(done, pending)
+                if winner is not None:
+                    self._won(winner is hedge)
+                    for other in pending:
+                        other.cancel()
+                    return winner.result()
+
+        async def ainvoke(inputs: dict):
+            self._start()
+            start = time.monotonic()
+            primary = asyncio.ensure_future(self._atimed(chain.ainvoke, inputs))
+            hedge = None
+            try:
+                while (remaining := self._remaining(start)) > 0:
+                    done, _ = await asyncio.wait([primary], timeout=remaining)
+                    if done:
+                        return primary.result()
+                if self._try_hedge():
+                    hedge = asyncio.ensure_future(self._atimed(chain.ainvoke, inputs))
+                    pending = {primary, hedge}
+                    while True:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        winner = self._winner(done, pending)
+                        if winner is not None:
+                            self._won(winner is hedge)
+                            return winner.result()
+                return await primary
+            finally:
+                # the request that lost, or both when the caller is cancelled
+                for task in (primary, hedge):
+                    if task is not None:
+                        task.cancel()
+
+        return RunnableLambda(invoke, afunc=ainvoke)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'hedges_won': self.hedges_won,
+            'threshold': round(self.latencies.threshold(), 3) if len(self.latencies) else None,
+        }
@@ -0,0 +1,282 @@
+"""
+A small metrics registry rendered in the Prometheus text format, for the `/metrics` endpoint of the API.
+
+Worker processes of the pool do not render metrics: their updates are buffered and sent to the API process
+through the queue given to the pool initializer, and merged there by a collector thread.
+"""
+
+from contextlib import contextmanager
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import openai
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Upper bounds of the buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+IO_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+# seconds between two flushes of the updates of a worker process
+FLUSH_INTERVAL = 1.0
+
+_registry: Dict[str, 'Metric'] = {}
+# queue to the API process, in a worker process of the pool
+_sink = None
+_buffer: List[Tuple[str, Tuple[str, ...], str, float]] = []
+_buffer_lock = threading.Lock()
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+class Metric:
+    """
+    A metric with one value per combination of label values
+    """
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _update(self, key: Tuple[str, ...], op: str, value: float):
+        if _sink is not None:
+            with _buffer_lock:
+                _buffer.append((self.name, key, op, value))
+            return
+        self._apply(key, op, value)
+
+    def _apply(self, key: Tuple[str, ...], op: str, value: float):
+        with self._lock:
+            self._values[key] = value if op == 'set' else self._values.get(key, 0) + value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                    for key, value in sorted(self._values.items())]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, value: float = 1, **labels):
+        self._update(self._key(labels), 'inc', value)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, value: float = 1, **labels):
+        self._update(self._key(labels), 'inc', value)
+
+    def dec(self, value: float = 1, **labels):
+        self._update(self._key(labels), 'inc', -value)
+
+    def set(self, value: float, **labels):
+        self._update(self._key(labels), 'set', value)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # label values -> (count per bucket, sum, count)
+        self._histograms: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        self._update(self._key(labels), 'observe', value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def _apply(self, key: Tuple[str, ...], op: str, value: float):
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][position] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names + ('le',), key + (_format_value(bound),))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.label_names, key)
+                lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+LLM_REQUEST_SECONDS = Histogram('llm_request_duration_seconds', 'Latency of the LLM requests', ('model', 'language'))
+LLM_REQUEST_ERRORS = Counter('llm_request_errors_total', 'LLM requests that failed, by kind: rate_limited or error', ('model', 'kind'))
+LLM_TOKENS = Counter('llm_tokens_total', 'Tokens of the LLM requests, by kind: prompt or completion', ('model', 'kind'))
+LLM_IN_FLIGHT = Gauge('llm_requests_in_flight', 'LLM requests waiting for their answer', ('model',))
+LLM_RETRIES = Counter('llm_retries_total', 'Translations sent again after a failed attempt', ('language',))
+LLM_HEDGING = Counter('llm_hedging_total', 'Requests of the hedged chains, by kind: requests, hedges sent or hedges_won', ('kind',))
+TEXTS_TRANSLATED = Counter('translation_texts_total', 'Texts translated by a task, by outcome: ok, partial or failed', ('outcome',))
+QUEUE_DEPTH = Gauge('translation_queue_depth', 'Work units of the running jobs that are not translated yet')
+JOB_PROGRESS = Gauge('translation_job_progress', 'Counters of the jobs, e.g. units_done or translations_done', ('job_id', 'counter'))
+FILE_IO_SECONDS = Histogram('file_io_duration_seconds', 'Duration of reading the inputs and writing the outputs',
+                            ('operation', 'format'), buckets=IO_BUCKETS)
+
+
+def render() -> str:
+    """
+    All the metrics of the process in the Prometheus text format
+    """
+    lines = []
+    for metric in list(_registry.values()):
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def configure_worker(sink):
+    """
+    Send the metrics of this worker process to the API process through the `sink` queue, see `flush`.
+    The updates are flushed every `FLUSH_INTERVAL` seconds by a daemon thread, so that the requests in flight
+    and the latencies of a long task show up while it runs.
+    """
+    global _sink
+    _sink = sink
+    if sink is None:
+        return
+
+    def run():
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                flush()
+            except (ValueError, OSError):
+                # the queue is closed when the pool shuts down
+                return
+
+    threading.Thread(target=run, daemon=True, name='metrics_flusher').start()
+
+
+def flush():
+    """
+    Send the buffered updates of a worker process to the API process. Called at the end of every task and on a timer.
+    """
+    global _buffer
+    if _sink is None:
+        return
+    with _buffer_lock:
+        updates, _buffer = _buffer, []
+    if updates:
+        _sink.put(updates)
+
+
+def collect(source):
+    """
+    Merge the updates sent by the worker processes into the metrics of this process, on a daemon thread
+    """
+    def run():
+        while True:
+            try:
+                updates = source.get()
+            except (EOFError, OSError):
+                return
+            for name, key, op, value in updates:
+                _registry[name]._apply(key, op, value)
+
+    threading.Thread(target=run, daemon=True, name='metrics_collector').start()
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    return isinstance(error, openai.RateLimitError) or getattr(error, 'status_code', None) == 429
+
+
+def instrument(chain: Runnable, model_name: str) -> Runnable:
+    """
+    Wrap a chain to measure every request: latency per language, errors, 429s and requests in flight
+    """
+    def observe(inputs: dict, start: float, error: Optional[Exception]):
+        if error is None:
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - start, model=model_name, language=inputs.get('language', 'multi'))
+        else:
+            LLM_REQUEST_ERRORS.inc(model=model_name, kind='rate_limited' if _is_rate_limited(error) else 'error')
+
+    def invoke(inputs: dict):
+        LLM_IN_FLIGHT.inc(model=model_name)
+        start = time.monotonic()
+        try:
+            result = chain.invoke(inputs)
+        except Exception as e:
+            observe(inputs, start, e)
+            raise
+        finally:
+            LLM_IN_FLIGHT.dec(model=model_name)
+        observe(inputs, start, None)
+        return result
+
+    async def ainvoke(inputs: dict):
+        LLM_IN_FLIGHT.inc(model=model_name)
+        start = time.monotonic()
+        try:
+            result = await chain.ainvoke(inputs)
+        except Exception as e:
+            observe(inputs, start, e)
+            raise
+        finally:
+            # also when the request is cancelled
+            LLM_IN_FLIGHT.dec(model=model_name)
+        observe(inputs, start, None)
+        return result
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+
+def token_usage(model_name: str):
+    """
+    A chain step that counts the prompt and completion tokens of the model answers and passes them on
+    """
+    def record(message):
+        usage = (getattr(message, 'response_metadata', None) or {}).get('token_usage') or {}
+        if usage:
+            LLM_TOKENS.inc(usage.get('prompt_tokens', 0), model=model_name, kind='prompt')
+            LLM_TOKENS.inc(usage.get('completion_tokens', 0), model=model_name, kind='completion')
+        return message
+
+    return RunnableLambda(record)
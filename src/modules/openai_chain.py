@@ -5,8 +5,10 @@ This module is responsible for creating the chain of modules for OpenAI
 from langchain_core.runnables import RunnableSequence
 from langchain_core.output_parsers import StrOutputParser
 
+from modules import metrics, tracing
 from modules.model_config import ModelConfig
 from modules.openai_model import OpenAImodel
+from modules.token_counter import count_tokens
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -15,17 +17,43 @@ class OpenAIchain:
     """
     class to create the chain of modules for OpenAI
     """
-    def __init__(self,prompt, model_config: ModelConfig):
+    def __init__(self,prompt, model_config: ModelConfig, json_mode: bool = False, rate_limiter=None, hedger=None):
         self.model_config = model_config
         self.prompt = prompt
+        self.json_mode = json_mode
+        self.rate_limiter = rate_limiter
+        self.hedger = hedger
+        # the async HTTP client of the model of the last chain created
+        self.http_async_client = None
+
+    def estimate_tokens(self, inputs: dict) -> int:
+        """
+        Estimate the tokens of a request: the formatted prompt plus a completion about as long as the inputs
+        """
+        model_name = self.model_config.llm_model_name
+        prompt_tokens = count_tokens(self.prompt.format(**inputs), model_name)
+        return prompt_tokens + sum(count_tokens(str(value), model_name) for value in inputs.values())
 
     def create_chain(self) -> RunnableSequence:
         """
         create the chain of modules for OpenAI
         """
         try:
-            model = OpenAImodel(self.model_config).get_model()
+            openai_model = OpenAImodel(self.model_config, self.rate_limiter)
+            self.http_async_client = openai_model.http_async_client
+            model = openai_model.get_model()
+            if self.json_mode:
+                # constrain the model to answer with a valid JSON object
+                model = model.bind(response_format={'type': 'json_object'})
             output_parser = StrOutputParser()
-            return self.prompt | model | output_parser
+            model_name = self.model_config.llm_model_name
+            chain = metrics.instrument(self.prompt | model | metrics.token_usage(model_name) | output_parser, model_name)
+            chain = tracing.instrument(chain, model_name)
+            if self.rate_limiter is not None:
+                chain = self.rate_limiter.wrap(chain, self.estimate_tokens)
+            if self.hedger is not None:
+                # hedge outside the rate limiter, so that every duplicate request waits for and is charged to the budgets
+                chain = self.hedger.wrap(chain)
+            return chain
         except Exception as e:
             logger.error(f"Error creating OpenAI chain: {str(e)}")
@@ -3,6 +3,7 @@ A module to handle the OpenAI model
 """
 
 
+import httpx
 from langchain_openai import ChatOpenAI
 
 from modules.model_config import ModelConfig
@@ -10,9 +11,39 @@ from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Same timeout and connection limits as the default client of the openai package
+HTTP_TIMEOUT = httpx.Timeout(timeout=600.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+# retries of a request that failed without a response, when the rate limiter handles the error responses
+CONNECTION_RETRIES = 1
+
 class OpenAImodel:
-    def __init__(self, model_config: ModelConfig):
-        self._model = ChatOpenAI(temperature=model_config.temperature, openai_api_key=model_config.openai_api_key, model=model_config.llm_model_name)
+    def __init__(self, model_config: ModelConfig, rate_limiter=None):
+        kwargs = {}
+        async_hooks = {}
+        if rate_limiter is not None:
+            # let the rate limiter see the rate limit headers of every response, and handle 429s itself
+            # instead of the client retrying them behind its back. The other error responses are retried by the callers;
+            # the client only retries the requests that got no response, e.g. on a keep-alive connection the server closed.
+            def observe_response(response):
+                rate_limiter.observe_headers(response.headers)
+                response.headers['x-should-retry'] = 'false'
+
+            async def aobserve_response(response):
+                observe_response(response)
+
+            kwargs['max_retries'] = CONNECTION_RETRIES
+            kwargs['http_client'] = httpx.Client(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS,
+                                                 event_hooks={'response': [observe_response]})
+            async_hooks = {'response': [aobserve_response]}
+        # the connections of an async client belong to the event loop that opened them, so the chain registry
+        # builds the async chains per event loop and closes this client with the loop, see `chain_registry.get_chain`
+        self.http_async_client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS, event_hooks=async_hooks)
+        kwargs['http_async_client'] = self.http_async_client
+        if model_config.base_url:
+            kwargs['base_url'] = model_config.base_url
+        self._model = ChatOpenAI(temperature=model_config.temperature, openai_api_key=model_config.openai_api_key, model=model_config.llm_model_name,
+                                 **kwargs)
 
     def get_model(self):
         return self._model
\ No newline at end of file
@@ -0,0 +1,210 @@
+"""
+A rate-limit-aware scheduler for the LLM requests.
+Requests and tokens per minute are budgeted with token buckets, and the number of requests in flight
+adapts to the responses: it grows additively on success and is cut multiplicatively on 429s.
+"""
+
+import asyncio
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import openai
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import BaseModel, Field
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Seconds to wait for a free slot before checking again
+POLL_INTERVAL = 0.05
+# Minimum seconds between two multiplicative decreases, so that one burst of 429s only halves the concurrency once
+DECREASE_COOLDOWN = 2.0
+
+
+class RateLimitConfig(BaseModel):
+    requests_per_minute: int = Field(default=500, description='requests per minute quota of the account')
+    tokens_per_minute: int = Field(default=30000, description='tokens per minute quota of the account')
+    max_concurrency: int = Field(default=100, description='maximum number of requests in flight')
+    min_concurrency: int = Field(default=1, description='minimum number of requests in flight')
+
+    def per_process(self, processes: int) -> 'RateLimitConfig':
+        """
+        The share of the budget of one of `processes` worker processes
+        """
+        return RateLimitConfig(requests_per_minute=max(1, self.requests_per_minute // processes),
+                               tokens_per_minute=max(1, self.tokens_per_minute // processes),
+                               max_concurrency=max(1, self.max_concurrency // processes),
+                               min_concurrency=max(1, min(self.min_concurrency, self.max_concurrency // processes)))
+
+
+class TokenBucket:
+    """
+    A bucket of `per_minute` units that refills continuously
+    """
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` units are available. Requests larger than the bucket only wait for a full bucket.
+        """
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.available >= amount else (amount - self.available) / self.rate
+
+    def consume(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+    def limit(self, remaining: float, now: float):
+        """
+        Align the bucket with the remaining quota reported by the server
+        """
+        self._refill(now)
+        self.available = min(self.available, remaining)
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """
+    Parse the durations of the rate limit headers, e.g. '20ms', '1s', '6m0s'
+    """
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    parts = re.findall(r'([\d.]+)(ms|s|m|h)', value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+class RateLimiter:
+    """
+    Schedules the requests of a process within its requests/tokens per minute budget and an adaptive concurrency.
+    Safe to use from threads (`acquire`) and from an event loop (`aacquire`).
+    """
+    def __init__(self, config: RateLimitConfig):
+        self.config = config
+        self.requests = TokenBucket(config.requests_per_minute)
+        self.tokens = TokenBucket(config.tokens_per_minute)
+        self.concurrency = float(config.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.completed = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def _try_start(self, tokens: int) -> float:
+        """
+        Start a request if the budgets allow it, otherwise return the number of seconds to wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.in_flight >= int(self.concurrency):
+                return POLL_INTERVAL
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def acquire(self, tokens: int):
+        while (wait := self._try_start(tokens)) > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int):
+        while (wait := self._try_start(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def release(self, rate_limited: bool = False, retry_after: Optional[float] = None):
+        """
+        Finish a request. Success grows the concurrency by about one per round of requests, a 429 halves it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if rate_limited:
+                self.rate_limited += 1
+                self.paused_until = max(self.paused_until, now + (retry_after or 1.0))
+                if now - self.last_decrease > DECREASE_COOLDOWN:
+                    self.concurrency = max(self.config.min_concurrency, self.concurrency / 2)
+                    self.last_decrease = now
+                    logger.warning(f'Rate limited, concurrency reduced to {int(self.concurrency)}')
+            else:
+                self.completed += 1
+                self.concurrency = min(self.config.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def observe_headers(self, headers: Dict[str, str]):
+        """
+        Align the budgets with the x-ratelimit-* and retry-after headers of a response, when present
+        """
+        with self._lock:
+            now = time.monotonic()
+            if 'x-ratelimit-remaining-requests' in headers:
+                self.requests.limit(float(headers['x-ratelimit-remaining-requests']), now)
+            if 'x-ratelimit-remaining-tokens' in headers:
+                self.tokens.limit(float(headers['x-ratelimit-remaining-tokens']), now)
+            retry_after = headers.get('retry-after-ms')
+            retry_after = float(retry_after) / 1000 if retry_after else _parse_duration(headers.get('retry-after', ''))
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        response = getattr(error, 'response', None)
+        return _parse_duration(response.headers.get('retry-after', '')) if response is not None else None
+
+    @staticmethod
+    def _is_rate_limited(error: Exception) -> bool:
+        return isinstance(error, openai.RateLimitError) or getattr(error, 'status_code', None) == 429
+
+    def wrap(self, chain: Runnable, estimate_tokens: Callable[[dict], int]) -> Runnable:
+        """
+        Wrap a chain so that every invocation waits for the budgets and reports its outcome
+        """
+        def invoke(inputs: dict):
+            self.acquire(estimate_tokens(inputs))
+            rate_limited, retry_after = False, None
+            try:
+                return chain.invoke(inputs)
+            except Exception as e:
+                rate_limited, retry_after = self._is_rate_limited(e), self._retry_after(e)
+                raise
+            finally:
+                self.release(rate_limited, retry_after)
+
+        async def ainvoke(inputs: dict):
+            await self.aacquire(estimate_tokens(inputs))
+            rate_limited, retry_after = False, None
+            try:
+                return await chain.ainvoke(inputs)
+            except Exception as e:
+                rate_limited, retry_after = self._is_rate_limited(e), self._retry_after(e)
+                raise
+            finally:
+                # also when the request is cancelled, which is not an Exception, so that it gives its slot back
+                self.release(rate_limited, retry_after)
+
+        return RunnableLambda(invoke, afunc=ainvoke)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'concurrency': int(self.concurrency),
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'rate_limited': self.rate_limited,
+        }
@@ -0,0 +1,189 @@
+"""
+A module to carry the translations of a previous output over to the rows whose source text did not change,
+so that a new version of a file only has its changed rows translated
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from modules.streaming_io import read_chunks, target_columns
+from utils.utils import cell_text
+
+# Cell category of the rows whose translations are carried over, see `modules.cell_filter`
+UNCHANGED = 'unchanged'
+# rows looked up at a time in the translations of a previous output
+LOOKUP_BATCH_SIZE = 500
+
+
+def source_hashes(series: pd.Series) -> pd.Series:
+    """
+    Vectorized 64-bit hashes of source texts, stable across runs
+    """
+    return pd.util.hash_pandas_object(series.astype(str), index=False)
+
+
+def _empty_to_none(cells: pd.DataFrame) -> pd.DataFrame:
+    cells = cells.astype(object)
+    return cells.where(cells.notna() & ~cells.isin(['nan', '']), None)
+
+
+class Fingerprint:
+    """
+    The source hash of every row of the translated columns of a job, saved next to its output
+    """
+    def __init__(self):
+        self._columns: Dict[Tuple[Optional[str], str], List[pd.Series]] = {}
+
+    def add(self, sheet: Optional[str], column: str, series: pd.Series):
+        self._columns.setdefault((sheet, column), []).append(source_hashes(series))
+
+    def save(self, path: str):
+        columns = []
+        for (sheet, column), hashes in self._columns.items():
+            hashes = pd.concat(hashes)
+            columns.append({'sheet': sheet, 'column': column, 'rows': hashes.index.tolist(), 'hashes': hashes.tolist()})
+        with open(path, 'w') as f:
+            json.dump({'columns': columns}, f)
+
+
+class Baseline:
+    """
+    The source hashes and translations of the rows of a previous version of a file, per (sheet, column).
+    A baseline built from a previous output carries its translations over to the rows with the same source text,
+    matched by row number first and by source text for the rows that moved. Only the 64-bit source hashes are kept
+    in memory: the translations are stored in a temporary SQLite file and read only for the rows that are carried over,
+    so a streamed file is compared with its previous output in memory bounded by the hashes, not by the texts.
+    A baseline built from a fingerprint has no translations: the rows with the same source text at the same row number
+    keep the translations the new file already has.
+    """
+    def __init__(self, language_codes: List[str]):
+        self.language_codes = language_codes
+        self._hashes: Dict[Tuple[Optional[str], str], pd.Series] = {}
+        # by source hash of a previous output, the first row with a translation in every language, -1 for none,
+        # to find the translations of the rows that moved
+        self._first_rows: Dict[Tuple[Optional[str], str], pd.DataFrame] = {}
+        # id of every (sheet, column) of a previous output in the translations store
+        self._column_ids: Dict[Tuple[Optional[str], str], int] = {}
+        self._store: Optional[sqlite3.Connection] = None
+        self._store_path: Optional[str] = None
+
+    @classmethod
+    def from_output(cls, path: str, file_format: str, columns: Dict[Optional[str], Dict[str, str]], language_codes: List[str],
+                    chunk_size: int = 10000, store_dir: Optional[str] = None) -> 'Baseline':
+        """
+        Read the source and target columns of a previous output. `columns` maps every sheet to its source columns
+        and the pattern of their target columns. The translations are stored in a temporary file in `store_dir`
+        until `close`.
+        """
+        baseline = cls(language_codes)
+        baseline._open_store(store_dir)
+        hashes, translated = {}, {}
+        for sheet, chunk in read_chunks(path, file_format, chunk_size):
+            for column, pattern in columns.get(sheet, {}).items():
+                if column not in chunk.columns:
+                    continue
+                targets = target_columns(list(chunk.columns), language_codes, pattern)
+                cells = pd.DataFrame({language_code: chunk[target] if target else None
+                                      for language_code, target in zip(language_codes, targets)}, index=chunk.index)
+                cells = _empty_to_none(cells)
+                hashes.setdefault((sheet, column), []).append(source_hashes(chunk[column].map(cell_text)))
+                translated.setdefault((sheet, column), []).append(cells.notna())
+                column_id = baseline._column_ids.setdefault((sheet, column), len(baseline._column_ids))
+                baseline._store.executemany('INSERT OR REPLACE INTO translations VALUES (?, ?, ?)',
+                                            ((column_id, row, json.dumps(translations, ensure_ascii=False, default=str))
+                                             for row, translations in zip(chunk.index.tolist(), cells.to_numpy().tolist())))
+        baseline._store.commit()
+        for key in hashes:
+            column_hashes = baseline._hashes[key] = pd.concat(hashes[key])
+            column_translated = pd.concat(translated[key])
+            first_rows = pd.DataFrame(-1, index=pd.Index(column_hashes.drop_duplicates().to_numpy()), columns=language_codes)
+            for language_code in language_codes:
+                first = column_hashes[column_translated[language_code].to_numpy()].drop_duplicates()
+                first_rows.loc[first.to_numpy(), language_code] = first.index.to_numpy()
+            baseline._first_rows[key] = first_rows
+        return baseline
+
+    @classmethod
+    def from_fingerprint(cls, path: str, language_codes: List[str]) -> 'Baseline':
+        baseline = cls(language_codes)
+        with open(path, 'r') as f:
+            fingerprint = json.load(f)
+        for column in fingerprint['columns']:
+            baseline._hashes[(column['sheet'], column['column'])] = pd.Series(column['hashes'], index=column['rows'], dtype='uint64')
+        return baseline
+
+    def _open_store(self, store_dir: Optional[str]):
+        if store_dir is not None:
+            os.makedirs(store_dir, exist_ok=True)
+        fd, self._store_path = tempfile.mkstemp(prefix='baseline_', suffix='.sqlite', dir=store_dir)
+        os.close(fd)
+        self._store = sqlite3.connect(self._store_path, check_same_thread=False)
+        # a scratch file, dropped with the baseline
+        self._store.execute('PRAGMA journal_mode=OFF')
+        self._store.execute('PRAGMA synchronous=OFF')
+        self._store.execute('CREATE TABLE translations (column_id INTEGER, row INTEGER, translations TEXT, PRIMARY KEY (column_id, row))')
+
+    def _translations(self, column_id: int, rows: Iterable[int]) -> Dict[int, List[Optional[str]]]:
+        """
+        The stored translations of some rows of a previous output, by row
+        """
+        rows = list(rows)
+        found = {}
+        for start in range(0, len(rows), LOOKUP_BATCH_SIZE):
+            batch = rows[start:start + LOOKUP_BATCH_SIZE]
+            found.update((row, json.loads(translations)) for row, translations in self._store.execute(
+                f"SELECT row, translations FROM translations WHERE column_id = ? AND row IN ({','.join('?' * len(batch))})",
+                [column_id, *batch]))
+        return found
+
+    def carry_over(self, sheet: Optional[str], column: str, series: pd.Series,
+                   targets: pd.DataFrame) -> Dict[int, List[Optional[str]]]:
+        """
+        The translations to keep for the rows of a source column whose source text did not change, by row.
+        `targets` holds the target cells of the new file, one column per language that has a target column.
+        Translations are listed per language: None when missing, '' for the languages the new file has no column for.
+        """
+        previous = self._hashes.get((sheet, column))
+        if previous is None or not len(series):
+            return {}
+        hashes = source_hashes(series)
+        unchanged = pd.Series(False, index=hashes.index)
+        same_rows = hashes.index.intersection(previous.index)
+        unchanged[same_rows] = previous[same_rows].to_numpy() == hashes[same_rows].to_numpy()
+        if (sheet, column) in self._column_ids:
+            # the unchanged rows take the translations of the same row of the previous output, the rows that moved
+            # the first translation of the same source text in every language
+            first_rows = self._first_rows[(sheet, column)]
+            moved = ~unchanged & hashes.isin(first_rows.index)
+            moved_rows = first_rows.loc[hashes[moved].to_numpy()].set_axis(hashes.index[moved.to_numpy()])
+            same_rows = hashes.index[unchanged.to_numpy()]
+            needed = set(same_rows.tolist()) | set(moved_rows.to_numpy().ravel().tolist())
+            needed.discard(-1)
+            stored = self._translations(self._column_ids[(sheet, column)], sorted(needed))
+            missing = [None for _ in self.language_codes]
+            carried = pd.DataFrame([stored.get(row, missing) for row in same_rows.tolist()], index=same_rows, columns=self.language_codes)
+            moved_translations = pd.DataFrame(
+                [[stored[row][position] if row != -1 else None for position, row in enumerate(rows)]
+                 for rows in moved_rows.to_numpy().tolist()], index=moved_rows.index, columns=self.language_codes)
+            carried = pd.concat([carried, moved_translations]).reindex(hashes.index[(unchanged | moved).to_numpy()])
+        else:
+            carried = _empty_to_none(targets).reindex(columns=self.language_codes)[unchanged.to_numpy()]
+        carried = _empty_to_none(carried.reindex(columns=self.language_codes))
+        for language_code in self.language_codes:
+            if language_code not in targets.columns:
+                carried[language_code] = ''
+        return dict(zip(carried.index.tolist(), carried.to_numpy().tolist()))
+
+    def close(self):
+        """
+        Delete the stored translations of a previous output
+        """
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+            os.remove(self._store_path)
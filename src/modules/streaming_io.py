@@ -0,0 +1,176 @@
+"""
+A module to stream large CSV, JSON lines and Excel inputs through the translation in chunks of rows,
+so that memory depends on the chunk size instead of the file size
+"""
+
+import os
+import queue
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+import openpyxl
+import pandas as pd
+
+from modules import metrics, tracing
+from modules.data_reader import DataReader
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+FILE_FORMATS = ('xlsx', 'csv', 'jsonl')
+
+
+def file_format(file_name: Optional[str]) -> str:
+    """
+    The input format of an uploaded file, from its extension. Files without an extension are taken as Excel.
+    """
+    extension = os.path.splitext(file_name or '')[1].lower().lstrip('.')
+    extension = {'xlsm': 'xlsx', 'ndjson': 'jsonl', '': 'xlsx'}.get(extension, extension)
+    if extension not in FILE_FORMATS:
+        raise ValueError(f"Unsupported file format '{extension}', expected one of {', '.join(FILE_FORMATS)}")
+    return extension
+
+
+def read_chunks(path: str, file_format: str, chunk_size: int) -> Iterator[Tuple[Optional[str], pd.DataFrame]]:
+    """
+    Yield the (sheet, chunk) of every chunk of rows of a file, sheet after sheet for Excel files.
+    CSV and JSON lines files have a single sheet, None. Chunks are indexed by the row number in the file, the header being row 1.
+    """
+    chunks = _read_chunks(path, file_format, chunk_size)
+    while True:
+        with metrics.FILE_IO_SECONDS.time(operation='read', format=file_format), tracing.span('read_chunk'):
+            item = next(chunks, None)
+        if item is None:
+            return
+        yield item
+
+
+def _read_chunks(path: str, file_format: str, chunk_size: int) -> Iterator[Tuple[Optional[str], pd.DataFrame]]:
+    reader = DataReader()
+    if file_format == 'xlsx':
+        for sheet in reader.excel_sheet_names(path):
+            for chunk in reader.iter_excel(path, chunk_size, sheet):
+                yield sheet, chunk
+        return
+    # JSON lines files have no header row
+    first_row = 2 if file_format == 'csv' else 1
+    chunks = reader.iter_csv(path, chunk_size) if file_format == 'csv' else reader.iter_jsonl(path, chunk_size)
+    for chunk in chunks:
+        chunk.index = range(first_row, first_row + len(chunk))
+        first_row += len(chunk)
+        yield None, chunk
+
+
+def prefetch(chunks: Iterator, size: int = 2) -> Iterator:
+    """
+    Read the next `size` chunks on a background thread while the current one is being translated
+    """
+    buffer = queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(done)
+
+    threading.Thread(target=tracing.copy_context(read), daemon=True, name='chunk_reader').start()
+    try:
+        while (chunk := buffer.get()) is not done:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stop.set()
+
+
+def target_columns(columns: List[str], language_codes: List[str], pattern: str) -> List[Optional[str]]:
+    """
+    The `{language_code} {pattern}` column of every language, None for the languages without a column
+    """
+    return [f'{language_code} {pattern}' if f'{language_code} {pattern}' in columns else None for language_code in language_codes]
+
+
+def set_chunk_translations(chunk: pd.DataFrame, results: List[Tuple[int, Optional[List[str]]]], language_codes: List[str], pattern: str):
+    """
+    Patch the (row number, translations) results into the target columns of a chunk.
+    Missing translations leave the target cell as it is.
+    """
+    targets = [(position, column) for position, column
+               in enumerate(target_columns(list(chunk.columns), language_codes, pattern)) if column is not None]
+    for position, column in targets:
+        translated = {row: translations[position] for row, translations in results if translations and translations[position]}
+        if translated:
+            chunk[column] = chunk[column].astype(object)
+            chunk.loc[list(translated), column] = list(translated.values())
+
+
+def read_header(path: str, file_format: str) -> Optional[List[str]]:
+    """
+    The column names of a CSV file, None for the other formats: JSON lines files have no header row
+    and Excel sheets are written with the columns of their first chunk
+    """
+    return DataReader().csv_header(path) if file_format == 'csv' else None
+
+
+class ChunkWriter:
+    """
+    Appends the translated chunks to the output file as they are done: CSV and JSON lines files are appended to,
+    Excel files are written with a write-only workbook.
+    CSV and JSON lines files are created when the writer is opened, with the header row of `columns` for CSV files,
+    so that an input without data rows still has an output.
+    """
+    def __init__(self, path: str, file_format: str, columns: Optional[List[str]] = None):
+        self.path = path
+        self.file_format = file_format
+        self._started = False
+        self._workbook = openpyxl.Workbook(write_only=True) if file_format == 'xlsx' else None
+        self._sheet_name = None
+        self._sheet = None
+        if file_format == 'csv' and columns is not None:
+            pd.DataFrame(columns=columns).to_csv(path, index=False)
+            self._started = True
+        elif file_format in ('csv', 'jsonl'):
+            open(path, 'w').close()
+
+    def write(self, chunk: pd.DataFrame, sheet: Optional[str] = None):
+        with metrics.FILE_IO_SECONDS.time(operation='write', format=self.file_format), tracing.span('write_chunk', rows=len(chunk)):
+            self._write(chunk, sheet)
+        self._started = True
+
+    def _write(self, chunk: pd.DataFrame, sheet: Optional[str]):
+        if self.file_format == 'csv':
+            chunk.to_csv(self.path, mode='a' if self._started else 'w', header=not self._started, index=False)
+        elif self.file_format == 'jsonl':
+            with open(self.path, 'a' if self._started else 'w', encoding='utf-8') as f:
+                if len(chunk):
+                    f.write(chunk.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n')
+        else:
+            if self._sheet is None or sheet != self._sheet_name:
+                logger.info(f"Processing sheet: {sheet}")
+                self._sheet_name = sheet
+                self._sheet = self._workbook.create_sheet(sheet)
+                if len(chunk.columns):
+                    self._sheet.append([None if column == f'Unnamed: {position}' else column
+                                        for position, column in enumerate(chunk.columns)])
+            for row in chunk.itertuples(index=False, name=None):
+                self._sheet.append([None if not isinstance(value, str) and pd.isna(value) else value for value in row])
+
+    def close(self):
+        if self._workbook is not None:
+            with metrics.FILE_IO_SECONDS.time(operation='write', format=self.file_format), tracing.span('write_output'):
+                self._workbook.save(self.path)
@@ -0,0 +1,81 @@
+"""
+A module to pack several translations into a single structured (JSON) request:
+several short texts to one language, or one text to several languages
+"""
+
+import json
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from modules.token_counter import count_tokens
+
+
+class PackingConfig(BaseModel):
+    max_pack_tokens: int = Field(default=1000, description='maximum number of source tokens in one packed request')
+    max_pack_items: int = Field(default=50, description='maximum number of texts in one packed request')
+
+
+class PackedResponseError(ValueError):
+    """
+    The response to a packed request is not a JSON object of translations
+    """
+
+
+def pack_texts(texts: List[str], packing: PackingConfig, model_name: str) -> List[List[int]]:
+    """
+    Group the texts into packs that stay under the token budget. Returns the positions of the texts of every pack.
+    A text that is over the budget on its own gets a pack of its own.
+    """
+    packs, pack, pack_tokens = [], [], 0
+    for position, text in enumerate(texts):
+        tokens = count_tokens(text, model_name)
+        if pack and (pack_tokens + tokens > packing.max_pack_tokens or len(pack) >= packing.max_pack_items):
+            packs.append(pack)
+            pack, pack_tokens = [], 0
+        pack.append(position)
+        pack_tokens += tokens
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def packed_payload(texts: List[str]) -> str:
+    return json.dumps({str(i): text for i, text in enumerate(texts)}, ensure_ascii=False)
+
+
+def parse_json_object(response: str) -> dict:
+    """
+    Parse a structured response, tolerating a markdown code fence around the JSON object
+    """
+    content = response.strip()
+    if content.startswith('```'):
+        content = content.strip('`')
+        content = content[content.find('{'):] if '{' in content else content
+    try:
+        parsed = json.loads(content)
+    except (json.JSONDecodeError, TypeError) as e:
+        raise PackedResponseError(f'response is not valid JSON: {e}')
+    if not isinstance(parsed, dict):
+        raise PackedResponseError('response is not a JSON object')
+    return parsed
+
+
+def _valid_translation(translation) -> Optional[str]:
+    return translation if isinstance(translation, str) and translation.strip() else None
+
+
+def parse_packed_response(response: str, size: int) -> List[Optional[str]]:
+    """
+    Parse the response to a packed request of `size` texts. Items that are missing or not a string are None.
+    """
+    translations = parse_json_object(response)
+    return [_valid_translation(translations.get(str(i))) for i in range(size)]
+
+
+def parse_languages_response(response: str, language_codes: List[str]) -> List[Optional[str]]:
+    """
+    Parse the response to a multi-language request. Languages that are missing or not a string are None.
+    """
+    translations = parse_json_object(response)
+    return [_valid_translation(translations.get(lang)) for lang in language_codes]
@@ -0,0 +1,83 @@
+"""
+A module to split long texts into segments that are translated on their own and joined back in order
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+from modules.token_counter import count_tokens
+
+# Boundaries to split at, from the coarsest to the finest. The whitespace of a boundary is kept as it is.
+PARAGRAPH_BREAK = re.compile(r'(\s*\n\s*\n\s*)')
+LINE_BREAK = re.compile(r'(\s*\n\s*)')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?…。！？])(\s+)')
+BOUNDARIES = (PARAGRAPH_BREAK, LINE_BREAK, SENTENCE_BREAK)
+
+
+class TextSegmenter:
+    """
+    Splits texts over `max_tokens` tokens at paragraph, line or sentence boundaries into segments under the threshold.
+    Consecutive pieces are merged back up to the threshold, so that segments keep as much context as possible.
+    A sentence that is over the threshold on its own stays a single segment.
+    """
+    def __init__(self, max_tokens: int, model_name: str):
+        self.max_tokens = max_tokens
+        self.model_name = model_name
+
+    def _tokens(self, text: str) -> int:
+        return count_tokens(text, self.model_name)
+
+    def _split(self, text: str, boundaries=BOUNDARIES) -> List[str]:
+        """
+        Split a text into alternating [piece, separator, piece, ...] parts, only as far as needed
+        """
+        if not boundaries or self._tokens(text) <= self.max_tokens:
+            return [text]
+        parts = boundaries[0].split(text)
+        if len(parts) == 1:
+            return self._split(text, boundaries[1:])
+        result = []
+        for position, part in enumerate(parts):
+            if position % 2:
+                result.append(part)
+            else:
+                result.extend(self._split(part, boundaries[1:]))
+        return result
+
+    def split(self, text: str) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Split a long text into segments. Returns the segments and the whitespace around them, one more separator
+        than segments, or None if the text does not need to be split.
+        """
+        match = re.fullmatch(r'(\s*)(.*?)(\s*)', text, re.S)
+        leading, core, trailing = match.groups()
+        if self._tokens(core) <= self.max_tokens:
+            return None
+        parts = self._split(core)
+        pieces, boundaries = parts[0::2], parts[1::2]
+
+        segments, separators = [], [leading]
+        current, current_tokens = pieces[0], self._tokens(pieces[0])
+        for separator, piece in zip(boundaries, pieces[1:]):
+            tokens = self._tokens(piece)
+            if current_tokens + tokens <= self.max_tokens:
+                current += separator + piece
+                current_tokens += tokens
+            else:
+                segments.append(current)
+                separators.append(separator)
+                current, current_tokens = piece, tokens
+        segments.append(current)
+        separators.append(trailing)
+        if len(segments) == 1:
+            return None
+        return segments, separators
+
+
+def join_segments(translations: List[Optional[str]], separators: List[str]) -> Optional[str]:
+    """
+    Join the translations of the segments of a text with the original whitespace. None if a segment is missing.
+    """
+    if not all(translations):
+        return None
+    return separators[0] + ''.join(translation.strip() + separator for translation, separator in zip(translations, separators[1:]))
@@ -0,0 +1,37 @@
+"""
+A module to estimate the number of tokens of a text locally, before it is sent to the model
+"""
+
+from functools import lru_cache
+
+import tiktoken
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Rough number of characters per token, used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model_name: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base' if model_name.startswith('gpt-4o') else 'cl100k_base')
+    except Exception as e:
+        # tiktoken downloads its encodings on first use, which fails without network access
+        logger.warning(f'No tokenizer available for {model_name}, estimating tokens from characters: {e}')
+        return None
+
+
+def count_tokens(text: str, model_name: str = 'gpt-3.5-turbo') -> int:
+    """
+    Number of tokens of the text for the model, or an estimate if the tokenizer can't be loaded
+    """
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,227 @@
+"""
+Spans of the stages of a job and of its LLM requests, saved as a Chrome trace-event file
+that chrome://tracing or https://ui.perfetto.dev can open, and an opt-in cProfile of the job.
+
+A job is traced while `trace_job` is active: spans opened in its thread, in the tasks of its event loop
+and in the pool tasks it submits through `wrap_task` are recorded with the tags of the spans around them
+(job, sheet, column, row, language). Outside of a traced job, `span` does nothing.
+Worker processes of the pool send their spans to the API process through the queue given to the pool initializer.
+"""
+
+import asyncio
+import contextvars
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# tags of the current span, None outside of a traced job
+_tags: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar('trace_tags', default=None)
+# cProfile output of the traced job, None when it is not profiled
+_profile_path: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('profile_path', default=None)
+# job id -> events of the traced jobs of this process
+_traces: Dict[str, List[dict]] = {}
+_traces_lock = threading.Lock()
+# queue to the API process, in a worker process of the pool
+_sink = None
+_buffer: List[dict] = []
+# queue of the worker spans, in the API process
+_source = None
+# profile of the tasks of this worker process, when the job is profiled
+_worker_profile: Optional[cProfile.Profile] = None
+
+
+def _now() -> int:
+    # microseconds of the wall clock, comparable across the processes
+    return time.time_ns() // 1000
+
+
+def _thread_id() -> int:
+    # concurrent requests of an event loop are shown as separate threads
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_native_id()
+
+
+def _record(event: dict):
+    if _sink is not None:
+        _buffer.append(event)
+    else:
+        _merge([event])
+
+
+@contextmanager
+def span(name: str, **tags):
+    """
+    Record the duration of the block as a span of the traced job, with the tags of the enclosing spans and `tags`
+    """
+    parent = _tags.get()
+    if parent is None:
+        yield
+        return
+    args = {**parent, **tags}
+    token = _tags.set(args)
+    start = _now()
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+        _record({'name': name, 'cat': name.split(':')[0], 'ph': 'X', 'ts': start, 'dur': _now() - start,
+                 'pid': os.getpid(), 'tid': _thread_id(), 'args': args})
+
+
+@contextmanager
+def trace_job(job_id: str, trace_path: str, profile_path: Optional[str] = None):
+    """
+    Trace a job while the block runs and save its spans to `trace_path`. With a `profile_path`, the job thread
+    is profiled with cProfile to `profile_path` and every worker process to `<profile_path>.<pid>`.
+    """
+    with _traces_lock:
+        _traces[job_id] = []
+    profile = cProfile.Profile() if profile_path else None
+    token = _tags.set({'job': job_id})
+    profile_token = _profile_path.set(profile_path)
+    if profile is not None:
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Python 3.12 allows a single profiler at a time, e.g. when two profiled jobs run together
+            logger.warning(f'Not profiling job {job_id}: {e}')
+            profile = None
+    try:
+        with span('job'):
+            yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(profile_path)
+        _tags.reset(token)
+        _profile_path.reset(profile_token)
+        _drain()
+        with _traces_lock:
+            events = _traces.pop(job_id)
+        with open(trace_path, 'w') as f:
+            json.dump({'traceEvents': sorted(events, key=lambda event: event['ts']), 'displayTimeUnit': 'ms'}, f)
+        logger.info(f'Saved {len(events)} spans of job {job_id} to {trace_path}')
+
+
+def copy_context(function: Callable) -> Callable:
+    """
+    `function` running with the tags of the current span, to trace the work it does on another thread
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+
+def wrap_task(function: Callable, args: tuple) -> tuple:
+    """
+    The (function, args) of a pool task that runs `function` with the tags of the current span
+    and records the time the task waited in the queue of the pool, pickling included
+    """
+    tags = _tags.get()
+    if tags is None:
+        return function, args
+    return _run_task, (tags, _profile_path.get(), function, args, _now())
+
+
+def _run_task(tags: dict, profile_path: Optional[str], function: Callable, args: tuple, submitted: int):
+    global _worker_profile
+    if profile_path and _worker_profile is None:
+        # one profile per worker process, accumulated over its tasks
+        _worker_profile = cProfile.Profile()
+    profile = _worker_profile if profile_path else None
+    token = _tags.set(tags)
+    try:
+        with span(f'task:{function.__name__}', queued_ms=round((_now() - submitted) / 1000, 1)):
+            if profile is not None:
+                profile.enable()
+            try:
+                return function(*args)
+            finally:
+                if profile is not None:
+                    profile.disable()
+    finally:
+        _tags.reset(token)
+        if profile is not None:
+            profile.dump_stats(f'{profile_path}.{os.getpid()}')
+        flush()
+
+
+def configure_worker(sink):
+    """
+    Send the spans of this worker process to the API process through the `sink` queue
+    """
+    global _sink
+    _sink = sink
+
+
+def flush():
+    global _buffer
+    if _sink is None or not _buffer:
+        return
+    events, _buffer = _buffer, []
+    _sink.put(events)
+
+
+def _merge(events: List[dict]):
+    with _traces_lock:
+        for event in events:
+            job_events = _traces.get(event['args'].get('job'))
+            if job_events is not None:
+                job_events.append(event)
+
+
+def _drain():
+    # the spans of the last tasks of a job may still be in the queue when the job ends
+    if _source is None:
+        return
+    while True:
+        try:
+            _merge(_source.get(timeout=0.1))
+        except (queue.Empty, EOFError, OSError):
+            return
+
+
+def collect(source):
+    """
+    Merge the spans sent by the worker processes into the traces of their jobs, on a daemon thread
+    """
+    global _source
+    _source = source
+
+    def run():
+        while True:
+            try:
+                events = source.get()
+            except (EOFError, OSError):
+                return
+            _merge(events)
+
+    threading.Thread(target=run, daemon=True, name='trace_collector').start()
+
+
+def instrument(chain: Runnable, model_name: str) -> Runnable:
+    """
+    Wrap a chain to record every request as a span tagged with its language and model
+    """
+    def invoke(inputs: dict):
+        with span('llm', language=inputs.get('language', 'multi'), model=model_name):
+            return chain.invoke(inputs)
+
+    async def ainvoke(inputs: dict):
+        with span('llm', language=inputs.get('language', 'multi'), model=model_name):
+            return await chain.ainvoke(inputs)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
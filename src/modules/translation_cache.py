@@ -0,0 +1,154 @@
+"""
+A disk-backed translation memory that sits in front of the LLM calls
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class TranslationCache:
+    """
+    SQLite translation memory keyed on source text, target language, model name, temperature, prompt version
+    and the server the model is called on.
+    Least recently used entries are evicted once the stored translations grow past `max_size_mb`.
+    """
+    def __init__(self, path: str = 'translation_cache/translation_memory.sqlite', max_size_mb: float = 512):
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                model_name TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                language TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations (last_used)')
+        self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM translations').fetchone()[0]
+
+    @staticmethod
+    def make_key(text: str, language: str, model_name: str, temperature: float, prompt_version: str,
+                 base_url: Optional[str] = None) -> str:
+        """
+        Hash of everything that can change the translation of a text. `base_url` is the OpenAI compatible server
+        the model is called on, None for the OpenAI API, so that the answers of another server under the same
+        model name, e.g. the fake backend of the benchmarks, are never served as translations of the real model.
+        """
+        parts = [text, language, model_name, repr(float(temperature)), prompt_version]
+        if base_url:
+            # the keys of the OpenAI API are unchanged, so the existing entries stay valid
+            parts.append(base_url.rstrip('/'))
+        raw = '\x1f'.join(parts)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get_many(self, text: str, languages: List[str], model_name: str, temperature: float, prompt_version: str,
+                 base_url: Optional[str] = None) -> Dict[str, str]:
+        """
+        Look up the translations of a text into several languages. Returns only the languages that were found.
+        """
+        keys = {self.make_key(text, lang, model_name, temperature, prompt_version, base_url): lang for lang in languages}
+        placeholders = ','.join('?' * len(keys))
+        with self._lock:
+            rows = self._conn.execute(f'SELECT key, translation FROM translations WHERE key IN ({placeholders})',
+                                      list(keys)).fetchall()
+            if rows:
+                self._conn.execute(f"UPDATE translations SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                                   [time.time(), *[key for key, _ in rows]])
+            self.hits += len(rows)
+            self.misses += len(keys) - len(rows)
+        return {keys[key]: translation for key, translation in rows}
+
+    def set_many(self, text: str, translations: Dict[str, str], model_name: str, temperature: float, prompt_version: str,
+                 base_url: Optional[str] = None):
+        """
+        Store the translations of a text. Empty translations are failures and are never stored.
+        """
+        now = time.time()
+        rows = [(self.make_key(text, lang, model_name, temperature, prompt_version, base_url), model_name, prompt_version, lang,
+                 translation, len(translation.encode('utf-8')), now)
+                for lang, translation in translations.items() if translation]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute('BEGIN')
+            for row in rows:
+                previous = self._conn.execute('SELECT size FROM translations WHERE key = ?', (row[0],)).fetchone()
+                self._size -= previous[0] if previous else 0
+                self._conn.execute('INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+                self._size += row[5]
+            self._conn.execute('COMMIT')
+            if self._size > self.max_size_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Delete least recently used entries until the cache is back under 90% of its size limit
+        """
+        target = int(self.max_size_bytes * 0.9)
+        while self._size > target:
+            rows = self._conn.execute('SELECT key, size FROM translations ORDER BY last_used LIMIT 500').fetchall()
+            if not rows:
+                self._size = 0
+                break
+            self._conn.executemany('DELETE FROM translations WHERE key = ?', [(key,) for key, _ in rows])
+            self._size -= sum(size for _, size in rows)
+            self.evictions += len(rows)
+        logger.info(f'Translation cache evicted down to {self._size} bytes')
+
+    def invalidate(self, model_name: Optional[str] = None, prompt_version: Optional[str] = None) -> int:
+        """
+        Delete the entries of a model and/or a prompt version. With no arguments the whole cache is cleared.
+        Returns the number of deleted entries.
+        """
+        conditions, args = [], []
+        if model_name is not None:
+            conditions.append('model_name = ?')
+            args.append(model_name)
+        if prompt_version is not None:
+            conditions.append('prompt_version = ?')
+            args.append(prompt_version)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._lock:
+            deleted = self._conn.execute(f'DELETE FROM translations{where}', args).rowcount
+            self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM translations').fetchone()[0]
+        logger.info(f'Invalidated {deleted} cached translations (model={model_name}, prompt_version={prompt_version})')
+        return deleted
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'size_bytes': self._size,
+            'max_size_bytes': self.max_size_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
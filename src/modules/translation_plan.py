@@ -0,0 +1,176 @@
+"""
+A module to plan the translation work of a whole job
+"""
+
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import pandas as pd
+
+from modules.cell_filter import NON_LINGUISTIC, PASS_THROUGH, TEXT, classify_cells
+from modules.row_diff import UNCHANGED
+from modules.text_segmenter import TextSegmenter, join_segments
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class SegmentedText(NamedTuple):
+    """
+    A long text translated as several units, joined back with the whitespace between them
+    """
+    unit_ids: List[int]
+    separators: List[str]
+
+
+class TranslationPlan:
+    """
+    Collects the cells of every (sheet, column) of a job and collapses identical source texts into a single work unit.
+    The translation of a unit is fanned back out to every cell that needs it.
+    With a `segmenter`, long texts are split into segments that are units of their own, so that they are translated
+    in parallel and cached per segment.
+    Unit ids start at `first_unit_id`, so that the plans of the chunks of a streamed file have distinct ids.
+    With `pre_filter`, the cells that need no translation are resolved locally: empty cells are left as they are,
+    non-linguistic cells are copied as they are to every language, and only the other cells become units.
+    The translations carried over from a previous output are kept: the rows that have all of them are not translated,
+    the others only take the new translations of the languages they miss.
+    """
+    def __init__(self, first_unit_id: int = 0, segmenter: Optional[TextSegmenter] = None, pre_filter: bool = False):
+        self.first_unit_id = first_unit_id
+        self.segmenter = segmenter
+        self.pre_filter = pre_filter
+        # number of cells skipped per category of `modules.cell_filter`
+        self.skipped: Counter = Counter()
+        self._unit_ids: Dict[str, int] = {}
+        self._texts: List[str] = []
+        self._segmented: Dict[str, Optional[SegmentedText]] = {}
+        # (index, unit id) of every cell, or (index, source text) for the cells of a segmented text
+        self._cells: Dict[Tuple[str, str], List[Tuple[int, Union[int, str]]]] = {}
+        # (index, source text) of the cells that are copied as they are
+        self._copied: Dict[Tuple[str, str], List[Tuple[int, str]]] = {}
+        # index -> translations carried over from a previous output
+        self._carried: Dict[Tuple[str, str], Dict[int, List[Optional[str]]]] = {}
+
+    def _unit_id(self, text: str) -> int:
+        unit_id = self._unit_ids.get(text)
+        if unit_id is None:
+            unit_id = self.first_unit_id + len(self._texts)
+            self._unit_ids[text] = unit_id
+            self._texts.append(text)
+        return unit_id
+
+    def _unit(self, text: str) -> Union[int, str]:
+        if self.segmenter is None or text in self._unit_ids:
+            return self._unit_id(text)
+        if text not in self._segmented:
+            split = self.segmenter.split(text)
+            self._segmented[text] = SegmentedText([self._unit_id(segment) for segment in split[0]], split[1]) if split else None
+        return text if self._segmented[text] is not None else self._unit_id(text)
+
+    def add_column(self, sheet: str, column: str, series: pd.Series, carried: Optional[Dict[int, List[Optional[str]]]] = None,
+                   empty: Optional[pd.Series] = None):
+        """
+        Add the cells of a source column to the plan, with the translations to carry over by index, None where missing.
+        `empty` flags the cells that are empty in the source file, see `cell_filter.classify_cells`.
+        """
+        if carried:
+            self._carried[(sheet, column)] = carried
+            complete = [index for index, translations in carried.items() if None not in translations]
+            self.skipped[UNCHANGED] += len(complete)
+            series = series[~series.index.isin(complete)]
+        if self.pre_filter:
+            categories = classify_cells(series, empty)
+            self.skipped.update(categories[categories != TEXT].value_counts().to_dict())
+            copied = series[categories.isin((NON_LINGUISTIC, PASS_THROUGH))]
+            self._copied[(sheet, column)] = list(zip(copied.index.tolist(), copied.tolist()))
+            series = series[categories == TEXT]
+        self._cells[(sheet, column)] = [(index, self._unit(text)) for index, text in zip(series.index.tolist(), series.tolist())]
+
+    @property
+    def columns(self) -> List[Tuple[str, str]]:
+        return list(self._cells)
+
+    @property
+    def total_cells(self) -> int:
+        return sum(len(cells) for cells in self._cells.values()) + sum(self.skipped.values())
+
+    @property
+    def unique_texts(self) -> int:
+        return len(self._texts)
+
+    def unit_cells(self) -> Dict[int, Dict[Tuple[str, str], float]]:
+        """
+        The number of cells of every (sheet, column) that each work unit is translated for.
+        The segments of a long text count for an equal share of the cells of the text.
+        """
+        unit_cells: Dict[int, Dict[Tuple[str, str], float]] = {}
+        for key, cells in self._cells.items():
+            for _, unit in cells:
+                unit_ids = [unit] if isinstance(unit, int) else self._segmented[unit].unit_ids
+                for unit_id in unit_ids:
+                    counts = unit_cells.setdefault(unit_id, {})
+                    counts[key] = counts.get(key, 0) + 1 / len(unit_ids)
+        return unit_cells
+
+    def text_index_pairs(self) -> List[Tuple[int, str]]:
+        """
+        The deduplicated work units as (unit id, text) pairs, in the format `TranslationService` expects
+        """
+        logger.info(f'Planned {self.unique_texts} unique texts for {self.total_cells} cells, skipped {dict(self.skipped)}')
+        return list(enumerate(self._texts, self.first_unit_id))
+
+    @property
+    def segmented_texts(self) -> int:
+        return sum(1 for segmented in self._segmented.values() if segmented is not None)
+
+    @staticmethod
+    def _join(segmented: SegmentedText, translations: Dict[int, Optional[List[str]]]) -> Optional[List[str]]:
+        """
+        Join the translations of the segments of a text, per language
+        """
+        segment_translations = [translations.get(unit_id) for unit_id in segmented.unit_ids]
+        languages = next((len(t) for t in segment_translations if t), 0)
+        joined = [join_segments([t[position] if t else None for t in segment_translations], segmented.separators)
+                  for position in range(languages)]
+        return joined if any(joined) else None
+
+    def fan_out(self, results: List[Tuple[int, Optional[List[str]]]],
+                languages: int) -> Dict[Tuple[str, str], List[Tuple[int, Optional[List[str]]]]]:
+        """
+        Map the results of the work units back to (index, translations) results for every (sheet, column),
+        with the copied cells of the pre-filter in each of the `languages`
+        """
+        translations = dict(results)
+        joined = {text: self._join(segmented, translations) for text, segmented in self._segmented.items() if segmented is not None}
+
+        def merged(key, index, unit) -> Optional[List[str]]:
+            translated = translations.get(unit) if isinstance(unit, int) else joined[unit]
+            carried = self._carried.get(key, {}).get(index)
+            if carried is None:
+                return translated
+            return [kept or new for kept, new in zip(carried, translated or [None] * languages)]
+
+        return {key: [(index, merged(key, index, unit)) for index, unit in cells]
+                + [(index, [text] * languages) for index, text in self._copied.get(key, [])]
+                + [(index, carried) for index, carried in self._carried.get(key, {}).items() if None not in carried]
+                for key, cells in self._cells.items()}
+
+    def failed_cells(self, failures: List[Tuple[int, str]]) -> List[dict]:
+        """
+        Map the (unit id, language) failures of the work units to the cells that need them
+        """
+        languages = {}
+        for unit_id, language in failures:
+            languages.setdefault(unit_id, []).append(language)
+
+        def cell_languages(unit) -> List[str]:
+            if isinstance(unit, int):
+                return languages.get(unit, [])
+            # a segmented text fails in a language when any of its segments does
+            unit_ids = self._segmented[unit].unit_ids
+            return list(dict.fromkeys(language for unit_id in unit_ids for language in languages.get(unit_id, [])))
+
+        return [{'sheet': sheet, 'column': column, 'row': index, 'language': language}
+                for (sheet, column), cells in self._cells.items()
+                for index, unit in cells
+                for language in cell_languages(unit)]
@@ -1,3 +1,5 @@
+import hashlib
+
 from langchain_core.prompts import ChatPromptTemplate
 
 
@@ -16,6 +18,14 @@ class TranslationPrompt:
         ])
         return prompt
 
+    @property
+    def version(self) -> str:
+        """
+        Short hash of the prompt messages. Any edit to the prompt changes the version.
+        """
+        content = f'{self.system_message_str}\n{self.human_message_str}'
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+
 
 class SkillDescriptionPrompt(TranslationPrompt):
     """
@@ -84,3 +94,47 @@ class TextTranslationPrompt(TranslationPrompt):
         {text}
         """
         super().__init__(system_message_str, human_message_str)
+
+
+class PackedTextTranslationPrompt(TranslationPrompt):
+    """
+    Creates a prompt template to translate several texts in one request.
+    The texts are given as a JSON object of id -> text and the translations are expected back under the same ids.
+    """
+    def __init__(self):
+        system_message_str = """
+        Role: You are an excellent multilingual translator. Translate every text of the given JSON object to language: {language}. Texts might be skill names,
+        skill descriptions, or anything else. Translate each whole text accurately, not just interpret it. Use clear, professional, fluent, natural and formal language.
+        Steps to take:
+        1. Read each text carefully. Every text is independent of the others.
+        2. Translate each text to the target language. Ensure the translation is complete and accurately reflects the original meaning.
+        3. Use appropriate terminology specific to the context of the text.
+        4. Output only a JSON object with exactly the same keys as the input, where each value is the translation of the text under that key.
+        For example the input {{"0": "Leadership", "1": "Writes clear reports."}} is translated to French as {{"0": "Leadership", "1": "Rédige des rapports clairs."}}
+        """
+        human_message_str = """
+        {texts}
+        """
+        super().__init__(system_message_str, human_message_str)
+
+
+class MultiLanguageTextTranslationPrompt(TranslationPrompt):
+    """
+    Creates a prompt template to translate one text to several languages in one request.
+    The translations are expected back as a JSON object keyed by language code.
+    """
+    def __init__(self):
+        system_message_str = """
+        Role: You are an excellent multilingual translator. Translate the given text to each of these languages: {languages}. Text might be a skill name,
+        a skill description, or anything else. Translate the whole text accurately, not just interpret it. Use clear, professional, fluent, natural and formal language.
+        Steps to take:
+        1. Read the text carefully.
+        2. Translate the text to every target language. Ensure each translation is complete and accurately reflects the original meaning.
+        3. Use appropriate terminology specific to the context of the text.
+        4. Output only a JSON object with one key per language code exactly as given, where each value is the translation to that language.
+        For example the text "Writes clear reports." translated to ["fr", "de"] is {{"fr": "Rédige des rapports clairs.", "de": "Schreibt klare Berichte."}}
+        """
+        human_message_str = """
+        {text}
+        """
+        super().__init__(system_message_str, human_message_str)
@@ -0,0 +1,95 @@
+"""
+The sheets, row counts, source columns and target languages of a workbook, read from the header rows only,
+for the front end to list what can be translated without parsing the sheets
+"""
+
+from collections import OrderedDict
+import hashlib
+import threading
+from typing import BinaryIO, List, Optional, Union
+
+from modules.workbook_session import WorkbookSession
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# the columns to translate have this in their name
+SOURCE_PATTERN = '(to translate)'
+# the target columns are named `{language code} description`
+TARGET_SUFFIX = ' description'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def columns_to_translate(headers: List[str], pattern: str = SOURCE_PATTERN) -> List[str]:
+    return [header for header in headers if pattern in header]
+
+
+def languages(headers: List[str]) -> List[str]:
+    """
+    The language codes of the `{language code} description` columns
+    """
+    return [header.replace(TARGET_SUFFIX, '') for header in headers if TARGET_SUFFIX in header]
+
+
+def content_hash(file: BinaryIO) -> str:
+    """
+    The SHA-256 of a file object, read in chunks from its start
+    """
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def read_metadata(source: Union[bytes, str, BinaryIO]) -> dict:
+    """
+    The name, number of rows, columns to translate and target languages of every sheet of a workbook
+    """
+    workbook = WorkbookSession(source)
+    try:
+        sheets = []
+        for sheet in workbook.sheet_names:
+            headers = workbook.headers(sheet)
+            sheets.append({'name': sheet, 'rows': workbook.row_count(sheet),
+                           'columns_to_translate': columns_to_translate(headers), 'languages': languages(headers)})
+        return {'sheets': sheets}
+    finally:
+        workbook.close()
+
+
+class MetadataCache:
+    """
+    The metadata of the last `max_entries` workbooks, by content hash, so a workbook uploaded again is not parsed again
+    """
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            metadata = self._entries.get(key)
+            if metadata is not None:
+                self._entries.move_to_end(key)
+            return metadata
+
+    def put(self, key: str, metadata: dict):
+        with self._lock:
+            self._entries[key] = metadata
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def metadata(self, file: BinaryIO) -> dict:
+        """
+        The metadata of a workbook file object, parsed only when no workbook with the same content was parsed before
+        """
+        key = content_hash(file)
+        metadata = self.get(key)
+        if metadata is None:
+            metadata = {'content_hash': key, **read_metadata(file)}
+            self.put(key, metadata)
+            logger.info(f"Read the metadata of workbook {key[:12]}: {len(metadata['sheets'])} sheets")
+        return metadata
@@ -0,0 +1,148 @@
+"""
+A module to read the source columns of an uploaded workbook and write the translations back into it
+"""
+
+from collections import defaultdict
+from io import BytesIO
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+import openpyxl
+import pandas as pd
+
+from modules import metrics, tracing
+from modules.streaming_io import target_columns
+from utils.logger import setup_logger
+from utils.utils import cell_text, is_empty_cell
+
+logger = setup_logger(__name__)
+
+
+class WorkbookSession:
+    """
+    Parses an uploaded workbook once, in openpyxl read-only mode, and only keeps the cells of the columns that are translated.
+    Translations are written by patching the target cells while the sheets are streamed to a write-only workbook,
+    so the other cells and sheets are copied as they are instead of being rebuilt through DataFrames.
+    """
+    def __init__(self, source: Union[bytes, str, BinaryIO]):
+        """
+        `source` is the content of the workbook, its path or a file object. From a path or a file, the sheets are read
+        by seeking in the file while they are streamed, so the workbook is not held in memory.
+        """
+        try:
+            with tracing.span('parse_workbook'):
+                self._workbook = openpyxl.load_workbook(BytesIO(source) if isinstance(source, bytes) else source,
+                                                        read_only=True, data_only=True)
+        except Exception as e:
+            logger.error(f"Error reading Excel file: {str(e)}")
+            raise FileNotFoundError("Error reading Excel file")
+        self._headers: Dict[str, List[str]] = {}
+        # (sheet, column) -> whether every cell read by `read_columns` is empty, see `empty_cells`
+        self._empty: Dict[Tuple[str, str], pd.Series] = {}
+        # sheet -> row number -> column position -> translation
+        self._patches: Dict[str, Dict[int, Dict[int, str]]] = defaultdict(lambda: defaultdict(dict))
+
+    def _worksheet(self, sheet: str):
+        if sheet not in self._workbook.sheetnames:
+            raise ValueError(f"Worksheet named '{sheet}' not found")
+        return self._workbook[sheet]
+
+    @property
+    def sheet_names(self) -> List[str]:
+        return self._workbook.sheetnames
+
+    def row_count(self, sheet: str) -> int:
+        """
+        The number of rows below the header, from the dimensions saved in the sheet, so its cells are not read.
+        Sheets saved without dimensions are counted row by row.
+        """
+        worksheet = self._worksheet(sheet)
+        worksheet.calculate_dimension(force=True)
+        return max((worksheet.max_row or 0) - 1, 0)
+
+    def headers(self, sheet: str) -> List[str]:
+        """
+        The column names of a sheet, named like `pandas.read_excel` names them
+        """
+        if sheet not in self._headers:
+            header = next(self._worksheet(sheet).iter_rows(min_row=1, max_row=1, values_only=True), ())
+            self._headers[sheet] = [f'Unnamed: {position}' if value is None else str(value) for position, value in enumerate(header)]
+        return self._headers[sheet]
+
+    def _position(self, sheet: str, column: str) -> int:
+        headers = self.headers(sheet)
+        if str(column) not in headers:
+            raise ValueError(f"Column '{column}' not found in worksheet '{sheet}'")
+        return headers.index(str(column))
+
+    def read_columns(self, sheet: str, columns: List[str]) -> Dict[str, pd.Series]:
+        """
+        Read the cells of some columns of a sheet in a single pass, as strings indexed by row number.
+        Empty cells read as 'nan' and trailing empty rows are dropped, like `DataReader.read_excel` does.
+        """
+        positions = [self._position(sheet, column) for column in columns]
+        rows, values, empty = [], [[] for _ in columns], [[] for _ in columns]
+        last_filled = 0
+        with metrics.FILE_IO_SECONDS.time(operation='read', format='xlsx'), tracing.span('read_columns', sheet=sheet):
+            for row_number, row in enumerate(self._worksheet(sheet).iter_rows(min_row=2, values_only=True), 2):
+                cells = [row[position] if position < len(row) else None for position in positions]
+                if any(value is not None for value in row):
+                    last_filled = len(rows) + 1
+                rows.append(row_number)
+                for column_values, column_empty, value in zip(values, empty, cells):
+                    column_values.append(cell_text(value))
+                    column_empty.append(is_empty_cell(value))
+        rows = rows[:last_filled]
+        for column, column_empty in zip(columns, empty):
+            self._empty[(sheet, column)] = pd.Series(column_empty[:last_filled], index=rows, dtype=bool)
+        return {column: pd.Series(column_values[:last_filled], index=rows, dtype=object)
+                for column, column_values in zip(columns, values)}
+
+    def empty_cells(self, sheet: str, column: str) -> pd.Series:
+        """
+        Whether the cells of a column read by `read_columns` are empty, from their values instead of their text
+        """
+        return self._empty[(sheet, column)]
+
+    def target_columns(self, sheet: str, language_codes: List[str], pattern: str) -> List[Optional[str]]:
+        """
+        The `{language_code} {pattern}` column of every language, None for the languages the sheet has no column for
+        """
+        return target_columns(self.headers(sheet), language_codes, pattern)
+
+    def set_translations(self, sheet: str, results: List[Tuple[int, Optional[List[str]]]], language_codes: List[str], pattern: str):
+        """
+        Patch the (row number, translations) results into the target columns of a sheet.
+        Missing translations leave the target cell as it is.
+        """
+        targets = [(position, self._position(sheet, column)) for position, column
+                   in enumerate(self.target_columns(sheet, language_codes, pattern)) if column is not None]
+        patches = self._patches[sheet]
+        for row_number, translations in results:
+            if not translations:
+                continue
+            for language_position, column_position in targets:
+                translation = translations[language_position]
+                if translation:
+                    patches[row_number][column_position] = translation
+
+    def save(self, path: str):
+        """
+        Stream every sheet of the workbook to `path` with the patched cells
+        """
+        with metrics.FILE_IO_SECONDS.time(operation='write', format='xlsx'), tracing.span('write_output'):
+            output = openpyxl.Workbook(write_only=True)
+            for worksheet in self._workbook.worksheets:
+                logger.info(f"Processing sheet: {worksheet.title}")
+                patches = self._patches.get(worksheet.title, {})
+                output_sheet = output.create_sheet(worksheet.title)
+                for row_number, row in enumerate(worksheet.iter_rows(values_only=True), 1):
+                    row_patches = patches.get(row_number)
+                    if row_patches:
+                        row = list(row) + [None] * (max(row_patches) + 1 - len(row))
+                        for column_position, translation in row_patches.items():
+                            row[column_position] = translation
+                    output_sheet.append(row)
+            output.save(path)
+
+    def close(self):
+        self._workbook.close()
@@ -1,12 +1,25 @@
+import asyncio
+from collections import defaultdict
+import json
+import os
+import queue
+import random
+import threading
 import time
 from tqdm import tqdm
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 from langchain_core.runnables import RunnableSequence
 
+from modules import metrics, tracing
+from modules.batch_client import FINAL_STATUSES, BatchClient, BatchConfig, batch_request, parse_batch_output
+from modules.chain_registry import close_loop_chains, get_chain
+from modules.checkpoint_journal import CheckpointJournal
 from modules.model_config import ModelConfig
-from modules.openai_chain import OpenAIchain
-from modules.translation_prompt import TextTranslationPrompt
+from modules.text_packer import (PackedResponseError, PackingConfig, pack_texts, packed_payload, parse_languages_response,
+                                 parse_packed_response)
+from modules.translation_cache import TranslationCache
+from modules.translation_prompt import MultiLanguageTextTranslationPrompt, PackedTextTranslationPrompt, TextTranslationPrompt
 
 from utils.logger import setup_logger
 
@@ -14,55 +27,660 @@ from utils.logger import setup_logger
 logger = setup_logger(__name__)
 
             
-def batch_text_translate(chain: RunnableSequence, text: str, language_codes: List[str], retries=3, delay=5) -> List[str]:
+def backoff_delay(attempt: int, delay: float, max_delay: float = 60) -> float:
+    """
+    Exponential backoff with jitter: between half and all of `delay * 2 ** attempt`, capped at `max_delay`
+    """
+    backoff = min(max_delay, delay * 2 ** attempt)
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+def batch_text_translate(chain: RunnableSequence, text: str, language_codes: List[str], retries=3, delay=2) -> List[Optional[str]]:
+    """
+    Translate the text to every language. Only the languages whose request failed are retried,
+    with exponential backoff and jitter. Languages that still fail after `retries` attempts are None.
+    """
+    translations = [None for _ in language_codes]
+    pending = list(range(len(language_codes)))
+    for attempt in range(retries):
+        results = chain.batch([{'text': text, 'language': language_codes[i]} for i in pending], return_exceptions=True)
+        failed = []
+        for i, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.warning(f'Attempt {attempt+1} for language {language_codes[i]} failed with error: {result}')
+                failed.append(i)
+            else:
+                translations[i] = result
+        pending = failed
+        if not pending:
+            break
+        if attempt < retries - 1:
+            for i in pending:
+                metrics.LLM_RETRIES.inc(language=language_codes[i])
+            time.sleep(backoff_delay(attempt, delay))
+    if pending:
+        logger.warning(f'Failed after {retries} attempts for languages {[language_codes[i] for i in pending]}.')
+    return translations
+
+
+def _count_text(translations: Optional[List[Optional[str]]]):
+    if translations and all(translations):
+        metrics.TEXTS_TRANSLATED.inc(outcome='ok')
+    else:
+        metrics.TEXTS_TRANSLATED.inc(outcome='partial' if translations and any(translations) else 'failed')
+
+
+def translate_description(prompt, model_config: ModelConfig, index_text: Tuple[str,str], language_codes: List[str]) -> Tuple[int, List[str]]:
+    """
+    Translate the text using the OpenAI model
+    """
+    # with pool.apply_async I can't pass the chain directly as it is not picklable, so every worker process
+    # builds it on its first task and keeps it in the chain registry for the following tasks.
+    try:
+        chain = get_chain(prompt, model_config)
+        with tracing.span('translate_text', unit=index_text[0]):
+            result = batch_text_translate(chain, index_text[1], language_codes)
+        _count_text(result)
+        return (index_text[0], result)
+    except Exception as e:
+        logger.warning(f"Error translating text: {str(e)}")
+        _count_text(None)
+        return (index_text[0], ['' for _ in language_codes])
+    finally:
+        # the metrics of the worker process are sent to the API process after every task
+        metrics.flush()
+
+
+async def abatch_text_translate(chain: RunnableSequence, text: str, language_codes: List[str], semaphore: asyncio.Semaphore,
+                                retries=3, delay=2) -> List[Optional[str]]:
+    """
+    Async version of `batch_text_translate`. Every language is a separate request that holds the semaphore while in flight.
+    """
+    async def invoke(lang_code):
+        async with semaphore:
+            return await chain.ainvoke({'text': text, 'language': lang_code})
+
+    translations = [None for _ in language_codes]
+    pending = list(range(len(language_codes)))
+    for attempt in range(retries):
+        results = await asyncio.gather(*(invoke(language_codes[i]) for i in pending), return_exceptions=True)
+        failed = []
+        for i, result in zip(pending, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, Exception):
+                logger.warning(f'Attempt {attempt+1} for language {language_codes[i]} failed with error: {result}')
+                failed.append(i)
+            else:
+                translations[i] = result
+        pending = failed
+        if not pending:
+            break
+        if attempt < retries - 1:
+            for i in pending:
+                metrics.LLM_RETRIES.inc(language=language_codes[i])
+            await asyncio.sleep(backoff_delay(attempt, delay))
+    if pending:
+        logger.warning(f'Failed after {retries} attempts for languages {[language_codes[i] for i in pending]}.')
+    return translations
+
+
+async def atranslate_description(chain: RunnableSequence, index_text: Tuple[str,str], language_codes: List[str],
+                                 semaphore: asyncio.Semaphore) -> Tuple[int, List[str]]:
+    """
+    Translate the text using a chain shared by all the tasks of the event loop
+    """
+    try:
+        result = await abatch_text_translate(chain, index_text[1], language_codes, semaphore)
+        _count_text(result)
+        return (index_text[0], result)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Error translating text: {str(e)}")
+        _count_text(None)
+        return (index_text[0], ['' for _ in language_codes])
+
+
+def _parse_pack(response: Optional[str], texts: List[str]) -> List[Optional[str]]:
+    if response is None:
+        return [None for _ in texts]
+    try:
+        return parse_packed_response(response, len(texts))
+    except PackedResponseError as e:
+        logger.warning(f'Malformed response for a pack of {len(texts)} texts: {e}')
+        return [None for _ in texts]
+
+
+def packed_text_translate(chain: RunnableSequence, texts: List[str], language: str, retries=3, delay=2) -> List[Optional[str]]:
+    """
+    Translate several texts to one language in a single JSON request.
+    A malformed response is split in two halves that are retried separately,
+    and the items missing from a partial response are requested again.
+    """
+    response = None
     for attempt in range(retries):
         try:
-            return chain.batch([{'text': text, 'language': lang_code} for lang_code in language_codes])
+            response = chain.invoke({'texts': packed_payload(texts), 'language': language})
+            break
         except Exception as e:
             logger.warning(f'Attempt {attempt+1} failed with error: {e}')
             if attempt < retries - 1:
-                time.sleep(delay)
+                metrics.LLM_RETRIES.inc(len(texts), language=language)
+                time.sleep(backoff_delay(attempt, delay))
             else:
                 logger.warning(f'Failed after {retries} attempts. Returning None.')
-                return None
+                return [None for _ in texts]
 
+    translations = _parse_pack(response, texts)
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    if not missing or len(texts) == 1:
+        return translations
+    # the texts of a malformed or partial response are sent again
+    metrics.LLM_RETRIES.inc(len(missing), language=language)
+    if len(missing) == len(texts):
+        half = len(texts) // 2
+        return (packed_text_translate(chain, texts[:half], language, retries, delay)
+                + packed_text_translate(chain, texts[half:], language, retries, delay))
+    retried = packed_text_translate(chain, [texts[i] for i in missing], language, retries, delay)
+    for i, translation in zip(missing, retried):
+        translations[i] = translation
+    return translations
 
-def translate_description(prompt, model_config: ModelConfig, index_text: Tuple[str,str], language_codes: List[str]) -> Tuple[int, List[str]]:
+
+async def apacked_text_translate(chain: RunnableSequence, texts: List[str], language: str, semaphore: asyncio.Semaphore,
+                                 retries=3, delay=2) -> List[Optional[str]]:
     """
-    Translate the text using the OpenAI model
+    Async version of `packed_text_translate`
+    """
+    response = None
+    for attempt in range(retries):
+        try:
+            async with semaphore:
+                response = await chain.ainvoke({'texts': packed_payload(texts), 'language': language})
+            break
+        except Exception as e:
+            logger.warning(f'Attempt {attempt+1} failed with error: {e}')
+            if attempt < retries - 1:
+                metrics.LLM_RETRIES.inc(len(texts), language=language)
+                await asyncio.sleep(backoff_delay(attempt, delay))
+            else:
+                logger.warning(f'Failed after {retries} attempts. Returning None.')
+                return [None for _ in texts]
+
+    translations = _parse_pack(response, texts)
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    if not missing or len(texts) == 1:
+        return translations
+    # the texts of a malformed or partial response are sent again
+    metrics.LLM_RETRIES.inc(len(missing), language=language)
+    if len(missing) == len(texts):
+        half = len(texts) // 2
+        halves = await asyncio.gather(apacked_text_translate(chain, texts[:half], language, semaphore, retries, delay),
+                                      apacked_text_translate(chain, texts[half:], language, semaphore, retries, delay))
+        return halves[0] + halves[1]
+    retried = await apacked_text_translate(chain, [texts[i] for i in missing], language, semaphore, retries, delay)
+    for i, translation in zip(missing, retried):
+        translations[i] = translation
+    return translations
+
+
+def translate_pack(prompt, model_config: ModelConfig, texts: List[str], language: str) -> List[Optional[str]]:
+    """
+    Translate a pack of texts using the OpenAI model, in a worker process
     """
-    # with pool.apply_async I can't pass the chain directly as it is not picklable, so create it in the function which is happening over and over again.
-    # We need to consider other ways to handle this, as creating the chain every time is not efficient.
-    # using manager to share the chain between processes is not possible as the chain is not picklable.
     try:
-        chain = OpenAIchain(prompt, model_config).create_chain()
-        result = batch_text_translate(chain, index_text[1], language_codes)
+        chain = get_chain(prompt, model_config, json_mode=True)
+        with tracing.span('translate_pack', language=language, texts=len(texts)):
+            return packed_text_translate(chain, texts, language)
+    except Exception as e:
+        logger.warning(f"Error translating pack: {str(e)}")
+        return [None for _ in texts]
+    finally:
+        metrics.flush()
+
+
+def _language_groups(language_codes: List[str], languages_per_request: int) -> List[List[str]]:
+    return [language_codes[i:i + languages_per_request] for i in range(0, len(language_codes), languages_per_request)]
+
+
+def _parse_languages(response, group: List[str]) -> List[Optional[str]]:
+    if isinstance(response, Exception):
+        logger.warning(f'Multi-language request for {group} failed with error: {response}')
+        return [None for _ in group]
+    try:
+        return parse_languages_response(response, group)
+    except PackedResponseError as e:
+        logger.warning(f'Malformed response for languages {group}: {e}')
+        return [None for _ in group]
+
+
+def multi_language_text_translate(chain: RunnableSequence, fallback_chain: RunnableSequence, text: str, language_codes: List[str],
+                                  languages_per_request: int) -> List[Optional[str]]:
+    """
+    Translate a text to several languages with one JSON request per group of `languages_per_request` languages.
+    Languages that are missing or invalid in the responses fall back to one request per language.
+    """
+    groups = _language_groups(language_codes, languages_per_request)
+    responses = chain.batch([{'text': text, 'languages': json.dumps(group)} for group in groups], return_exceptions=True)
+    translations = {}
+    for group, response in zip(groups, responses):
+        translations.update(zip(group, _parse_languages(response, group)))
+
+    missing = [lang for lang in language_codes if translations[lang] is None]
+    if missing:
+        logger.info(f'Falling back to per-language requests for {missing}')
+        translations.update(zip(missing, batch_text_translate(fallback_chain, text, missing)))
+    return [translations[lang] for lang in language_codes]
+
+
+async def amulti_language_text_translate(chain: RunnableSequence, fallback_chain: RunnableSequence, text: str, language_codes: List[str],
+                                         languages_per_request: int, semaphore: asyncio.Semaphore) -> List[Optional[str]]:
+    """
+    Async version of `multi_language_text_translate`
+    """
+    async def invoke(group):
+        async with semaphore:
+            return await chain.ainvoke({'text': text, 'languages': json.dumps(group)})
+
+    groups = _language_groups(language_codes, languages_per_request)
+    responses = await asyncio.gather(*(invoke(group) for group in groups), return_exceptions=True)
+    translations = {}
+    for group, response in zip(groups, responses):
+        translations.update(zip(group, _parse_languages(response, group)))
+
+    missing = [lang for lang in language_codes if translations[lang] is None]
+    if missing:
+        logger.info(f'Falling back to per-language requests for {missing}')
+        translations.update(zip(missing, await abatch_text_translate(fallback_chain, text, missing, semaphore)))
+    return [translations[lang] for lang in language_codes]
+
+
+def translate_description_multi_language(prompt, fallback_prompt, model_config: ModelConfig, index_text: Tuple[str,str],
+                                         language_codes: List[str], languages_per_request: int) -> Tuple[int, List[str]]:
+    """
+    Translate the text to several languages per request using the OpenAI model
+    """
+    try:
+        chain = get_chain(prompt, model_config, json_mode=True)
+        fallback_chain = get_chain(fallback_prompt, model_config)
+        with tracing.span('translate_text', unit=index_text[0]):
+            result = multi_language_text_translate(chain, fallback_chain, index_text[1], language_codes, languages_per_request)
+        _count_text(result)
         return (index_text[0], result)
     except Exception as e:
         logger.warning(f"Error translating text: {str(e)}")
+        _count_text(None)
         return (index_text[0], ['' for _ in language_codes])
+    finally:
+        metrics.flush()
 
 
 class TranslationService:
     """
     class to handle the translation of skills
     """
-    def __init__(self, processes: int, model_config: ModelConfig, text_index_pair: List[Tuple[str, str]], language_codes: List[str]):
+    def __init__(self, processes: int, model_config: ModelConfig, text_index_pair: List[Tuple[str, str]], language_codes: List[str],
+                 cache: Optional[TranslationCache] = None, packing: Optional[PackingConfig] = None,
+                 languages_per_request: Optional[int] = None, on_result: Optional[Callable[[Tuple[int, Optional[List[str]]]], None]] = None,
+                 journal: Optional[CheckpointJournal] = None, completed: Optional[Dict[int, Dict[str, str]]] = None):
         self.model_config = model_config
         self.texts = text_index_pair
         self.language_codes = language_codes
         self.processes = processes
-        self.prompt = TextTranslationPrompt().create_prompt()
+        self.cache = cache
+        # with packing, many texts are translated in one JSON request per language
+        self.packing = packing
+        # otherwise, with languages_per_request, one request returns the translations to several languages
+        self.languages_per_request = languages_per_request if not packing else None
+        if packing:
+            translation_prompt = PackedTextTranslationPrompt()
+        elif self.languages_per_request:
+            translation_prompt = MultiLanguageTextTranslationPrompt()
+        else:
+            translation_prompt = TextTranslationPrompt()
+        self.fallback_prompt = TextTranslationPrompt().create_prompt()
+        # (index, language) of the translations that failed permanently
+        self.failures: List[Tuple[int, str]] = []
+        # called with every (index, translations) result as soon as it is merged
+        self.on_result = on_result
+        # new translations are appended to the checkpoint journal as they finish, and the translations
+        # `completed` by an interrupted run of the job are not requested again
+        self.journal = journal
+        self.completed = completed or {}
+        self.prompt = translation_prompt.create_prompt()
+        self.prompt_version = translation_prompt.version
+        # the server the translations come from, part of the cache key
+        self.base_url = model_config.base_url
+
+    def _cached_translations(self, index: int, text: str) -> dict:
+        translations = {lang: translation for lang, translation in self.completed.get(index, {}).items() if lang in self.language_codes}
+        languages = [lang for lang in self.language_codes if lang not in translations]
+        if self.cache is not None and languages:
+            translations.update(self.cache.get_many(text, languages, self.model_config.llm_model_name,
+                                                    self.model_config.temperature, self.prompt_version, self.base_url))
+        return translations
+
+    def _record(self, index: int, language_codes: List[str], translations: Optional[List[Optional[str]]]):
+        if self.journal is not None and translations:
+            self.journal.record(index, dict(zip(language_codes, translations)))
+
+    def _cache_translations(self, text: str, language_codes: List[str], translations: Optional[List[str]]):
+        if self.cache is None or not translations:
+            return
+        self.cache.set_many(text, dict(zip(language_codes, translations)), self.model_config.llm_model_name,
+                            self.model_config.temperature, self.prompt_version, self.base_url)
+
+    def _split_cached(self) -> List[Tuple[int, str, dict, List[str]]]:
+        """
+        Look up every text in the completed translations and the translation cache.
+        Returns (index, text, cached translations, missing languages) rows.
+        """
+        if self.completed:
+            logger.info(f"Resuming: {sum(len(translations) for translations in self.completed.values())} translations already completed.")
+        rows = []
+        for index, text in self.texts:
+            cached = self._cached_translations(index, text)
+            rows.append((index, text, cached, [lang for lang in self.language_codes if lang not in cached]))
+        if self.cache is not None:
+            logger.info(f"Translation cache: {self.cache.stats()}")
+        return rows
+
+    def _merge_result(self, index: int, text: str, cached: dict, missing: List[str],
+                      translations: Optional[List[str]], record: bool = True) -> Tuple[int, Optional[List[str]]]:
+        """
+        Store the new translations of a text and merge them with the cached ones in the order of `language_codes`.
+        Packed translations are recorded in the journal per pack, so they pass `record=False`.
+        """
+        if not missing:
+            result = (index, [cached[lang] for lang in self.language_codes])
+        else:
+            self._cache_translations(text, missing, translations)
+            if record:
+                self._record(index, missing, translations)
+            if not translations:
+                translations = [None for _ in missing]
+            translated = dict(zip(missing, translations))
+            self.failures.extend((index, lang) for lang in missing if not translated[lang])
+            merged = [cached[lang] if lang in cached else translated[lang] for lang in self.language_codes]
+            result = (index, merged if any(merged) else None)
+        if self.on_result is not None:
+            self.on_result(result)
+        return result
+
+    def _language_packs(self, rows: List[Tuple[int, str, dict, List[str]]]) -> List[Tuple[str, List[int]]]:
+        """
+        Pack the rows that miss a language into packed requests. Returns the (language, row positions) of every request.
+        """
+        packs = []
+        for lang in self.language_codes:
+            positions = [position for position, row in enumerate(rows) if lang in row[3]]
+            texts = [rows[position][1] for position in positions]
+            for pack in pack_texts(texts, self.packing, self.model_config.llm_model_name):
+                packs.append((lang, [positions[i] for i in pack]))
+        logger.info(f"Packed {sum(len(row[3]) for row in rows)} translations into {len(packs)} requests.")
+        return packs
+
+    def _merge_packs(self, rows, packs, pack_results) -> List[Tuple[int, List[str]]]:
+        translated = defaultdict(dict)
+        for (lang, positions), translations in zip(packs, pack_results):
+            for position, translation in zip(positions, translations):
+                translated[position][lang] = translation
+        return [self._merge_result(index, text, cached, missing, [translated[position].get(lang) for lang in missing], record=False)
+                for position, (index, text, cached, missing) in enumerate(rows)]
 
-    def translate_apply_sync(self, pool) -> List[Tuple[int, List[str]]]:
+    def _record_pack(self, rows, lang: str, positions: List[int], translations: List[Optional[str]]):
+        for position, translation in zip(positions, translations):
+            self._record(rows[position][0], [lang], [translation])
+
+    def _translate_packed_sync(self, pool, cancel_event: Optional[threading.Event] = None) -> List[Tuple[int, List[str]]]:
+        rows = self._split_cached()
+        packs = self._language_packs(rows)
+        tasks = [(translate_pack, (self.prompt, self.model_config, [rows[p][1] for p in positions], lang)) for lang, positions in packs]
+        pack_results = [None for _ in packs]
+        done = 0
+        for position, translations in self._apply_windowed(pool, tasks, cancel_event):
+            pack_results[position] = translations
+            done += 1
+            lang, positions = packs[position]
+            self._record_pack(rows, lang, positions, translations)
+        if done < len(packs):
+            return []
+        return self._merge_packs(rows, packs, pack_results)
+
+    async def _translate_packed_async(self, concurrency: int) -> List[Tuple[int, List[str]]]:
+        chain = get_chain(self.prompt, self.model_config, json_mode=True)
+        semaphore = asyncio.Semaphore(concurrency)
+        rows = self._split_cached()
+        packs = self._language_packs(rows)
+        progress = tqdm(total=len(packs))
+        metrics.QUEUE_DEPTH.inc(len(packs))
+
+        async def translate(lang, positions):
+            try:
+                with tracing.span('translate_pack', language=lang, texts=len(positions)):
+                    translations = await apacked_text_translate(chain, [rows[p][1] for p in positions], lang, semaphore)
+            finally:
+                metrics.QUEUE_DEPTH.dec()
+            self._record_pack(rows, lang, positions, translations)
+            progress.update(1)
+            return translations
+
+        try:
+            return self._merge_packs(rows, packs, await asyncio.gather(*(translate(*pack) for pack in packs)))
+        finally:
+            progress.close()
+
+    def _row_task(self, index: int, text: str, missing: List[str]):
+        if self.languages_per_request:
+            return translate_description_multi_language, (self.prompt, self.fallback_prompt, self.model_config, (index, text),
+                                                          missing, self.languages_per_request)
+        return translate_description, (self.prompt, self.model_config, (index, text), missing)
+
+    def _apply_windowed(self, pool, tasks: List[Optional[Tuple[Callable, tuple]]], cancel_event: Optional[threading.Event] = None):
+        """
+        Submit the (function, args) tasks to the pool and yield the (position, result) of every task as soon as it completes,
+        in completion order, so that a slow request does not hold back the tasks behind it.
+        At most two tasks per process are in flight at a time, so that several jobs can share one pool
+        and a cancelled job stops submitting work. A task of None yields a result of None.
         """
-        Translate the skills synchronously using multiprocessing
+        window = self.processes * 2
+        completed = queue.Queue()
+        in_flight = 0
+        remaining = len(tasks)
+        metrics.QUEUE_DEPTH.inc(remaining)
+        with tqdm(total=len(tasks)) as progress:
+            try:
+                tasks = iter(enumerate(tasks))
+                while True:
+                    while in_flight < window:
+                        position, task = next(tasks, (None, StopIteration))
+                        if task is StopIteration:
+                            break
+                        if task is None:
+                            completed.put((position, True, None))
+                        else:
+                            pool.apply_async(*tracing.wrap_task(*task),
+                                             callback=lambda result, position=position: completed.put((position, True, result)),
+                                             error_callback=lambda error, position=position: completed.put((position, False, error)))
+                        in_flight += 1
+                    if not in_flight:
+                        return
+                    if cancel_event is not None and cancel_event.is_set():
+                        logger.warning("Translation cancelled.")
+                        return
+                    try:
+                        position, ok, result = completed.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    in_flight -= 1
+                    remaining -= 1
+                    metrics.QUEUE_DEPTH.dec()
+                    if not ok:
+                        raise result
+                    yield position, result
+                    progress.update(1)
+            finally:
+                # the tasks a cancelled or failed job leaves behind
+                metrics.QUEUE_DEPTH.dec(remaining)
+
+    def translate_apply_sync(self, pool, cancel_event: Optional[threading.Event] = None) -> List[Tuple[int, List[str]]]:
+        """
+        Translate the skills synchronously using multiprocessing.
+        Languages found in the translation cache are not sent to the model.
+        Setting `cancel_event` stops submitting requests and returns no results.
+        A task that fails in the pool, e.g. a worker that died, raises its error: the job fails instead of completing
+        with the texts of the missing results left empty, and resuming it keeps the translations already journaled.
         """
         logger.info(f"Translating {len(self.texts)} skills with {self.processes} processes.")
+        if self.packing:
+            return self._translate_packed_sync(pool, cancel_event)
+        results = []
+        rows = self._split_cached()
+        tasks = [self._row_task(index, text, missing) if missing else None for index, text, cached, missing in rows]
+        for position, response in self._apply_windowed(pool, tasks, cancel_event):
+            index, text, cached, missing = rows[position]
+            translations = response[1] if response is not None else None
+            results.append(self._merge_result(index, text, cached, missing, translations))
+        if cancel_event is not None and cancel_event.is_set():
+            return []
+        return results
+
+    async def translate_async(self, concurrency: int) -> List[Tuple[int, List[str]]]:
+        """
+        Translate the skills on a single event loop with at most `concurrency` requests in flight.
+        The chain is created once per event loop and shared by all the requests of the loop.
+        Cancelling the coroutine cancels every request that is still pending.
+        """
+        logger.info(f"Translating {len(self.texts)} skills with {concurrency} concurrent requests.")
+        if self.packing:
+            return await self._translate_packed_async(concurrency)
+        chain = get_chain(self.prompt, self.model_config, json_mode=bool(self.languages_per_request))
+        fallback_chain = get_chain(self.fallback_prompt, self.model_config)
+        semaphore = asyncio.Semaphore(concurrency)
+        rows = self._split_cached()
+        progress = tqdm(total=len(rows))
+        metrics.QUEUE_DEPTH.inc(len(rows))
+
+        async def translate_row(index, text, cached, missing):
+            translations = None
+            try:
+                with tracing.span('translate_text', unit=index):
+                    if missing and self.languages_per_request:
+                        translations = await amulti_language_text_translate(chain, fallback_chain, text, missing,
+                                                                            self.languages_per_request, semaphore)
+                        _count_text(translations)
+                    elif missing:
+                        translations = (await atranslate_description(chain, (index, text), missing, semaphore))[1]
+            finally:
+                metrics.QUEUE_DEPTH.dec()
+            progress.update(1)
+            return self._merge_result(index, text, cached, missing, translations)
+
         try:
-            jobs = [pool.apply_async(translate_description, (self.prompt, self.model_config, index_text, self.language_codes))
-                        for index_text in self.texts]
-            results = [res.get() for res in tqdm(jobs)]
-        except Exception as e:
-            logger.error(f"Error retrieving results: {e}")
+            return await asyncio.gather(*(translate_row(*row) for row in rows))
+        finally:
+            progress.close()
+
+    def translate_apply_async(self, concurrency: int, cancel_event: Optional[threading.Event] = None) -> List[Tuple[int, List[str]]]:
+        """
+        Run `translate_async` to completion on a new event loop, e.g. from a worker thread.
+        Setting `cancel_event` cancels the pending requests and returns no results. Translations that already
+        finished are kept in the translation cache.
+        """
+        async def run():
+            task = asyncio.ensure_future(self.translate_async(concurrency))
+            try:
+                while cancel_event is not None and not task.done():
+                    if cancel_event.is_set():
+                        task.cancel()
+                        break
+                    await asyncio.wait([task], timeout=0.5)
+                return await task
+            finally:
+                # the HTTP connections of this loop cannot be used by the next one
+                await close_loop_chains()
+
+        try:
+            return asyncio.run(run())
+        except asyncio.CancelledError:
+            logger.warning("Translation cancelled.")
+            return []
+
+    def _write_batch_files(self, rows, config: BatchConfig, path_prefix: str) -> List[str]:
+        """
+        Write one request per missing (text, language) to JSONL request files of at most `max_requests_per_batch` requests
+        """
+        paths, f, count = [], None, 0
+        try:
+            for index, text, cached, missing in rows:
+                for lang in missing:
+                    if f is None or count == config.max_requests_per_batch:
+                        if f is not None:
+                            f.close()
+                        paths.append(f'{path_prefix}_{len(paths)}.jsonl')
+                        f, count = open(paths[-1], 'w', encoding='utf-8'), 0
+                    request = batch_request(f'{index}:{lang}', self.prompt.format_messages(text=text, language=lang),
+                                            self.model_config.llm_model_name, self.model_config.temperature)
+                    f.write(json.dumps(request, ensure_ascii=False) + '\n')
+                    count += 1
+        finally:
+            if f is not None:
+                f.close()
+        return paths
+
+    def translate_batch(self, client: BatchClient, config: BatchConfig, work_dir: str,
+                        cancel_event: Optional[threading.Event] = None) -> List[Tuple[int, List[str]]]:
+        """
+        Translate the skills through the batch API of the provider: the missing translations are written to request files,
+        submitted as batches and polled until the batches finish, then merged like the answers of the other modes.
+        The batch ids are saved in `work_dir`, so that a resumed job polls the batches it already submitted.
+        Setting `cancel_event` cancels the batches and returns no results.
+        """
+        if not self.texts:
+            return []
+        # the batches are answered by the batch server, not the server of the model
+        self.base_url = config.base_url
+        rows = self._split_cached()
+        path_prefix = os.path.join(work_dir, f'batch_{self.texts[0][0]}')
+        state_path = f'{path_prefix}.json'
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                batch_ids = json.load(f)['batch_ids']
+            logger.info(f"Polling {len(batch_ids)} batches submitted before.")
+        else:
+            paths = self._write_batch_files(rows, config, path_prefix)
+            batch_ids = [client.submit(path, config.completion_window) for path in paths]
+            with open(state_path, 'w') as f:
+                json.dump({'batch_ids': batch_ids}, f)
+            for path in paths:
+                os.remove(path)
+            logger.info(f"Translating {sum(len(row[3]) for row in rows)} translations in {len(batch_ids)} batches.")
+
+        translated = defaultdict(dict)
+        pending = list(batch_ids)
+        while pending:
+            for batch_id in list(pending):
+                status, file_ids = client.status(batch_id)
+                if status not in FINAL_STATUSES:
+                    continue
+                pending.remove(batch_id)
+                if status != 'completed':
+                    logger.warning(f"Batch {batch_id} {status}.")
+                for file_id in file_ids:
+                    for custom_id, answer in parse_batch_output(client.download(file_id)):
+                        index, lang = custom_id.split(':', 1)
+                        translated[int(index)][lang] = answer
+            if pending and cancel_event is not None and cancel_event.wait(config.poll_interval):
+                for batch_id in pending:
+                    client.cancel(batch_id)
+                os.remove(state_path)
+                logger.warning("Translation cancelled.")
+                return []
+            if pending and cancel_event is None:
+                time.sleep(config.poll_interval)
+
+        results = [self._merge_result(index, text, cached, missing, [translated[index].get(lang) for lang in missing])
+                   for index, text, cached, missing in rows]
+        os.remove(state_path)
         return results
@@ -0,0 +1,36 @@
+"""
+YAML configuration files parsed once and parsed again only when they change on disk
+"""
+
+import os
+import threading
+from typing import Optional, Tuple
+
+import yaml
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class ConfigFile:
+    """
+    The parsed content of a YAML file, cached until the modification time or the size of the file changes
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._content: Optional[dict] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stamp != self._stamp:
+                with open(self.path, 'r') as f:
+                    self._content = yaml.safe_load(f)
+                if self._stamp is not None:
+                    logger.info(f'Reloaded {self.path}')
+                self._stamp = stamp
+            return self._content
@@ -10,6 +10,22 @@ from utils.logger import setup_logger
 logger = setup_logger(__name__)
 
 
+def is_empty_cell(value) -> bool:
+    """
+    Whether the raw value of a source cell is empty. A cell with the text 'nan' is not.
+    """
+    return value is None or value == '' or (not isinstance(value, str) and pd.isna(value))
+
+
+def cell_text(value) -> str:
+    """
+    The text of a source cell, as `DataReader` reads it: empty cells are 'nan'
+    """
+    if is_empty_cell(value):
+        return 'nan'
+    return str(value)
+
+
 def language_codes_to_df_column_names(df: pd.DataFrame, language_codes: List[str], pattern: str) -> List[str]:
     """
     Convert the language codes to the column names in the DataFrame
@@ -0,0 +1,12 @@
+"""
+The tests import the modules the way the API does, with `src` on the path, and the fake backend from `benchmarks`
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+os.environ.setdefault('LOG_FILE_PATH', os.path.join(tempfile.gettempdir(), 'translation_tests.log'))
@@ -0,0 +1,99 @@
+"""
+A batch job run end to end against the batch endpoints of the fake backend, interrupted after its batch
+was submitted and resumed
+"""
+
+import os
+import socket
+import time
+
+import httpx
+import pandas as pd
+import pytest
+import yaml
+
+from api.job_manager import JobManager, JobSettings, JobState
+from fake_llm_server import FakeBackendConfig, start_server
+from modules.batch_client import OpenAIBatchClient
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLUMN = 'description (to translate)'
+LANGUAGES = ['fr', 'de']
+ROWS = 25
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def backend_url():
+    return start_server(FakeBackendConfig(batch_latency=0.2), free_port())
+
+
+class InterruptedBatchClient(OpenAIBatchClient):
+    """
+    Fails the first status check, like an API process stopped after its batches were submitted
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.submitted = 0
+        self.interrupted = False
+
+    def submit(self, path, completion_window):
+        self.submitted += 1
+        return super().submit(path, completion_window)
+
+    def status(self, batch_id):
+        if not self.interrupted:
+            self.interrupted = True
+            raise RuntimeError('interrupted')
+        return super().status(batch_id)
+
+
+def settings(backend_url: str) -> JobSettings:
+    with open(os.path.join(ROOT_DIR, 'params.yaml'), 'r') as f:
+        params = yaml.safe_load(f)
+    params['parallel_processing']['mode'] = 'batch'
+    params['batch'] = {'base_url': backend_url, 'poll_interval': 0.05}
+    return JobSettings.from_params(params, {'openai': {'api_key': 'sk-test'}})
+
+
+def wait(job, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while not job.finished:
+        assert time.monotonic() < deadline, f'job {job.id} is still {job.state.value}'
+        time.sleep(0.05)
+
+
+def test_batch_job_resumes_its_submitted_batch(backend_url, tmp_path):
+    client = InterruptedBatchClient('sk-test', backend_url)
+    manager = JobManager(output_dir=str(tmp_path), batch_client=client)
+    header = ','.join(['id', f'"{COLUMN}"', *[f'{language} description' for language in LANGUAGES]])
+    rows = [f'{row},skill number {row},,' for row in range(ROWS)]
+    # an empty source cell is not sent
+    rows[3] = '3,,,'
+    content = '\n'.join([header, *rows]).encode('utf-8')
+    try:
+        job = manager.submit(content, [{'sheet': None, 'columns': [COLUMN]}], LANGUAGES, settings(backend_url), file_format='csv')
+        wait(job)
+        assert job.state == JobState.FAILED
+        # the ids of the submitted batch are kept for the resumed job
+        assert [name for name in os.listdir(job.output_dir) if name.startswith('batch_') and name.endswith('.json')]
+
+        resumed = manager.resume(job.id, 'sk-test')
+        wait(resumed)
+        assert resumed.state == JobState.COMPLETED, resumed.error
+    finally:
+        manager.shutdown()
+
+    assert client.submitted == 1
+    assert httpx.get(backend_url.replace('/v1', '/stats')).json()['batches'] == 1
+    assert not [name for name in os.listdir(resumed.output_dir) if name.startswith('batch_')]
+    output = pd.read_csv(resumed.output_path, keep_default_na=False)
+    for row in range(ROWS):
+        for language in LANGUAGES:
+            expected = '' if row == 3 else f'[{language}] skill number {row}'
+            assert output.loc[row, f'{language} description'] == expected
@@ -0,0 +1,55 @@
+"""
+The classification of the source cells that need no translation
+"""
+
+import pandas as pd
+import pytest
+
+from modules.cell_filter import EMPTY, NON_LINGUISTIC, PASS_THROUGH, TEXT, classify_cells
+
+
+def classify(text: str) -> str:
+    return classify_cells(pd.Series([text]))[0]
+
+
+@pytest.mark.parametrize('text', ['COVID-19', '3D', 'B2B', 'Q4', 'MP3-player', '4G', 'Python 3', 'Team of 5'])
+def test_terms_with_digits_are_translated(text):
+    assert classify(text) == TEXT
+
+
+@pytest.mark.parametrize('text', ['S1.2.3', 'AB-1234', 'ENG_042', 'v2.0.1', 'A1B2C3', 'X12', '12-ABC-34'])
+def test_codes_are_not_translated(text):
+    assert classify(text) == NON_LINGUISTIC
+
+
+@pytest.mark.parametrize('text', ['1234', '3.5%', '$1,200.00', '2024-01-31', '12:30', '+64 9 123 4567',
+                                  'https://example.com/a?b=1', 'www.example.com', 'jane.doe@example.co.nz'])
+def test_numbers_dates_urls_and_emails_are_not_translated(text):
+    assert classify(text) == NON_LINGUISTIC
+
+
+@pytest.mark.parametrize('text', ['1st', '2nd', '3rd', '21st', '103rd', '4th', '1er', '1re', '2e', '3ème', '2eme', '2ND'])
+def test_ordinals_are_translated(text):
+    assert classify(text) == TEXT
+
+
+@pytest.mark.parametrize('text', ['-', '...', '!?', '→'])
+def test_text_without_letters_is_passed_through(text):
+    assert classify(text) == PASS_THROUGH
+
+
+def test_empty_cells_come_from_the_raw_values():
+    texts = pd.Series(['nan', 'NaN', 'Nan', 'NaT', '  ', 'nan'], index=[10, 11, 12, 13, 14, 15])
+    empty = pd.Series([True, False, False, False, False, False], index=texts.index)
+    assert list(classify_cells(texts, empty)) == [EMPTY, TEXT, TEXT, TEXT, EMPTY, TEXT]
+
+
+def test_empty_flags_are_aligned_on_the_index():
+    texts = pd.Series(['first', 'nan'], index=[5, 6])
+    # flags of other rows, e.g. of a whole column when only a chunk is classified, are ignored
+    empty = pd.Series([False, True, True], index=[4, 6, 7])
+    assert list(classify_cells(texts, empty)) == [TEXT, EMPTY]
+
+
+def test_empty_text_without_flags_is_empty():
+    assert list(classify_cells(pd.Series(['nan', 'NaN', '', 'text']))) == [EMPTY, TEXT, EMPTY, TEXT]
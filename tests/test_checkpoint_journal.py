@@ -0,0 +1,84 @@
+"""
+The checkpoint journal of the finished translations of a job
+"""
+
+import json
+
+from modules.checkpoint_journal import CheckpointJournal
+
+
+def write(path, content: bytes):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def line(unit: int, translations: dict) -> bytes:
+    return (json.dumps({'unit': unit, 'translations': translations}) + '\n').encode('utf-8')
+
+
+def test_records_are_reloaded(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    journal = CheckpointJournal(path)
+    journal.record(0, {'fr': 'bonjour', 'de': 'hallo'})
+    journal.record(1, {'fr': 'monde'})
+    journal.record(1, {'de': 'Welt'})
+    journal.close()
+    assert CheckpointJournal.load(path) == {0: {'fr': 'bonjour', 'de': 'hallo'}, 1: {'fr': 'monde', 'de': 'Welt'}}
+
+
+def test_failed_translations_are_not_recorded(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    journal = CheckpointJournal(path)
+    journal.record(0, {'fr': '', 'de': None})
+    journal.record(1, {'fr': 'monde', 'de': ''})
+    journal.close()
+    assert CheckpointJournal.load(path) == {1: {'fr': 'monde'}}
+
+
+def test_missing_journal_is_empty(tmp_path):
+    assert CheckpointJournal.load(str(tmp_path / 'checkpoint.jsonl')) == {}
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    write(path, line(0, {'fr': 'bonjour'}) + b'{"unit": 1, "transl')
+    assert CheckpointJournal.load(path) == {0: {'fr': 'bonjour'}}
+
+
+def test_torn_last_line_is_truncated_before_appending(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    write(path, line(0, {'fr': 'bonjour'}) + b'{"unit": 1, "transl')
+    journal = CheckpointJournal(path)
+    journal.record(2, {'fr': 'monde'})
+    journal.close()
+    with open(path, 'rb') as f:
+        assert f.read() == line(0, {'fr': 'bonjour'}) + line(2, {'fr': 'monde'})
+    assert CheckpointJournal.load(path) == {0: {'fr': 'bonjour'}, 2: {'fr': 'monde'}}
+
+
+def test_long_torn_line_is_truncated(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    # longer than the blocks the end of the last complete line is searched in
+    write(path, line(0, {'fr': 'bonjour'}) + b'{"unit": 1, "translations": {"fr": "' + b'x' * 10000)
+    journal = CheckpointJournal(path)
+    journal.record(2, {'fr': 'monde'})
+    journal.close()
+    assert CheckpointJournal.load(path) == {0: {'fr': 'bonjour'}, 2: {'fr': 'monde'}}
+
+
+def test_journal_of_a_torn_line_only_is_emptied(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    write(path, b'{"unit": 1, "transl')
+    journal = CheckpointJournal(path)
+    journal.record(2, {'fr': 'monde'})
+    journal.close()
+    assert CheckpointJournal.load(path) == {2: {'fr': 'monde'}}
+
+
+def test_complete_journal_is_appended_to(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    write(path, line(0, {'fr': 'bonjour'}))
+    journal = CheckpointJournal(path)
+    journal.record(1, {'fr': 'monde'})
+    journal.close()
+    assert CheckpointJournal.load(path) == {0: {'fr': 'bonjour'}, 1: {'fr': 'monde'}}
@@ -0,0 +1,127 @@
+"""
+The download of the output files with Range and ETag support
+"""
+
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+import pytest
+
+from api import file_download
+from api.file_download import file_response, parse_range
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes=900-5000', (900, 999)),
+    ('bytes=10-19, 30-39', (10, 19)),
+    ('bytes=1000-', None),
+    ('bytes=20-10', None),
+    ('bytes=-0', None),
+    ('bytes=-', None),
+    ('items=0-10', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # chunks smaller than the file, so that the body is streamed in several chunks
+    monkeypatch.setattr(file_download, 'DOWNLOAD_CHUNK_SIZE', 1000)
+    path = str(tmp_path / 'translated_combined.xlsx')
+    with open(path, 'wb') as f:
+        f.write(CONTENT)
+    app = FastAPI()
+
+    @app.get('/download')
+    def download(request: Request):
+        return file_response(path, request)
+
+    return TestClient(app)
+
+
+def test_whole_file(client):
+    response = client.get('/download')
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers['content-length'] == str(len(CONTENT))
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert 'filename="translated_combined.xlsx"' in response.headers['content-disposition']
+
+
+def test_single_range(client):
+    response = client.get('/download', headers={'Range': 'bytes=1500-2999'})
+    assert response.status_code == 206
+    assert response.content == CONTENT[1500:3000]
+    assert response.headers['content-range'] == f'bytes 1500-2999/{len(CONTENT)}'
+    assert response.headers['content-length'] == '1500'
+
+
+def test_suffix_range(client):
+    response = client.get('/download', headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206
+    assert response.content == CONTENT[-10:]
+
+
+def test_open_ended_range(client):
+    response = client.get('/download', headers={'Range': 'bytes=10000-'})
+    assert response.status_code == 206
+    assert response.content == CONTENT[10000:]
+
+
+def test_unsatisfiable_range(client):
+    response = client.get('/download', headers={'Range': f'bytes={len(CONTENT)}-'})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_current_etag_is_not_modified(client):
+    etag = client.get('/download').headers['etag']
+    response = client.get('/download', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert client.get('/download', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_range_of_another_version_gets_the_whole_file(client):
+    etag = client.get('/download').headers['etag']
+    assert client.get('/download', headers={'Range': 'bytes=0-9', 'If-Range': etag}).status_code == 206
+    response = client.get('/download', headers={'Range': 'bytes=0-9', 'If-Range': '"old"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_etag_changes_with_the_file(client, tmp_path):
+    etag = client.get('/download').headers['etag']
+    path = str(tmp_path / 'translated_combined.xlsx')
+    with open(path, 'ab') as f:
+        f.write(b'more')
+    os.utime(path, ns=(0, 1))
+    assert client.get('/download', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_only_the_translated_file_of_a_job_is_served(tmp_path):
+    from api.job_manager import JobManager
+
+    job_id = 'a' * 32
+    job_dir = tmp_path / job_id
+    job_dir.mkdir()
+    (job_dir / 'job.json').write_text('{"file_format": "csv"}')
+    (job_dir / 'input.csv').write_text('source')
+    manager = JobManager(output_dir=str(tmp_path))
+    try:
+        # a job of a previous API process, not translated yet
+        assert manager.result_path(job_id) is None
+        (job_dir / 'translated_combined.csv').write_text('translated')
+        assert manager.result_path(job_id) == str(job_dir / 'translated_combined.csv')
+        assert manager.result_path('b' * 32) is None
+        assert manager.result_path('..') is None
+    finally:
+        manager.shutdown()
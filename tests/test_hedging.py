@@ -0,0 +1,54 @@
+"""
+Hedged requests of the synchronous chains
+"""
+
+import threading
+import time
+
+from langchain_core.runnables import RunnableLambda
+
+from modules import tracing
+from modules.hedging import Hedger, HedgingConfig
+
+
+def hedger() -> Hedger:
+    hedger = Hedger(HedgingConfig(min_samples=1, min_delay=0.05, max_hedge_ratio=1))
+    hedger.latencies.observe(0.01)
+    return hedger
+
+
+def test_attempts_keep_the_trace_tags_of_the_caller():
+    tags = []
+    lock = threading.Lock()
+
+    def request(inputs):
+        with lock:
+            tags.append(tracing._tags.get())
+            first = len(tags) == 1
+        # the first attempt is slow, so that it is hedged
+        time.sleep(0.5 if first else 0.01)
+        return 'answer'
+
+    chain = hedger().wrap(RunnableLambda(request))
+    token = tracing._tags.set({'job': 'job-1', 'unit': 3})
+    try:
+        assert chain.invoke({}) == 'answer'
+    finally:
+        tracing._tags.reset(token)
+    assert tags == [{'job': 'job-1', 'unit': 3}, {'job': 'job-1', 'unit': 3}]
+
+
+def test_successful_attempt_wins_over_a_failed_one():
+    calls = []
+
+    def request(inputs):
+        calls.append(len(calls))
+        if len(calls) == 1:
+            time.sleep(0.2)
+            return 'slow answer'
+        raise RuntimeError('hedge failed')
+
+    wrapped = hedger()
+    assert wrapped.wrap(RunnableLambda(request)).invoke({}) == 'slow answer'
+    assert wrapped.stats()['hedges'] == 1
+    assert wrapped.stats()['hedges_won'] == 0
@@ -0,0 +1,104 @@
+"""
+The carry-over of the translations of a previous version of a file to the rows that did not change
+"""
+
+import os
+
+import pandas as pd
+
+from modules.row_diff import Baseline, Fingerprint
+
+COLUMN = 'description (to translate)'
+LANGUAGES = ['fr', 'de']
+
+
+def previous_output(tmp_path, rows) -> str:
+    path = str(tmp_path / 'previous.csv')
+    pd.DataFrame(rows, columns=[COLUMN, 'fr description', 'de description']).to_csv(path, index=False)
+    return path
+
+
+def from_output(tmp_path, rows, chunk_size=2) -> Baseline:
+    return Baseline.from_output(previous_output(tmp_path, rows), 'csv', {None: {COLUMN: 'description'}}, LANGUAGES,
+                                chunk_size=chunk_size, store_dir=str(tmp_path))
+
+
+def source(texts) -> pd.Series:
+    # the rows of a CSV file are numbered from 2, after the header
+    return pd.Series(texts, index=range(2, 2 + len(texts)))
+
+
+def no_targets(series: pd.Series) -> pd.DataFrame:
+    return pd.DataFrame({language_code: '' for language_code in LANGUAGES}, index=series.index)
+
+
+def test_unchanged_rows_keep_their_translations(tmp_path):
+    baseline = from_output(tmp_path, [['one', 'un', 'eins'], ['two', 'deux', 'zwei'], ['three', 'trois', 'drei']])
+    series = source(['one', 'TWO', 'three'])
+    assert baseline.carry_over(None, COLUMN, series, no_targets(series)) == {2: ['un', 'eins'], 4: ['trois', 'drei']}
+    baseline.close()
+
+
+def test_moved_rows_take_the_translations_of_the_same_text(tmp_path):
+    baseline = from_output(tmp_path, [['one', 'un', None], ['two', 'deux', 'zwei'], ['one', None, 'eins']])
+    series = source(['new', 'one', 'two', 'other'])
+    # the first translation of every language, also when it comes from another row with the same text
+    assert baseline.carry_over(None, COLUMN, series, no_targets(series)) == {3: ['un', 'eins'], 4: ['deux', 'zwei']}
+    baseline.close()
+
+
+def test_missing_translations_are_none(tmp_path):
+    baseline = from_output(tmp_path, [['one', 'un', None]])
+    series = source(['one'])
+    assert baseline.carry_over(None, COLUMN, series, no_targets(series)) == {2: ['un', None]}
+    baseline.close()
+
+
+def test_languages_without_target_column_are_left_empty(tmp_path):
+    baseline = from_output(tmp_path, [['one', 'un', 'eins']])
+    series = source(['one'])
+    targets = pd.DataFrame({'fr': ['']}, index=series.index)
+    assert baseline.carry_over(None, COLUMN, series, targets) == {2: ['un', '']}
+    baseline.close()
+
+
+def test_carry_over_per_chunk_matches_the_whole_column(tmp_path):
+    rows = [[f'text {i % 7}', f'fr {i}', f'de {i}'] for i in range(40)]
+    baseline = from_output(tmp_path, rows, chunk_size=6)
+    series = source([f'text {i % 9}' for i in range(45)])
+    whole = baseline.carry_over(None, COLUMN, series, no_targets(series))
+    chunked = {}
+    for start in range(0, len(series), 10):
+        chunk = series.iloc[start:start + 10]
+        chunked.update(baseline.carry_over(None, COLUMN, chunk, no_targets(chunk)))
+    assert chunked == whole
+    # every row but the ones of `text 7` and `text 8`, which the previous output does not have
+    assert len(whole) == 35
+    baseline.close()
+
+
+def test_unknown_columns_carry_nothing(tmp_path):
+    baseline = from_output(tmp_path, [['one', 'un', 'eins']])
+    series = source(['one'])
+    assert baseline.carry_over(None, 'other (to translate)', series, no_targets(series)) == {}
+    assert baseline.carry_over('Sheet1', COLUMN, series, no_targets(series)) == {}
+    baseline.close()
+
+
+def test_close_deletes_the_stored_translations(tmp_path):
+    baseline = from_output(tmp_path, [['one', 'un', 'eins']])
+    baseline.close()
+    assert os.listdir(tmp_path) == ['previous.csv']
+
+
+def test_fingerprint_keeps_the_targets_of_the_unchanged_rows(tmp_path):
+    fingerprint = Fingerprint()
+    fingerprint.add(None, COLUMN, source(['one', 'two']))
+    fingerprint.add(None, COLUMN, pd.Series(['three'], index=[4]))
+    path = str(tmp_path / 'fingerprint.json')
+    fingerprint.save(path)
+    baseline = Baseline.from_fingerprint(path, LANGUAGES)
+    series = source(['one', 'changed', 'three'])
+    targets = pd.DataFrame({'fr': ['un', 'deux', 'trois'], 'de': ['eins', 'zwei', '']}, index=series.index)
+    assert baseline.carry_over(None, COLUMN, series, targets) == {2: ['un', 'eins'], 4: ['trois', None]}
+    baseline.close()
@@ -0,0 +1,47 @@
+"""
+The chunked reading and writing of streamed files
+"""
+
+import pandas as pd
+
+from modules.streaming_io import ChunkWriter, read_chunks, read_header
+
+
+def test_csv_without_rows_gets_an_output_with_its_header(tmp_path):
+    source = tmp_path / 'input.csv'
+    source.write_text('id,description (to translate),fr description\n')
+    output = str(tmp_path / 'output.csv')
+    writer = ChunkWriter(output, 'csv', read_header(str(source), 'csv'))
+    writer.close()
+    with open(output) as f:
+        assert f.read() == 'id,description (to translate),fr description\n'
+
+
+def test_jsonl_without_records_gets_an_empty_output(tmp_path):
+    output = tmp_path / 'output.jsonl'
+    ChunkWriter(str(output), 'jsonl').close()
+    assert output.read_text() == ''
+
+
+def test_csv_chunks_are_appended_under_the_header(tmp_path):
+    source = tmp_path / 'input.csv'
+    source.write_text('id,text\n1,one\n2,two\n3,three\n')
+    output = str(tmp_path / 'output.csv')
+    writer = ChunkWriter(output, 'csv', read_header(str(source), 'csv'))
+    chunks = list(read_chunks(str(source), 'csv', 2))
+    assert [chunk.index.tolist() for _, chunk in chunks] == [[2, 3], [4]]
+    for sheet, chunk in chunks:
+        writer.write(chunk, sheet)
+    writer.close()
+    pd.testing.assert_frame_equal(pd.read_csv(output, dtype=str), pd.read_csv(source, dtype=str))
+
+
+def test_jsonl_chunks_are_appended(tmp_path):
+    source = tmp_path / 'input.jsonl'
+    source.write_text('{"id": 1, "text": "one"}\n{"id": 2, "text": "two"}\n{"id": 3, "text": "three"}\n')
+    output = tmp_path / 'output.jsonl'
+    writer = ChunkWriter(str(output), 'jsonl', read_header(str(source), 'jsonl'))
+    for sheet, chunk in read_chunks(str(source), 'jsonl', 2):
+        writer.write(chunk, sheet)
+    writer.close()
+    pd.testing.assert_frame_equal(pd.read_json(output, lines=True), pd.read_json(source, lines=True))
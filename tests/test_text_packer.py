@@ -0,0 +1,87 @@
+"""
+The packing of several texts into one JSON request and the parsing of the responses
+"""
+
+import json
+
+import pytest
+
+from modules import text_packer
+from modules.text_packer import (PackedResponseError, PackingConfig, pack_texts, packed_payload, parse_json_object,
+                                 parse_languages_response, parse_packed_response)
+from services import packed_text_translate
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(text_packer, 'count_tokens', lambda text, model_name: len(text.split()))
+
+
+def test_packs_stay_under_the_token_budget(word_tokens):
+    texts = ['one two', 'three four five', 'six', 'seven eight nine ten eleven twelve', 'thirteen']
+    assert pack_texts(texts, PackingConfig(max_pack_tokens=5, max_pack_items=10), 'gpt-4o') == [[0, 1], [2], [3], [4]]
+
+
+def test_packs_stay_under_the_item_limit(word_tokens):
+    assert pack_texts(['a'] * 5, PackingConfig(max_pack_tokens=100, max_pack_items=2), 'gpt-4o') == [[0, 1], [2, 3], [4]]
+
+
+def test_payload_numbers_the_texts():
+    assert json.loads(packed_payload(['un', 'deux'])) == {'0': 'un', '1': 'deux'}
+
+
+def test_code_fence_is_tolerated():
+    assert parse_json_object('```json\n{"0": "un"}\n```') == {'0': 'un'}
+
+
+@pytest.mark.parametrize('response', ['not json', '["un", "deux"]', ''])
+def test_malformed_response_is_an_error(response):
+    with pytest.raises(PackedResponseError):
+        parse_json_object(response)
+
+
+def test_missing_and_invalid_items_are_none():
+    response = json.dumps({'0': 'un', '2': 3, '3': '  ', '4': 'cinq', 'extra': 'x'})
+    assert parse_packed_response(response, 5) == ['un', None, None, None, 'cinq']
+
+
+def test_languages_response_is_read_by_language_code():
+    assert parse_languages_response('{"de": "eins", "fr": "un"}', ['fr', 'es', 'de']) == ['un', None, 'eins']
+
+
+class FakeChain:
+    """
+    Answers the packs of at most `max_size` texts, and leaves out the texts in `dropped` the first time it sees them
+    """
+    def __init__(self, max_size: int, dropped=()):
+        self.max_size = max_size
+        self.dropped = set(dropped)
+        self.requests = []
+
+    def invoke(self, inputs: dict):
+        texts = json.loads(inputs['texts'])
+        self.requests.append(list(texts.values()))
+        if len(texts) > self.max_size:
+            return 'Sorry, that is too much text.'
+        answer = {key: f"[{inputs['language']}] {text}" for key, text in texts.items() if text not in self.dropped}
+        self.dropped -= set(texts.values())
+        return json.dumps(answer)
+
+
+def test_malformed_response_is_split_in_halves():
+    texts = [f'text {i}' for i in range(5)]
+    chain = FakeChain(max_size=2)
+    assert packed_text_translate(chain, texts, 'fr', delay=0) == [f'[fr] {text}' for text in texts]
+    assert chain.requests == [texts, texts[:2], texts[2:], texts[2:3], texts[3:]]
+
+
+def test_missing_items_are_requested_again():
+    texts = [f'text {i}' for i in range(4)]
+    chain = FakeChain(max_size=10, dropped=['text 1', 'text 3'])
+    assert packed_text_translate(chain, texts, 'fr', delay=0) == [f'[fr] {text}' for text in texts]
+    assert chain.requests == [texts, ['text 1', 'text 3']]
+
+
+def test_text_that_keeps_failing_is_none():
+    chain = FakeChain(max_size=0)
+    assert packed_text_translate(chain, ['a', 'b', 'c'], 'fr', delay=0) == [None, None, None]
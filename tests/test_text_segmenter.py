@@ -0,0 +1,69 @@
+"""
+The split of long texts into segments and the join of their translations
+"""
+
+import pytest
+
+from modules import text_segmenter
+from modules.text_segmenter import TextSegmenter, join_segments
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # one token per word, so that the tests do not depend on the tokenizer
+    monkeypatch.setattr(text_segmenter, 'count_tokens', lambda text, model_name: len(text.split()))
+
+
+def sentence(words: int, mark: str = '.') -> str:
+    return ' '.join(f'word{i}' for i in range(words)) + mark
+
+
+def round_trip(text: str, max_tokens: int):
+    result = TextSegmenter(max_tokens, 'gpt-4o').split(text)
+    assert result is not None
+    segments, separators = result
+    assert len(separators) == len(segments) + 1
+    assert join_segments(segments, separators) == text
+    return segments, separators
+
+
+def test_short_text_is_not_split():
+    assert TextSegmenter(10, 'gpt-4o').split(sentence(8)) is None
+
+
+def test_paragraphs_are_split_and_joined_back():
+    text = '\n\n'.join([sentence(6), sentence(6), sentence(6)])
+    segments, separators = round_trip(text, 10)
+    assert segments == [sentence(6), sentence(6), sentence(6)]
+    assert separators == ['', '\n\n', '\n\n', '']
+
+
+def test_pieces_are_merged_up_to_the_threshold():
+    text = '\n\n'.join([sentence(3), sentence(3), sentence(3), sentence(3)])
+    segments, _ = round_trip(text, 7)
+    assert segments == [f'{sentence(3)}\n\n{sentence(3)}', f'{sentence(3)}\n\n{sentence(3)}']
+
+
+def test_long_paragraphs_are_split_at_lines_then_sentences():
+    paragraph = f'{sentence(6)} {sentence(6, "!")}\n{sentence(6, "?")}'
+    text = f'  {paragraph}\n\n  {sentence(4)}\n'
+    segments, separators = round_trip(text, 8)
+    assert segments == [sentence(6), sentence(6, '!'), sentence(6, '?'), sentence(4)]
+    # the whitespace around the text and between the pieces is kept as it is
+    assert separators == ['  ', ' ', '\n', '\n\n  ', '\n']
+    assert all(len(segment.split()) <= 8 for segment in segments)
+
+
+def test_sentence_over_the_threshold_stays_whole():
+    text = f'{sentence(12)} {sentence(2)}'
+    segments, _ = round_trip(text, 5)
+    assert segments == [sentence(12), sentence(2)]
+
+
+def test_translations_are_joined_with_the_original_whitespace():
+    assert join_segments([' un. ', 'deux.\n'], ['\n', '\n\n', ' ']) == '\nun.\n\ndeux. '
+
+
+def test_join_fails_when_a_segment_failed():
+    assert join_segments(['un.', None], ['', ' ', '']) is None
+    assert join_segments(['un.', ''], ['', ' ', '']) is None